@@ -1,16 +1,23 @@
 # at_cog.py (修改后)
 import asyncio
+import contextlib
 import time
-from typing import List, TYPE_CHECKING, Optional, Dict, Any
+from typing import Collection, List, TYPE_CHECKING, Optional, Dict, Sequence
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
 from config_data import GUILD_CONFIGS
+from at.delivery_planner import (
+    STRATEGY_DIRECT, STRATEGY_TEMP_ROLE, DeliveryPlanner, DirectMentionBlocked, chunk_mentions, is_delivery_blocked
+)
+from at.mention_matrix import MentionMatrix
+from at.notification_jobs import JobCallback, NotificationJob, NotificationJobQueue
+from at.role_assigner import BulkRoleAssigner
+from at.thread_member_index import ThreadMemberIndex
 from utility.permison import is_admin
-# 导入新的异步辅助函数来获取虚拟组配置
-from virtual_role.virtual_role_helper import get_virtual_role_configs_for_guild
+from virtual_role.virtual_role_config_manager import VirtualRoleConfigManager
 
 if TYPE_CHECKING:
     from virtual_role.virtual_role_cog import VirtualRoleCog
@@ -23,6 +30,40 @@ class AtCog(commands.Cog):
     def __init__(self, bot: 'NewsBot'):
         self.bot = bot
         self.virtual_role_cog: Optional['VirtualRoleCog'] = None
+        self.config_manager = VirtualRoleConfigManager()
+        self.role_assigner = BulkRoleAssigner(bot)
+        self.delivery_planner = DeliveryPlanner(bot)
+        self.job_queue = NotificationJobQueue(self)
+        self.thread_members = ThreadMemberIndex()
+        # { guild_id: MentionMatrix }
+        self._mention_matrices: Dict[int, MentionMatrix] = {}
+        # { role_id: Lock }，避免同一影子身份组的并发通知互相恢复对方的可提及状态
+        self._shadow_ping_locks: Dict[int, asyncio.Lock] = {}
+
+    async def cog_load(self):
+        self.job_queue.start()
+
+    async def cog_unload(self):
+        self.job_queue.stop()
+
+    # --- 子区成员索引的网关事件 ---
+
+    @commands.Cog.listener()
+    async def on_thread_member_join(self, member: discord.ThreadMember):
+        self.thread_members.on_member_join(member)
+
+    @commands.Cog.listener()
+    async def on_raw_thread_member_remove(self, payload: discord.RawThreadMembersUpdate):
+        self.thread_members.on_members_removed(payload)
+
+    @commands.Cog.listener()
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
+        self.thread_members.discard(payload.thread_id)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # 新会话可能错过了断线期间的成员变动
+        self.thread_members.clear()
 
     def _get_virtual_role_cog(self) -> Optional['VirtualRoleCog']:
         """延迟获取VirtualRoleCog实例，确保它已经被加载。"""
@@ -30,53 +71,119 @@ class AtCog(commands.Cog):
             self.virtual_role_cog = self.bot.get_cog('VirtualRoleCog')
         return self.virtual_role_cog
 
-    async def _get_combined_mention_map(self, guild_id: int) -> Dict[str, Any]:
+    def _get_mention_matrix(self, guild_id: int) -> MentionMatrix:
         """
-        将硬编码的真实身份组配置和动态的虚拟身份组配置合并成一个字典。
-        这是此 Cog 的核心数据源。
+        获取服务器编译后的提及权限矩阵。
+        它合并了硬编码的真实身份组配置和动态的虚拟身份组配置，是此 Cog 的核心数据源；
+        只有虚拟组配置的版本号变化时才会重建。
         """
-        # 1. 从 GUILD_CONFIGS 获取真实身份组的配置
-        guild_config = GUILD_CONFIGS.get(guild_id, {})
-        # 使用 .copy() 以免修改原始配置
-        mention_map = guild_config.get("at_config", {}).get("mention_map", {}).copy()
-
-        # 2. 从新的 Config Manager 获取虚拟身份组的配置
-        virtual_roles = await get_virtual_role_configs_for_guild(guild_id)
-
-        # 3. 将虚拟组配置合并到主 mention_map 中
-        for key, config in virtual_roles.items():
-            # 为虚拟组配置添加 'type' 字段，以便后续逻辑判断
-            virtual_config_with_type = config.copy()
-            virtual_config_with_type['type'] = 'virtual'
-            mention_map[key] = virtual_config_with_type
-
-        return mention_map
+        version = self.config_manager.get_guild_version(guild_id)
+        matrix = self._mention_matrices.get(guild_id)
+        if matrix is None or matrix.version != version:
+            # 1. 从 GUILD_CONFIGS 获取真实身份组的配置
+            mention_map = GUILD_CONFIGS.get(guild_id, {}).get("at_config", {}).get("mention_map", {})
+            # 2. 从 Config Manager 获取虚拟身份组的配置 (只读视图，无需加锁)
+            virtual_roles = self.config_manager.get_guild_roles_view(guild_id)
+            matrix = self._mention_matrices[guild_id] = MentionMatrix.compile(version, mention_map, virtual_roles)
+        return matrix
 
     async def can_user_mention(self, interaction: discord.Interaction, target_key: str) -> bool:
         if not interaction.guild: return False
+        return self._get_mention_matrix(interaction.guild.id).can_mention(interaction.user, interaction.guild, target_key)
 
-        # 使用新的合并后的配置
-        mention_map = await self._get_combined_mention_map(interaction.guild.id)
-        target_config = mention_map.get(target_key)
-
-        if not target_config: return False
-        if interaction.user.id == interaction.guild.owner_id: return True
+    @staticmethod
+    async def send_role_ping(
+            channel: discord.abc.Messageable,
+            roles: Sequence[discord.Role],
+            target_name: str,
+            message: Optional[str],
+            ghost_ping: bool,
+            requester_name: str
+    ) -> str:
+        """
+        在频道中用一条消息提及一个或多个身份组 (可提及状态由调用方负责)，返回用于结果提示的动词。
+        同时属于多个身份组的成员只会收到一次通知。
+        """
+        # 准备最终的通知内容
+        final_content = " ".join(role.mention for role in roles)
+        final_embed = None
+        if message:
+            final_embed = discord.Embed(
+                title=f"通知: {target_name}",
+                description=message,
+                color=discord.Color.purple() if ghost_ping else discord.Color.blue()
+            )
+            final_embed.set_footer(text=f"由 {requester_name} 发送")
 
-        # 兼容旧配置，如果 interaction.user 是服务器所有者，则始终允许
-        if isinstance(interaction.user, discord.Member) and interaction.user.guild_permissions.administrator:
-            return True
+        sent_message = await channel.send(
+            content=final_content,
+            embed=final_embed,
+            allowed_mentions=discord.AllowedMentions(roles=True)
+        )
 
-        # allowed_by_roles 的逻辑对两种类型都适用
-        allowed_roles_ids_str = target_config.get("allowed_by_roles", [])
-        if not allowed_roles_ids_str: return False
+        # 根据 ghost_ping 处理消息
+        if ghost_ping:
+            await asyncio.sleep(2)  # 给予客户端足够的时间来接收和处理通知
 
-        # 将字符串ID转换为整数集合
-        allowed_roles_ids = {int(role_id) for role_id in allowed_roles_ids_str}
-        user_role_ids = {role.id for role in interaction.user.roles}
+            # 构建编辑后的、无提及效果的内容
+            edited_content = f"**To:** `@{target_name}`"  # 更清晰地表明目标群体
 
-        return not user_role_ids.isdisjoint(allowed_roles_ids)
+            # 编辑消息，移除提及
+            await sent_message.edit(
+                content=edited_content,
+                allowed_mentions=discord.AllowedMentions.none()  # 关键！禁止任何提及
+            )
+            return "发送了幽灵提及"
+        return "发送了提及"
 
-    async def perform_temp_role_ping(
+    async def ping_virtual_group(
+            self,
+            interaction: discord.Interaction,
+            role_keys: Sequence[str],
+            user_ids: Collection[int],
+            target_name: str,
+            message: Optional[str],
+            ghost_ping: bool
+    ) -> str:
+        """
+        提及一个或多个虚拟组的订阅者 (user_ids 应为已去重的并集)，只投递一次。
+        由投递规划器在直接提及、影子身份组 (所有组的影子身份组都已同步时) 和临时身份组之间
+        选择预计成本最低的方式，并记录实际耗时。
+        直接提及被 AutoMod 拦截或缺少权限时记为失败，尚未收到提及的成员改用临时身份组通知。
+        返回实际使用的投递策略，STRATEGY_TEMP_ROLE 表示通知只是加入了后台队列，尚未送达。
+        """
+        user_ids = list(user_ids)
+        vr_cog = self._get_virtual_role_cog()
+        shadow_manager = vr_cog.shadow_roles if vr_cog else None
+        shadow_roles = None
+        if shadow_manager:
+            ready = [shadow_manager.get_ready_role(interaction.guild, role_key) for role_key in role_keys]
+            if all(role is not None for role in ready):
+                shadow_roles = ready
+
+        plan = self.delivery_planner.plan(interaction.channel, interaction.guild, user_ids, shadow_roles, ghost_ping)[0]
+        if plan.strategy == STRATEGY_TEMP_ROLE:
+            # 临时身份组方案在后台任务中执行，完成时再记录耗时
+            await self.perform_temp_role_ping(
+                interaction, user_ids, target_name, message, ghost_ping,
+                on_complete=lambda job, elapsed: self.delivery_planner.record(plan, len(user_ids), elapsed)
+            )
+            return plan.strategy
+
+        started = time.monotonic()
+        if plan.strategy == STRATEGY_DIRECT:
+            try:
+                await self.perform_direct_mention_ping(interaction, user_ids, target_name, message, ghost_ping)
+            except DirectMentionBlocked as e:
+                self.delivery_planner.record_failure(plan, interaction.guild.id, e.error)
+                await self.perform_temp_role_ping(interaction, e.remaining_user_ids, target_name, message, ghost_ping)
+                return STRATEGY_TEMP_ROLE
+        else:
+            await self.perform_shadow_role_ping(interaction, shadow_roles, len(user_ids), target_name, message, ghost_ping)
+        self.delivery_planner.record(plan, len(user_ids), time.monotonic() - started)
+        return plan.strategy
+
+    async def perform_direct_mention_ping(
             self,
             interaction: discord.Interaction,
             user_ids: List[int],
@@ -85,131 +192,125 @@ class AtCog(commands.Cog):
             ghost_ping: bool
     ) -> None:
         """
-        【新】使用临时身份组执行大规模提及，避免速率限制，并提供进度反馈。
-
-        1.  创建一个临时的、不可见的身份组。
-        2.  向用户显示一个"正在处理"的进度条 Embed。
-        3.  将所有目标用户添加到该身份组，并实时更新进度条。
-        4.  使身份组可提及，发送通知。
-        5.  如果 ghost_ping 为 True，删除通知消息。
-        6.  清理：删除临时身份组。
+        把成员提及直接打包进若干条消息发送，适合小规模的组，不需要任何身份组操作。
+        某条消息被拦截时清理已发出的消息 (幽灵提及时) 并抛出 DirectMentionBlocked。
         """
-        guild = interaction.guild
-        if not guild.me.guild_permissions.manage_roles:
-            raise app_commands.MissingPermissions(['manage_roles'])
-
-        temp_role = None
-        try:
-            # 1. 创建临时身份组
-            temp_role = await guild.create_role(
-                name=f"通知-{target_name}-{int(time.time())}",
-                permissions=discord.Permissions.none(),
-                mentionable=False,
-                reason=f"为 {interaction.user} 的通知命令创建的临时通知组"
-            )
-
-            # 2. 发送初始进度 Embed
-            progress_embed = discord.Embed(
-                title=f"🚀 正在准备通知: {target_name}",
-                description="正在将成员添加到临时身份组...",
-                color=discord.Color.blurple()
+        final_embed = None
+        if message:
+            final_embed = discord.Embed(
+                title=f"通知: {target_name}",
+                description=message,
+                color=discord.Color.purple() if ghost_ping else discord.Color.blue()
             )
-            total_users = len(user_ids)
-            progress_embed.add_field(name="进度", value="`[          ]` 0%", inline=False)
-            progress_embed.set_footer(text="请稍候，此过程可能需要一些时间...")
-            await interaction.edit_original_response(embed=progress_embed)
-
-            # 3. 添加成员并更新进度
-            added_count = 0
-            skipped_count = 0
-            last_update_time = time.time()
-
-            for i, user_id in enumerate(user_ids):
-                member = guild.get_member(user_id)
-                if member:
-                    try:
-                        await member.add_roles(temp_role, reason="临时通知")
-                        added_count += 1
-                    except discord.Forbidden:
-                        # 如果无法向某个特定成员添加角色（例如，机器人角色层级低于该成员），则跳过
-                        skipped_count += 1
-                    except discord.HTTPException:
-                        # 处理其他可能的API错误
-                        skipped_count += 1
-                else:
-                    skipped_count += 1
-
-                # 更新进度条，避免过于频繁地编辑消息
-                current_time = time.time()
-                if current_time - last_update_time > 1.5 or (i + 1) == total_users:
-                    percentage = (i + 1) / total_users
-                    bar = '█' * int(percentage * 10) + ' ' * (10 - int(percentage * 10))
-                    progress_embed.set_field_at(
-                        0,
-                        name="进度",
-                        value=f"`[{bar}]` {int(percentage * 100)}%\n"
-                              f"已处理: {i + 1}/{total_users} (成功: {added_count}, 跳过: {skipped_count})",
-                        inline=False
-                    )
-                    await interaction.edit_original_response(embed=progress_embed)
-                    last_update_time = current_time
-
-            # 准备最终的通知内容
-            final_content = temp_role.mention
-            final_embed = None
-            if message:
-                final_embed = discord.Embed(
-                    title=f"通知: {target_name}",
-                    description=message,
-                    color=discord.Color.purple() if ghost_ping else discord.Color.blue()
+            final_embed.set_footer(text=f"由 {interaction.user.display_name} 发送")
+
+        chunks = chunk_mentions(user_ids)
+        sent_messages = []
+        delivered = 0
+        for i, content in enumerate(chunks):
+            try:
+                sent_messages.append(await interaction.channel.send(
+                    content=content,
+                    embed=final_embed if i == len(chunks) - 1 else None,
+                    allowed_mentions=discord.AllowedMentions(users=True, roles=False, everyone=False)
+                ))
+            except discord.HTTPException as e:
+                if not is_delivery_blocked(e):
+                    raise
+                if ghost_ping:
+                    for sent_message in sent_messages:
+                        with contextlib.suppress(discord.HTTPException):
+                            await sent_message.delete()
+                raise DirectMentionBlocked(user_ids[delivered:], e) from e
+            # chunk_mentions 按顺序打包，每条消息的提及数即为已送达的人数
+            delivered += content.count("<@")
+
+        if ghost_ping:
+            await asyncio.sleep(2)  # 给予客户端足够的时间来接收和处理通知
+            # 附带 Embed 的最后一条消息保留为目标说明，其余的删除
+            *extra_messages, last_message = sent_messages
+            await last_message.edit(content=f"**To:** `@{target_name}`", allowed_mentions=discord.AllowedMentions.none())
+            for sent_message in extra_messages:
+                await sent_message.delete()
+            final_response_verb = "发送了幽灵提及"
+        else:
+            final_response_verb = "发送了提及"
+
+        await interaction.edit_original_response(
+            content=f"✅ 成功向虚拟组 **{target_name}** ({len(user_ids)} 人) {final_response_verb}。", embed=None
+        )
+
+    async def perform_shadow_role_ping(
+            self,
+            interaction: discord.Interaction,
+            roles: Sequence[discord.Role],
+            user_count: int,
+            target_name: str,
+            message: Optional[str],
+            ghost_ping: bool
+    ) -> None:
+        """使用已同步的影子身份组发送提及，只需切换一次可提及状态。"""
+        # 拥有"提及所有人"权限时可以直接提及不可提及的身份组，无需修改身份组
+        toggle = not interaction.guild.me.guild_permissions.mention_everyone
+        async with contextlib.AsyncExitStack() as stack:
+            # 按固定顺序加锁，避免两个涉及相同身份组的通知互相等待
+            for role in sorted(roles, key=lambda r: r.id):
+                await stack.enter_async_context(self._shadow_ping_locks.setdefault(role.id, asyncio.Lock()))
+            toggled = []
+            try:
+                if toggle:
+                    for role in roles:
+                        await role.edit(mentionable=True, reason="准备发送通知")
+                        toggled.append(role)
+                final_response_verb = await self.send_role_ping(
+                    interaction.channel, roles, target_name, message, ghost_ping, interaction.user.display_name
                 )
-                final_embed.set_footer(text=f"由 {interaction.user.display_name} 发送")
-
-            # 4. 发送提及
-            await temp_role.edit(mentionable=True, reason="准备发送通知")
-            sent_message = await interaction.channel.send(
-                content=final_content,
-                embed=final_embed,
-                allowed_mentions=discord.AllowedMentions(roles=True)
-            )
-
-            # 5. 根据 ghost_ping 处理消息
-            if ghost_ping:
-                await asyncio.sleep(2)  # 给予客户端足够的时间来接收和处理通知
-
-                # 构建编辑后的、无提及效果的内容
-                edited_content = f"**To:** `@{target_name}`"  # 更清晰地表明目标群体
+            finally:
+                for role in toggled:
+                    try:
+                        await role.edit(mentionable=False, reason="通知已发送")
+                    except discord.HTTPException as e:
+                        self.bot.logger.error(f"无法恢复影子身份组 {role.id} 的可提及状态: {e}")
 
-                # 编辑消息，移除提及
-                await sent_message.edit(
-                    content=edited_content,
-                    allowed_mentions=discord.AllowedMentions.none()  # 关键！禁止任何提及
-                )
+        await interaction.edit_original_response(
+            content=f"✅ 成功向虚拟组 **{target_name}** ({user_count} 人) {final_response_verb}。", embed=None
+        )
 
-                final_response_verb = "发送了幽灵提及"
-            else:
-                final_response_verb = "发送了提及"
+    async def perform_temp_role_ping(
+            self,
+            interaction: discord.Interaction,
+            user_ids: List[int],
+            target_name: str,
+            message: Optional[str],
+            ghost_ping: bool,
+            on_complete: Optional[JobCallback] = None
+    ) -> NotificationJob:
+        """
+        使用临时身份组执行大规模提及：提交一个持久化的通知任务后立即返回。
 
-            # 更新最终状态给用户
-            final_response_msg = (
-                f"✅ 成功向虚拟组 **{target_name}** ({added_count} 人) {final_response_verb}。"
-                f"{f' ({skipped_count} 人被跳过)' if skipped_count > 0 else ''}"
-            )
-            await interaction.edit_original_response(content=final_response_msg, embed=None)
+        任务由后台队列执行 (创建临时身份组、添加成员、发送提及、清理身份组)，
+        进度显示在当前频道的一条消息中，不受交互令牌 15 分钟有效期的限制，机器人重启后会从断点继续。
+        """
+        guild = interaction.guild
+        if not guild.me.guild_permissions.manage_roles:
+            raise app_commands.MissingPermissions(['manage_roles'])
 
-        finally:
-            # 6. 清理临时身份组
-            if temp_role:
-                try:
-                    await temp_role.delete(reason="临时通知组清理")
-                except discord.HTTPException as e:
-                    self.bot.logger.error(f"无法删除临时身份组 {temp_role.id}: {e}")
-                    # 尝试通知用户，让管理员手动删除
-                    await interaction.followup.send(
-                        f"⚠️ **重要提示**: 无法自动删除临时身份组 `{temp_role.name}`。"
-                        f"请服务器管理员手动删除。",
-                        ephemeral=True
-                    )
+        job = self.job_queue.submit(NotificationJob(
+            job_id=self.job_queue.new_job_id(),
+            guild_id=guild.id,
+            channel_id=interaction.channel.id,
+            requester_name=interaction.user.display_name,
+            target_name=target_name,
+            user_ids=list(user_ids),
+            message=message,
+            ghost_ping=ghost_ping,
+        ), on_complete=on_complete)
+        await interaction.edit_original_response(
+            content=f"📨 向 **{target_name}** ({len(user_ids)} 人) 的通知已加入队列 (任务 `{job.job_id}`)，"
+                    f"进度将显示在频道中。",
+            embed=None
+        )
+        return job
 
     @app_commands.command(name="发送at通知", description="安全地提及一个身份组或用户组")
     @app_commands.guild_only()
@@ -223,19 +324,19 @@ class AtCog(commands.Cog):
         # 使用 defer 并将 thinking 设为 True，这样可以后续发送进度条
         await interaction.response.defer(ephemeral=True, thinking=True)
 
-        mention_map = await self._get_combined_mention_map(interaction.guild.id)
+        matrix = self._get_mention_matrix(interaction.guild.id)
 
-        if not mention_map:
+        if not matrix.targets:
             await interaction.followup.send("❌ 错误：此服务器没有配置 `@` 功能或虚拟组。", ephemeral=True)
             return
 
-        if target not in mention_map:
+        if target not in matrix.targets:
             await interaction.followup.send(f"❌ 错误：未找到名为 `{target}` 的可提及目标。", ephemeral=True)
             return
 
-        target_config = mention_map[target]
+        target_config = matrix.targets[target].config
 
-        if not await self.can_user_mention(interaction, target):
+        if not matrix.can_mention(interaction.user, interaction.guild, target):
             await interaction.followup.send(f"🚫 权限不足：你没有权限提及 `{target_config.get('name', target)}`。", ephemeral=True)
             return
 
@@ -292,7 +393,7 @@ class AtCog(commands.Cog):
                     return
 
                 # 调用新的核心处理函数
-                await self.perform_temp_role_ping(interaction, user_ids, target_name, message, ghost_ping)
+                await self.ping_virtual_group(interaction, [target], user_ids, target_name, message, ghost_ping)
 
             else:
                 await interaction.followup.send(f"❌ 内部错误：`{target}` 的配置类型 `{target_type}` 无效。", ephemeral=True)
@@ -352,18 +453,17 @@ class AtCog(commands.Cog):
                     break
 
         try:
-            # 2. 并发运行加载动画和成员获取
-            animation_task = self.bot.loop.create_task(animate_fetching())
+            # 2. 优先使用子区成员索引，未索引时才通过 REST 获取 (同时显示加载动画)
+            member_ids = self.thread_members.get(thread.id)
+            if member_ids is None:
+                animation_task = self.bot.loop.create_task(animate_fetching())
+                member_ids = await self.thread_members.load(thread)
 
-            # 使用 fetch_members() 来确保获取到所有成员
-            members = await thread.fetch_members()
-
-            # 成员获取完成，停止动画
-            stop_animation.set()
-            await animation_task  # 等待动画任务完全结束
+                # 成员获取完成，停止动画
+                stop_animation.set()
+                await animation_task  # 等待动画任务完全结束
 
-            # 排除机器人自己，以防万一
-            user_ids = [member.id for member in members if member.id != self.bot.user.id]
+            user_ids = list(member_ids)
 
             if not user_ids:
                 await interaction.edit_original_response(content=f"ℹ️ 子区 **{thread.name}** 内没有可通知的成员。")
@@ -398,18 +498,16 @@ class AtCog(commands.Cog):
         choices = []
         if not interaction.guild: return choices
 
-        mention_map = await self._get_combined_mention_map(interaction.guild.id)
+        matrix = self._get_mention_matrix(interaction.guild.id)
 
-        for key, config in mention_map.items():
-            if await self.can_user_mention(interaction, key):
-                display_name = config.get("name", key)
-                if current.lower() in key.lower() or current.lower() in display_name.lower():
-                    desc_type = "虚拟组" if config.get("type") == "virtual" else "身份组"
-                    choice_name = f"{display_name} ({desc_type})"
-                    if len(choice_name) > 100: choice_name = choice_name[:97] + "..."
-                    choices.append(app_commands.Choice(name=choice_name, value=key))
+        # 通过索引搜索 key、显示名称及其拼音/首字母，只返回用户有权限提及的目标
+        for target in matrix.search(interaction.user, interaction.guild, current):
+            desc_type = "虚拟组" if target.type == "virtual" else "身份组"
+            choice_name = f"{target.name} ({desc_type})"
+            if len(choice_name) > 100: choice_name = choice_name[:97] + "..."
+            choices.append(app_commands.Choice(name=choice_name, value=target.key))
 
-        return choices[:25]
+        return choices
 
 
 async def setup(bot: 'NewsBot') -> None:
@@ -0,0 +1,195 @@
+# at/delivery_planner.py
+from __future__ import annotations
+
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+import discord
+
+import config
+from at.role_assigner import ROLE_ASSIGN_CONCURRENCY
+from utility.rate_limit import route_key
+
+if TYPE_CHECKING:
+    from main import NewsBot
+
+# 投递策略
+STRATEGY_DIRECT = "direct"  # 把 <@id> 直接写进若干条消息
+STRATEGY_SHADOW_ROLE = "shadow_role"  # 使用已同步的影子身份组
+STRATEGY_TEMP_ROLE = "temp_role"  # 创建临时身份组并逐个添加成员
+
+# 直接提及最多拆成几条消息，超过后不再考虑该策略 (避免刷屏)
+DIRECT_MENTION_MAX_MESSAGES = getattr(config, "AT_DIRECT_MENTION_MAX_MESSAGES", 5)
+# 直接提及时每条消息最多包含的提及数。AutoMod 的"提及过多"规则常见阈值为 20~50，超过会被拦截
+DIRECT_MENTIONS_PER_MESSAGE = getattr(config, "AT_DIRECT_MENTIONS_PER_MESSAGE", 20)
+# 直接提及被拦截 (AutoMod 或缺少权限) 后，该服务器多长时间内不再使用直接提及 (秒)
+DIRECT_BLOCKED_SECONDS = 3600
+MESSAGE_CHARACTER_LIMIT = 2000
+# 消息被 AutoMod 拦截时 API 返回的错误码
+AUTOMOD_BLOCKED_CODE = 200000
+# 单个 REST 请求的大致往返时间 (秒)
+REQUEST_SECONDS = 0.3
+# 还没有观察到响应头时假设的限额: (每个窗口的请求数, 窗口秒数)
+DEFAULT_BUCKET_LIMITS = {
+    "POST /channels/{channel_id}/messages": (5, 5.0),
+    "PUT /guilds/{guild_id}/members/{id}/roles/{id}": (10, 10.0),
+}
+
+logger = logging.getLogger("NewsBot.Delivery")
+
+
+def chunk_mentions(user_ids: Sequence[int], limit: int = MESSAGE_CHARACTER_LIMIT,
+                   per_message: int = DIRECT_MENTIONS_PER_MESSAGE) -> List[str]:
+    """
+    把用户提及按顺序打包成尽量少的消息内容，每条不超过 limit 个字符、per_message 个提及。
+    第 i 条消息提及的是 user_ids 中紧接着前 i-1 条之后的成员。
+    """
+    chunks, current, count = [], "", 0
+    for user_id in user_ids:
+        mention = f"<@{user_id}>"
+        if current and (count >= per_message or len(current) + 1 + len(mention) > limit):
+            chunks.append(current)
+            current, count = mention, 1
+        else:
+            current = f"{current} {mention}" if current else mention
+            count += 1
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def is_delivery_blocked(error: discord.HTTPException) -> bool:
+    """发送提及消息的失败是否来自 AutoMod 拦截或缺少权限 (重试同样的消息不会成功)。"""
+    return isinstance(error, discord.Forbidden) or error.code == AUTOMOD_BLOCKED_CODE
+
+
+class DirectMentionBlocked(Exception):
+    """直接提及的某条消息被拦截，remaining_user_ids 为还没有收到提及的成员。"""
+
+    def __init__(self, remaining_user_ids: List[int], error: discord.HTTPException):
+        super().__init__(f"直接提及被拦截，{len(remaining_user_ids)} 人未收到提及: {error}")
+        self.remaining_user_ids = remaining_user_ids
+        self.error = error
+
+
+@dataclass(frozen=True)
+class DeliveryPlan:
+    strategy: str
+    api_calls: int
+    estimated_seconds: float
+
+
+@dataclass
+class StrategyStats:
+    """一种策略的累计运行数据，用于调整阈值。"""
+    runs: int = 0
+    users: int = 0
+    api_calls: int = 0
+    estimated_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
+    failures: int = 0
+
+
+class DeliveryPlanner:
+    """
+    为一次虚拟组提及选择成本最低的投递方式。
+
+    按成员数量估算每种策略需要的 REST 请求数，再结合 bot.rate_limits 中对应路由的剩余额度
+    估算耗时 (额度不足时需要等待桶重置)，选择预计耗时最短的策略，耗时相同时选择请求更少的。
+    直接提及被拦截过的服务器在 DIRECT_BLOCKED_SECONDS 内不再考虑直接提及。
+    """
+
+    def __init__(self, bot: 'NewsBot'):
+        self.bot = bot
+        self.stats: Dict[str, StrategyStats] = {}
+        # { guild_id: 解除限制的 time.monotonic() }
+        self._direct_blocked_until: Dict[int, float] = {}
+
+    def _route_seconds(self, key: str, default_key: str, calls: int, concurrency: int = 1) -> float:
+        """在一个路由上发出 calls 个请求的预计耗时。"""
+        seconds = math.ceil(calls / concurrency) * REQUEST_SECONDS
+        monitor = getattr(self.bot, "rate_limits", None)
+        state = monitor.get_state(key) if monitor else None
+        if state is not None:
+            limit, window = state.limit, state.reset_after or DEFAULT_BUCKET_LIMITS[default_key][1]
+            remaining, first_reset = state.remaining, max(0.0, state.reset_at - time.monotonic())
+        else:
+            limit, window = DEFAULT_BUCKET_LIMITS[default_key]
+            remaining, first_reset = limit, window
+        overflow = calls - max(remaining, 0)
+        if overflow > 0:
+            # 超出剩余额度的部分要等到桶重置，之后每个窗口补充 limit 个
+            seconds += first_reset + (math.ceil(overflow / max(limit, 1)) - 1) * window
+        return seconds
+
+    def plan(
+            self,
+            channel: discord.abc.Messageable,
+            guild: discord.Guild,
+            user_ids: Sequence[int],
+            shadow_roles: Optional[Sequence[discord.Role]],
+            ghost_ping: bool
+    ) -> List[DeliveryPlan]:
+        """返回所有可行策略的估算，按成本从低到高排列。"""
+        api_version = discord.http.INTERNAL_API_VERSION
+        send_key = route_key("POST", f"/api/v{api_version}/channels/{channel.id}/messages")
+        send_default = "POST /channels/{channel_id}/messages"
+        plans = []
+
+        # 直接提及: 每条消息 (不超过 DIRECT_MENTIONS_PER_MESSAGE 个提及) 一次发送，幽灵提及时再编辑最后一条、删除其余的
+        messages = len(chunk_mentions(user_ids))
+        direct_blocked = self._direct_blocked_until.get(guild.id, 0.0) > time.monotonic()
+        if messages <= DIRECT_MENTION_MAX_MESSAGES and not direct_blocked:
+            cleanup = messages if ghost_ping else 0
+            plans.append(DeliveryPlan(
+                STRATEGY_DIRECT,
+                api_calls=messages + cleanup,
+                estimated_seconds=self._route_seconds(send_key, send_default, messages) + cleanup * REQUEST_SECONDS,
+            ))
+
+        # 影子身份组: 每个身份组切换两次可提及状态 (拥有提及所有人权限时不需要)、发送、幽灵提及时编辑一次
+        if shadow_roles:
+            toggles = 0 if guild.me.guild_permissions.mention_everyone else 2 * len(shadow_roles)
+            calls = toggles + 1 + (1 if ghost_ping else 0)
+            plans.append(DeliveryPlan(STRATEGY_SHADOW_ROLE, calls, calls * REQUEST_SECONDS))
+
+        # 临时身份组: 创建、逐个添加成员、设为可提及、发送、(编辑)、删除
+        add_key = route_key("PUT", f"/api/v{api_version}/guilds/{guild.id}/members/0/roles/0")
+        overhead = 4 + (1 if ghost_ping else 0)
+        plans.append(DeliveryPlan(
+            STRATEGY_TEMP_ROLE,
+            api_calls=len(user_ids) + overhead,
+            estimated_seconds=self._route_seconds(
+                add_key, "PUT /guilds/{guild_id}/members/{id}/roles/{id}", len(user_ids), ROLE_ASSIGN_CONCURRENCY
+            ) + overhead * REQUEST_SECONDS,
+        ))
+
+        plans.sort(key=lambda p: (p.estimated_seconds, p.api_calls))
+        return plans
+
+    def record(self, plan: DeliveryPlan, user_count: int, elapsed: float):
+        """记录一次投递的实际耗时，并输出该策略的累计数据。"""
+        stats = self.stats.setdefault(plan.strategy, StrategyStats())
+        stats.runs += 1
+        stats.users += user_count
+        stats.api_calls += plan.api_calls
+        stats.estimated_seconds += plan.estimated_seconds
+        stats.elapsed_seconds += elapsed
+        logger.info(
+            f"投递 [{plan.strategy}] {user_count} 人: 预计 {plan.api_calls} 次请求 / {plan.estimated_seconds:.1f}s，"
+            f"实际 {elapsed:.1f}s (累计 {stats.runs} 次, {stats.users} 人, "
+            f"预计 {stats.estimated_seconds:.1f}s / 实际 {stats.elapsed_seconds:.1f}s)"
+        )
+
+    def record_failure(self, plan: DeliveryPlan, guild_id: int, error: Exception):
+        """记录一次失败的投递。直接提及失败时，该服务器暂时不再使用直接提及。"""
+        stats = self.stats.setdefault(plan.strategy, StrategyStats())
+        stats.failures += 1
+        if plan.strategy == STRATEGY_DIRECT:
+            self._direct_blocked_until[guild_id] = time.monotonic() + DIRECT_BLOCKED_SECONDS
+        logger.warning(
+            f"投递 [{plan.strategy}] 在服务器 {guild_id} 失败 (累计 {stats.failures} 次): {error}"
+        )
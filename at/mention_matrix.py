@@ -0,0 +1,88 @@
+# at/mention_matrix.py
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, Mapping
+
+import discord
+
+from utility.search_index import SearchIndex
+
+# 缓存的不同身份组组合数量上限，超过后整体清空 (大多数成员的身份组组合是重复的)
+ROLE_SET_CACHE_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class MentionTarget:
+    """一个可提及目标 (真实身份组或虚拟组) 编译后的配置。"""
+    key: str
+    name: str
+    config: Mapping[str, Any]
+    allowed_role_ids: FrozenSet[int]
+
+    @property
+    def type(self) -> str:
+        return self.config.get("type")
+
+
+class MentionMatrix:
+    """
+    一个服务器的提及权限矩阵：所有可提及目标及其允许的身份组ID集合，在配置变更时整体重建。
+
+    判断权限只需要用户的身份组集合：按身份组集合缓存可提及的目标 key 集合，
+    拥有相同身份组组合的成员共享同一个缓存项，成员的身份组变化后自然会命中另一个缓存项。
+    自动补全通过随矩阵一起构建的搜索索引完成，支持拼音和首字母。
+    """
+
+    def __init__(self, version: int, targets: Dict[str, MentionTarget]):
+        self.version = version
+        self.targets: Mapping[str, MentionTarget] = MappingProxyType(targets)
+        self._all_keys_set: FrozenSet[str] = frozenset(targets)
+        self._allowed_by_role_set: Dict[FrozenSet[int], FrozenSet[str]] = {}
+        # 按 key 和显示名称 (及其拼音/首字母) 搜索目标，供自动补全使用
+        self.search_index: SearchIndex[str] = SearchIndex((key, (key, target.name)) for key, target in targets.items())
+
+    @classmethod
+    def compile(cls, version: int, mention_map: Mapping[str, Mapping[str, Any]],
+                virtual_roles: Mapping[str, Mapping[str, Any]]) -> 'MentionMatrix':
+        """合并静态的 mention_map 与虚拟组配置，虚拟组的同名 key 会覆盖静态配置。"""
+        targets: Dict[str, MentionTarget] = {}
+        combined = dict(mention_map)
+        for key, config in virtual_roles.items():
+            # 为虚拟组配置添加 'type' 字段，以便后续逻辑判断
+            combined[key] = {**config, 'type': 'virtual'}
+        for key, config in combined.items():
+            targets[key] = MentionTarget(
+                key=key,
+                name=config.get("name", key),
+                config=MappingProxyType(dict(config)),
+                allowed_role_ids=frozenset(int(role_id) for role_id in config.get("allowed_by_roles", [])),
+            )
+        return cls(version, targets)
+
+    def allowed_keys(self, member: discord.abc.User, guild: discord.Guild) -> FrozenSet[str]:
+        """返回该用户可以提及的所有目标 key。"""
+        if member.id == guild.owner_id:
+            return self._all_keys_set
+        if not isinstance(member, discord.Member):
+            return frozenset()
+        if member.guild_permissions.administrator:
+            return self._all_keys_set
+
+        role_set = frozenset(role.id for role in member.roles)
+        allowed = self._allowed_by_role_set.get(role_set)
+        if allowed is None:
+            if len(self._allowed_by_role_set) >= ROLE_SET_CACHE_SIZE:
+                self._allowed_by_role_set.clear()
+            allowed = self._allowed_by_role_set[role_set] = frozenset(
+                key for key, target in self.targets.items()
+                if not target.allowed_role_ids.isdisjoint(role_set)
+            )
+        return allowed
+
+    def can_mention(self, member: discord.abc.User, guild: discord.Guild, target_key: str) -> bool:
+        return target_key in self.allowed_keys(member, guild)
+
+    def search(self, member: discord.abc.User, guild: discord.Guild, query: str, limit: int = 25) -> List[MentionTarget]:
+        """搜索该用户可以提及的目标，按匹配程度排序。"""
+        keys = self.search_index.search(query, limit, allowed=self.allowed_keys(member, guild), user_id=member.id)
+        return [self.targets[key] for key in keys]
@@ -0,0 +1,375 @@
+# at/notification_jobs.py
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field, fields
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set
+
+import discord
+
+import config
+from utility.write_behind import WriteBehindWriter, write_file_atomic
+
+if TYPE_CHECKING:
+    from at.at_cog import AtCog
+
+NOTIFICATION_JOBS_FILE = os.path.join("data", "notification_jobs.json")
+# 临时通知身份组的名称: "通知-<目标>-<创建时的unix时间戳>"
+TEMP_ROLE_NAME_PREFIX = "通知-"
+TEMP_ROLE_NAME_PATTERN = re.compile(rf"^{re.escape(TEMP_ROLE_NAME_PREFIX)}.+-\d+$")
+
+# 同时执行的通知任务数
+NOTIFICATION_WORKERS = getattr(config, "AT_NOTIFICATION_WORKERS", 2)
+# 进度消息的更新间隔 (秒)，断点也随进度一起保存
+PROGRESS_INTERVAL_SECONDS = 3.0
+
+# 任务状态
+STATE_ADDING = "adding"  # 正在向临时身份组添加成员
+STATE_SENDING = "sending"  # 已开始发送提及
+
+logger = logging.getLogger("NewsBot.NotificationJobs")
+
+
+@dataclass
+class NotificationJob:
+    """一个使用临时身份组的大规模通知任务，整体持久化，重启后从断点继续。"""
+    job_id: str
+    guild_id: int
+    channel_id: int
+    requester_name: str
+    target_name: str
+    user_ids: List[int]
+    message: Optional[str] = None
+    ghost_ping: bool = True
+    state: str = STATE_ADDING
+    role_id: Optional[int] = None
+    status_message_id: Optional[int] = None
+    # 断点：已处理的成员，以及其中成功添加/被跳过的人数
+    done: Set[int] = field(default_factory=set)
+    added: int = 0
+    skipped: int = 0
+    created_at: float = field(default_factory=time.time)
+
+    def snapshot(self) -> dict:
+        """
+        在事件循环上取一份廉价的快照：只复制 done 集合，user_ids 提交后不再修改，直接共享引用。
+        快照由 serialize 在写线程中转换为 JSON。
+        """
+        data = {f.name: getattr(self, f.name) for f in fields(self)}
+        data["done"] = set(self.done)
+        return data
+
+    @staticmethod
+    def serialize(snapshot: dict) -> dict:
+        return dict(snapshot, done=sorted(snapshot["done"]))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'NotificationJob':
+        data = dict(data)
+        data["done"] = set(data.get("done", []))
+        return cls(**data)
+
+
+JobCallback = Callable[[NotificationJob, float], None]
+
+
+class NotificationJobQueue:
+    """
+    临时身份组通知的持久化任务队列。
+
+    任务提交后立即写入 data/notification_jobs.json，由后台 worker 执行，不依赖 15 分钟有效的交互令牌；
+    进度通过频道中的普通消息显示。添加成员的过程中定期保存已处理的成员，重启后只处理剩余的部分。
+    机器人创建的临时身份组ID也会被记录，删除后才移除记录；启动时只清理这些记录中
+    不属于任何未完成任务的身份组 (上次运行中断时遗留的)，不会动管理员手动创建的身份组。
+    """
+
+    def __init__(self, cog: 'AtCog'):
+        self.cog = cog
+        self.bot = cog.bot
+        self._writer = WriteBehindWriter.default()
+        self._jobs: Dict[str, NotificationJob] = {}
+        # 机器人创建且尚未确认删除的临时身份组: { guild_id_str: [role_id, ...] }
+        self._created_roles: Dict[str, List[int]] = {}
+        self._load()
+        # 上次运行遗留的任务，启动完成后重新入队 (新提交的任务在提交时已入队)
+        self._resumed: List[str] = list(self._jobs)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # 任务完成时的回调 (不持久化，重启后恢复的任务没有回调)
+        self._callbacks: Dict[str, JobCallback] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    # --- 持久化 ---
+
+    def _load(self):
+        try:
+            with open(NOTIFICATION_JOBS_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError as e:
+            logger.error(f"无法解析 {NOTIFICATION_JOBS_FILE}，未完成的通知任务将被丢弃: {e}")
+            return
+        # 旧格式的文件只有 { job_id: job }
+        if "jobs" not in data:
+            data = {"jobs": data, "created_role_ids": {}}
+        try:
+            self._jobs = {job_id: NotificationJob.from_dict(job) for job_id, job in data["jobs"].items()}
+        except TypeError as e:
+            logger.error(f"无法解析 {NOTIFICATION_JOBS_FILE} 中的任务，未完成的通知任务将被丢弃: {e}")
+        self._created_roles = {
+            guild_id: [int(role_id) for role_id in role_ids]
+            for guild_id, role_ids in data.get("created_role_ids", {}).items()
+        }
+        for job in self._jobs.values():
+            if job.role_id:
+                self._remember_role(job.guild_id, job.role_id)
+
+    @staticmethod
+    def _serialize(snapshot: dict) -> str:
+        jobs = {job_id: NotificationJob.serialize(job) for job_id, job in snapshot["jobs"].items()}
+        return json.dumps({"jobs": jobs, "created_role_ids": snapshot["created_role_ids"]}, ensure_ascii=False)
+
+    def _save(self):
+        """事件循环上只取快照，序列化和写入都在写线程中进行。"""
+        snapshot = {
+            "jobs": {job_id: job.snapshot() for job_id, job in self._jobs.items()},
+            "created_role_ids": {guild_id: list(role_ids) for guild_id, role_ids in self._created_roles.items()},
+        }
+        self._writer.schedule(
+            NOTIFICATION_JOBS_FILE, lambda: write_file_atomic(NOTIFICATION_JOBS_FILE, self._serialize(snapshot))
+        )
+
+    def _remember_role(self, guild_id: int, role_id: int):
+        role_ids = self._created_roles.setdefault(str(guild_id), [])
+        if role_id not in role_ids:
+            role_ids.append(role_id)
+
+    def _forget_role(self, guild_id: int, role_id: int):
+        role_ids = self._created_roles.get(str(guild_id), [])
+        if role_id in role_ids:
+            role_ids.remove(role_id)
+            if not role_ids:
+                del self._created_roles[str(guild_id)]
+
+    # --- 生命周期 ---
+
+    def start(self):
+        self._tasks.append(asyncio.create_task(self._run()))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        # 当前进度写入磁盘，下次启动时从这里继续
+        self._save()
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        await self._sweep_orphan_roles()
+        for job_id in self._resumed:
+            self._queue.put_nowait(job_id)
+        if self._resumed:
+            logger.info(f"恢复了 {len(self._resumed)} 个未完成的通知任务。")
+        for _ in range(max(1, NOTIFICATION_WORKERS)):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    @staticmethod
+    def _is_temp_role(role: discord.Role) -> bool:
+        """再次确认身份组确实是临时通知组，避免误删被改作他用的身份组。"""
+        return (TEMP_ROLE_NAME_PATTERN.match(role.name) is not None
+                and role.permissions == discord.Permissions.none()
+                and not role.managed)
+
+    async def _sweep_orphan_roles(self):
+        """只删除记录中由机器人创建、且不属于任何未完成任务的临时身份组。"""
+        in_use = {job.role_id for job in self._jobs.values() if job.role_id}
+        for guild_id_str, role_ids in list(self._created_roles.items()):
+            guild = self.bot.get_guild(int(guild_id_str))
+            if guild is None:
+                continue
+            for role_id in [role_id for role_id in role_ids if role_id not in in_use]:
+                role = guild.get_role(role_id)
+                if role is None:
+                    # 已被删除
+                    self._forget_role(guild.id, role_id)
+                    continue
+                if not self._is_temp_role(role):
+                    logger.warning(f"服务器 {guild.id} 的身份组 {role.name} ({role.id}) 已被修改，不再视为临时通知组。")
+                    self._forget_role(guild.id, role_id)
+                    continue
+                try:
+                    await role.delete(reason="清理遗留的临时通知组")
+                    self._forget_role(guild.id, role_id)
+                    logger.info(f"已删除服务器 {guild.id} 中遗留的临时通知组 {role.name}。")
+                except discord.NotFound:
+                    self._forget_role(guild.id, role_id)
+                except discord.HTTPException as e:
+                    logger.warning(f"无法删除遗留的临时通知组 {role.id}: {e}")
+        self._save()
+
+    # --- 提交 ---
+
+    def submit(self, job: NotificationJob, on_complete: Optional[JobCallback] = None) -> NotificationJob:
+        self._jobs[job.job_id] = job
+        if on_complete:
+            self._callbacks[job.job_id] = on_complete
+        self._save()
+        self._queue.put_nowait(job.job_id)
+        return job
+
+    @staticmethod
+    def new_job_id() -> str:
+        return uuid.uuid4().hex[:12]
+
+    def pending_jobs(self, guild_id: int) -> List[NotificationJob]:
+        return [job for job in self._jobs.values() if job.guild_id == guild_id]
+
+    # --- 执行 ---
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            started = time.monotonic()
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                # 机器人关闭：保留任务、临时身份组和断点，下次启动时继续
+                raise
+            except Exception as e:
+                logger.error(f"通知任务 {job.job_id} ({job.target_name}) 执行失败: {e}", exc_info=True)
+                await self._update_status(job, content=f"❌ 向 **{job.target_name}** 发送通知失败：{e}", embed=None)
+            await self._delete_role(job)
+            self._jobs.pop(job.job_id, None)
+            self._save()
+            callback = self._callbacks.pop(job.job_id, None)
+            if callback:
+                callback(job, time.monotonic() - started)
+
+    def _get_channel(self, job: NotificationJob) -> Optional[discord.abc.Messageable]:
+        guild = self.bot.get_guild(job.guild_id)
+        return guild.get_channel_or_thread(job.channel_id) if guild else None
+
+    async def _update_status(self, job: NotificationJob, content: Optional[str] = None,
+                             embed: Optional[discord.Embed] = None, delete_after: Optional[float] = None):
+        """发送或编辑任务的进度消息。进度消息更新失败不影响任务本身。"""
+        channel = self._get_channel(job)
+        if channel is None:
+            return
+        try:
+            if job.status_message_id:
+                await channel.get_partial_message(job.status_message_id).edit(
+                    content=content, embed=embed, delete_after=delete_after
+                )
+            else:
+                status_message = await channel.send(content=content, embed=embed, delete_after=delete_after)
+                job.status_message_id = status_message.id
+                self._save()
+        except discord.HTTPException as e:
+            logger.debug(f"更新通知任务 {job.job_id} 的进度消息失败: {e}")
+
+    def _progress_embed(self, job: NotificationJob) -> discord.Embed:
+        total = len(job.user_ids)
+        percentage = len(job.done) / total if total else 1.0
+        bar = '█' * int(percentage * 10) + ' ' * (10 - int(percentage * 10))
+        embed = discord.Embed(
+            title=f"🚀 正在准备通知: {job.target_name}",
+            description="正在将成员添加到临时身份组...",
+            color=discord.Color.blurple()
+        )
+        embed.add_field(
+            name="进度",
+            value=f"`[{bar}]` {int(percentage * 100)}%\n"
+                  f"已处理: {len(job.done)}/{total} (成功: {job.added}, 跳过: {job.skipped})",
+            inline=False
+        )
+        embed.set_footer(text=f"由 {job.requester_name} 发起 · 任务 {job.job_id}")
+        return embed
+
+    async def _process(self, job: NotificationJob):
+        guild = self.bot.get_guild(job.guild_id)
+        channel = self._get_channel(job)
+        if guild is None or channel is None:
+            logger.warning(f"通知任务 {job.job_id} 的服务器或频道已不存在，任务被丢弃。")
+            return
+
+        if job.state == STATE_SENDING:
+            # 中断前可能已经发出了提及，为避免重复通知不再发送
+            await self._update_status(
+                job, content=f"⚠️ 向 **{job.target_name}** 的通知在发送时被中断，可能已经送达，未重新发送。", embed=None
+            )
+            return
+
+        role = guild.get_role(job.role_id) if job.role_id else None
+        if role is None:
+            role = await guild.create_role(
+                name=f"{TEMP_ROLE_NAME_PREFIX}{job.target_name}-{int(time.time())}",
+                permissions=discord.Permissions.none(),
+                mentionable=False,
+                reason=f"为 {job.requester_name} 的通知命令创建的临时通知组"
+            )
+            if job.role_id is not None:
+                # 身份组在中断期间被删除，之前添加的成员需要重新添加
+                job.done.clear()
+                job.added = job.skipped = 0
+            job.role_id = role.id
+            self._remember_role(guild.id, role.id)
+            self._save()
+
+        def on_user_done(user_id: int, added: bool):
+            job.done.add(user_id)
+            if added:
+                job.added += 1
+            else:
+                job.skipped += 1
+
+        async def on_progress(_result):
+            self._save()
+            await self._update_status(job, embed=self._progress_embed(job))
+
+        remaining = [user_id for user_id in job.user_ids if user_id not in job.done]
+        await self._update_status(job, embed=self._progress_embed(job))
+        await self.cog.role_assigner.assign(
+            guild, role, remaining, reason="临时通知",
+            on_progress=on_progress, progress_interval=PROGRESS_INTERVAL_SECONDS, on_user_done=on_user_done
+        )
+        if job.skipped:
+            logger.info(f"临时通知 {role.name}: 成功 {job.added}, 跳过 {job.skipped}")
+
+        job.state = STATE_SENDING
+        self._save()
+        await role.edit(mentionable=True, reason="准备发送通知")
+        final_response_verb = await self.cog.send_role_ping(
+            channel, [role], job.target_name, job.message, job.ghost_ping, job.requester_name
+        )
+        await self._update_status(
+            job,
+            content=f"✅ 成功向 **{job.target_name}** ({job.added} 人) {final_response_verb}。"
+                    f"{f' ({job.skipped} 人被跳过)' if job.skipped > 0 else ''}",
+            embed=None,
+            # 幽灵提及时不在频道中留下痕迹
+            delete_after=30 if job.ghost_ping else None
+        )
+
+    async def _delete_role(self, job: NotificationJob):
+        guild = self.bot.get_guild(job.guild_id)
+        if guild is None or not job.role_id:
+            return
+        role = guild.get_role(job.role_id)
+        if role is not None:
+            try:
+                await role.delete(reason="临时通知组清理")
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                # 保留记录，下次启动时作为遗留身份组再次尝试删除
+                logger.error(f"无法删除临时身份组 {role.id}: {e}")
+                return
+        self._forget_role(guild.id, job.role_id)
@@ -0,0 +1,155 @@
+# at/role_assigner.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Iterable, Optional
+
+import aiohttp
+import discord
+
+import config
+from utility.member_cache import resolve_members
+from utility.rate_limit import route_key
+
+if TYPE_CHECKING:
+    from main import NewsBot
+
+# 同时进行的添加身份组请求数
+ROLE_ASSIGN_CONCURRENCY = getattr(config, "AT_ROLE_ASSIGN_CONCURRENCY", 8)
+# 单个成员遇到暂时性错误 (5xx / 网络错误) 时的最大重试次数
+ROLE_ASSIGN_MAX_RETRIES = 3
+
+logger = logging.getLogger("NewsBot.RoleAssigner")
+
+
+@dataclass
+class RoleAssignmentResult:
+    total: int
+    added: int = 0
+    not_in_guild: int = 0  # 成员已离开服务器 (或本来就不在)
+    forbidden: int = 0  # 机器人无权为该成员添加身份组
+    failed: int = 0  # 重试后仍然失败
+
+    @property
+    def processed(self) -> int:
+        return self.added + self.skipped
+
+    @property
+    def skipped(self) -> int:
+        return self.not_in_guild + self.forbidden + self.failed
+
+
+ProgressCallback = Callable[[RoleAssignmentResult], Awaitable[None]]
+# 每个成员处理完毕 (无论成功与否) 时调用，参数为 (user_id, 是否成功添加)，用于记录断点
+UserDoneCallback = Callable[[int, bool], None]
+
+
+class BulkRoleAssigner:
+    """
+    批量为成员添加身份组。
+
+    固定数量的 worker 共享一个队列，直接调用添加成员身份组的 REST 路由 (不需要成员缓存)。
+    发请求前通过 bot.rate_limits 检查该路由桶的剩余额度，额度用尽时等待重置，
+    使请求保持在限额之内；discord.py 仍然负责按桶排队和处理意外的 429。
+    """
+
+    def __init__(self, bot: 'NewsBot', concurrency: int = ROLE_ASSIGN_CONCURRENCY):
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+
+    async def assign(
+            self,
+            guild: discord.Guild,
+            role: discord.Role,
+            user_ids: Iterable[int],
+            reason: Optional[str] = None,
+            on_progress: Optional[ProgressCallback] = None,
+            progress_interval: float = 1.5,
+            on_user_done: Optional[UserDoneCallback] = None,
+    ) -> RoleAssignmentResult:
+        user_ids = list(user_ids)
+        result = RoleAssignmentResult(total=len(user_ids))
+        queue: asyncio.Queue = asyncio.Queue()
+
+        # 先跳过已离开的成员，省下必然返回 404 的请求 (成员缓存不完整时按每批 100 个通过网关查询)
+        try:
+            present = await resolve_members(guild, user_ids)
+        except asyncio.TimeoutError:
+            logger.warning(f"查询服务器 {guild.id} 的成员超时，将直接尝试添加所有成员。")
+            present = None
+        for user_id in user_ids:
+            if present is not None and user_id not in present:
+                result.not_in_guild += 1
+                if on_user_done:
+                    on_user_done(user_id, False)
+            else:
+                queue.put_nowait(user_id)
+
+        key = route_key("PUT", f"/api/v{discord.http.INTERNAL_API_VERSION}/guilds/{guild.id}/members/0/roles/0")
+        workers = [
+            asyncio.create_task(self._worker(queue, guild, role, reason, key, result, on_user_done))
+            for _ in range(min(self.concurrency, queue.qsize()))
+        ]
+        reporter = asyncio.create_task(self._report(on_progress, progress_interval, result)) if on_progress else None
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if reporter:
+                reporter.cancel()
+
+        if on_progress:
+            await self._notify(on_progress, result)
+        return result
+
+    async def _worker(self, queue: asyncio.Queue, guild: discord.Guild, role: discord.Role,
+                      reason: Optional[str], key: str, result: RoleAssignmentResult,
+                      on_user_done: Optional[UserDoneCallback]):
+        monitor = getattr(self.bot, "rate_limits", None)
+        while True:
+            try:
+                user_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            added = False
+            for attempt in range(ROLE_ASSIGN_MAX_RETRIES + 1):
+                if monitor:
+                    await monitor.acquire(key)
+                try:
+                    await self.bot.http.add_role(guild.id, user_id, role.id, reason=reason)
+                    result.added += 1
+                    added = True
+                except discord.NotFound:
+                    result.not_in_guild += 1
+                except discord.Forbidden:
+                    result.forbidden += 1
+                except (discord.HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status = getattr(e, "status", None)
+                    # 只有 5xx 和网络错误是暂时性的，其余错误重试也不会成功
+                    if (status is None or status >= 500) and attempt < ROLE_ASSIGN_MAX_RETRIES:
+                        await asyncio.sleep(2 ** attempt + random.random())
+                        continue
+                    logger.warning(f"为用户 {user_id} 添加身份组 {role.id} 失败: {e}")
+                    result.failed += 1
+                break
+            if on_user_done:
+                on_user_done(user_id, added)
+
+    @classmethod
+    async def _report(cls, on_progress: ProgressCallback, interval: float, result: RoleAssignmentResult):
+        while True:
+            await asyncio.sleep(interval)
+            await cls._notify(on_progress, result)
+
+    @staticmethod
+    async def _notify(on_progress: ProgressCallback, result: RoleAssignmentResult):
+        try:
+            await on_progress(result)
+        except discord.HTTPException as e:
+            # 进度更新失败不影响批量任务本身
+            logger.debug(f"更新批量添加身份组的进度失败: {e}")
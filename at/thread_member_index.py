@@ -0,0 +1,81 @@
+# at/thread_member_index.py
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+from typing import FrozenSet, Optional, Set
+
+import discord
+
+import config
+from config_data import GUILD_CONFIGS
+
+# 最多保存多少个子区的成员列表，超过后淘汰最久未使用的
+THREAD_MEMBER_INDEX_SIZE = getattr(config, "AT_THREAD_MEMBER_INDEX_SIZE", 512)
+# 网关事件中 member_count 的上限，达到上限时不再反映真实人数
+THREAD_MEMBER_COUNT_CAP = 50
+
+logger = logging.getLogger("NewsBot.ThreadMembers")
+
+
+class ThreadMemberIndex:
+    """
+    子区成员索引：首次需要时用一次 fetch_members() 建立，之后由网关的
+    THREAD_MEMBERS_UPDATE 事件 (成员加入/离开子区) 增量维护，查询时不再需要 REST 请求。
+
+    只保存已配置的新闻论坛中的帖子，其他子区每次都重新获取；总数由 LRU 限制。
+    重新连接 (READY) 后可能错过了事件，整个索引会被清空并重新按需建立。
+    """
+
+    def __init__(self, capacity: int = THREAD_MEMBER_INDEX_SIZE):
+        self.capacity = max(1, capacity)
+        # { thread_id: 成员ID集合 (不含机器人自己) }
+        self._members: OrderedDict[int, Set[int]] = OrderedDict()
+
+    @staticmethod
+    def _is_indexed_forum(thread: discord.Thread) -> bool:
+        fm_config = GUILD_CONFIGS.get(thread.guild.id, {}).get("forum_manager_config") or {}
+        return thread.parent_id == fm_config.get("forum_channel_id")
+
+    def get(self, thread_id: int) -> Optional[FrozenSet[int]]:
+        """返回已索引的子区成员，未索引时返回 None。"""
+        members = self._members.get(thread_id)
+        if members is None:
+            return None
+        self._members.move_to_end(thread_id)
+        return frozenset(members)
+
+    async def load(self, thread: discord.Thread) -> FrozenSet[int]:
+        """通过 REST 获取子区的全部成员，属于已配置论坛的帖子会被加入索引。"""
+        members = {member.id for member in await thread.fetch_members() if member.id != thread.guild.me.id}
+        if self._is_indexed_forum(thread):
+            self._members[thread.id] = members
+            self._members.move_to_end(thread.id)
+            while len(self._members) > self.capacity:
+                self._members.popitem(last=False)
+        return frozenset(members)
+
+    # --- 网关事件 ---
+
+    def on_member_join(self, member: discord.ThreadMember):
+        members = self._members.get(member.thread_id)
+        if members is not None:
+            members.add(member.id)
+
+    def on_members_removed(self, payload: discord.RawThreadMembersUpdate):
+        members = self._members.get(payload.thread_id)
+        if members is None:
+            return
+        for user_id in payload.data.get('removed_member_ids', []):
+            members.discard(int(user_id))
+        # member_count 只是近似值且最多为 50，只有人数低于上限时才能用来发现错过的事件；
+        # 人数更多的子区依赖重新连接时清空索引和 LRU 淘汰。member_count 包含机器人自己 (如果它在子区中)
+        if payload.member_count < THREAD_MEMBER_COUNT_CAP and abs(len(members) - payload.member_count) > 1:
+            logger.debug(f"子区 {payload.thread_id} 的成员索引与网关人数不一致，已丢弃。")
+            del self._members[payload.thread_id]
+
+    def discard(self, thread_id: int):
+        self._members.pop(thread_id, None)
+
+    def clear(self):
+        self._members.clear()
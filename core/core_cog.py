@@ -9,6 +9,7 @@ import zipfile
 import config
 from core.embed_link.embed_manager import EmbedLinkManager
 from utility.permison import is_admin, is_admin_check
+from utility.search_index import SearchIndex
 
 try:
     import distro
@@ -58,6 +59,8 @@ class CoreCog(commands.Cog, name="Core"):
         self.start_time = datetime.now(timezone.utc)
 
         self.role_name_cache: Dict[int, str] = {}
+        # (已注册的模块键, 对应的搜索索引)
+        self._link_module_index: typing.Optional[typing.Tuple[typing.Tuple[str, ...], SearchIndex[str]]] = None
 
     async def cog_load(self) -> None:
         """当 Cog 被加载时，启动后台任务。"""
@@ -102,10 +105,13 @@ class CoreCog(commands.Cog, name="Core"):
 
     async def link_module_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
         """为配置指令提供模块键的自动补全。"""
-        keys = EmbedLinkManager.get_registered_keys()
+        keys = tuple(EmbedLinkManager.get_registered_keys())
+        # 注册的模块只在启动时变化，键列表不变时复用同一个索引
+        if self._link_module_index is None or self._link_module_index[0] != keys:
+            self._link_module_index = (keys, SearchIndex((key, (key,)) for key in keys))
         return [
             app_commands.Choice(name=key, value=key)
-            for key in keys if current.lower() in key.lower()
+            for key in self._link_module_index[1].search(current, user_id=interaction.user.id)
         ]
 
     @core_group.command(name="配置embed链接", description="配置一个模块使用的Discord消息链接")
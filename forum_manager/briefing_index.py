@@ -0,0 +1,79 @@
+# forum_manager/briefing_index.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+from utility.write_behind import WriteBehindWriter, write_file_atomic
+
+BRIEFING_INDEX_FILE = os.path.join("data", "briefing_threads.json")
+# 只保留最近多少天的记录
+BRIEFING_INDEX_RETENTION_DAYS = 60
+
+# 快讯标题，例如 "🗞️ | 每日快讯-2025年7月1日"
+BRIEFING_TITLE_PATTERN = re.compile(r"🗞️.*?每日快讯.*?-.*?(\d{4})年(\d{1,2})月(\d{1,2})日")
+
+logger = logging.getLogger("NewsBot.BriefingIndex")
+
+
+def parse_briefing_date(title: str) -> Optional[date]:
+    """从快讯帖子的标题中解析日期，不是快讯标题时返回 None。"""
+    match = BRIEFING_TITLE_PATTERN.search(title)
+    if not match:
+        return None
+    try:
+        return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    except ValueError:
+        return None
+
+
+class BriefingThreadIndex:
+    """
+    每日快讯帖子的持久化索引: { guild_id: { "YYYY-MM-DD": thread_id } }。
+
+    在机器人创建快讯帖子以及收到 on_thread_create 时写入，查找时只需一次字典查询；
+    记录的帖子由调用方对照缓存验证，失效的记录会被删除。
+    """
+
+    def __init__(self):
+        self._writer = WriteBehindWriter.default()
+        self._threads: Dict[str, Dict[str, int]] = self._load()
+
+    @staticmethod
+    def _load() -> Dict[str, Dict[str, int]]:
+        try:
+            with open(BRIEFING_INDEX_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.error(f"无法解析 {BRIEFING_INDEX_FILE}，快讯帖子索引将重新建立。")
+            return {}
+
+    def _schedule_save(self):
+        snapshot = json.dumps(self._threads, indent=4, ensure_ascii=False)
+        self._writer.schedule(BRIEFING_INDEX_FILE, lambda: write_file_atomic(BRIEFING_INDEX_FILE, snapshot))
+
+    def get(self, guild_id: int, target_date: date) -> Optional[int]:
+        return self._threads.get(str(guild_id), {}).get(target_date.isoformat())
+
+    def set(self, guild_id: int, target_date: date, thread_id: int):
+        guild_threads = self._threads.setdefault(str(guild_id), {})
+        if guild_threads.get(target_date.isoformat()) == thread_id:
+            return
+        guild_threads[target_date.isoformat()] = thread_id
+        # ISO 格式的日期可以直接按字符串比较
+        oldest = (target_date - timedelta(days=BRIEFING_INDEX_RETENTION_DAYS)).isoformat()
+        for day in [day for day in guild_threads if day < oldest]:
+            del guild_threads[day]
+        self._schedule_save()
+
+    def discard(self, guild_id: int, thread_id: int):
+        guild_threads = self._threads.get(str(guild_id), {})
+        for day in [day for day, indexed_id in guild_threads.items() if indexed_id == thread_id]:
+            del guild_threads[day]
+            self._schedule_save()
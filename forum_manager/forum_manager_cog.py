@@ -2,143 +2,209 @@
 from __future__ import annotations
 
 import asyncio
-import re
+from dataclasses import dataclass, field
 from datetime import datetime, time, timedelta
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, List, Optional
 
 import discord
 import pytz
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 import config
 from config_data import GUILD_CONFIGS
+from forum_manager.briefing_index import BriefingThreadIndex, parse_briefing_date
+from at.delivery_planner import STRATEGY_TEMP_ROLE
+from forum_manager.forum_planner import ThreadChange, plan_forum
+from utility.edit_pacer import EditJob, EditPacer, channel_edit_key
 from utility.permison import is_admin
-from virtual_role.virtual_role_helper import get_virtual_role_configs_for_guild
+from utility.scheduler import parse_time
 
 # 我们需要从 virtual_role cog 中导入视图，以便附加到新帖子上
 
 if TYPE_CHECKING:
     from main import NewsBot
 
-# --- 动态设置任务时间 ---
-# 从 config.py 读取时间字符串并解析
-try:
-    _H, _M = map(int, config.DAILY_TASK_TRIGGER_TIME.split(':'))
-    # 注意：这里的时区需要与任务逻辑中的时区概念保持一致。
-    # tasks.loop 的 time 参数只接受一个固定的时区。
-    # 我们假设所有服务器的时区相似，或者以一个主要时区为准。
-    # 这里我们使用一个通用的 'Asia/Shanghai' 作为任务调度器的基准时区。
-    # 任务内部逻辑会使用每个服务器自己的时区配置。
-    _TASK_TIME = time(hour=_H, minute=_M, tzinfo=pytz.timezone('Asia/Shanghai'))
-except (ValueError, KeyError):
-    print("错误：无法解析 config.py 中的 DAILY_TASK_TRIGGER_TIME，将使用默认时间 00:05")
-    _TASK_TIME = time(hour=0, minute=5, tzinfo=pytz.timezone('Asia/Shanghai'))
+# 每日任务的默认触发时间 (各服务器的本地时间)，可在 forum_manager_config 中用 "daily_task_time" 单独设置
+DAILY_TASK_TRIGGER_TIME = getattr(config, "DAILY_TASK_TRIGGER_TIME", "00:00")
+# 调度器中每日任务的名称
+DAILY_JOB_NAME = "forum_daily"
+
+# 同时执行每日任务的服务器数量
+DAILY_TASK_CONCURRENCY = getattr(config, "FORUM_DAILY_TASK_CONCURRENCY", 4)
+# 单个服务器每日任务的超时时间 (秒)
+DAILY_TASK_TIMEOUT_SECONDS = getattr(config, "FORUM_DAILY_TASK_TIMEOUT_SECONDS", 600)
+# 预演结果中最多列出的计划编辑条数
+DRY_RUN_MAX_LINES = 20
+
+
+@dataclass
+class DailyRunResult:
+    """一个服务器一次每日任务的执行结果。"""
+    guild_id: int
+    guild_name: str
+    archived: int = 0
+    created: bool = False
+    elapsed: float = 0.0
+    error: Optional[str] = None
+    dry_run: bool = False
+    # 计划中的编辑 (可读描述) 和预计的 API 请求数
+    planned: List[str] = field(default_factory=list)
+    api_calls: int = 0
+
+    def summary(self) -> str:
+        status = f"失败: {self.error}" if self.error else "成功"
+        if self.dry_run:
+            return (f"{self.guild_name} ({self.guild_id}): 预演{status}, 计划 {len(self.planned)} 项修改, "
+                    f"预计 {self.api_calls} 次请求, 耗时 {self.elapsed:.1f}s")
+        return (f"{self.guild_name} ({self.guild_id}): {status}, 归档 {self.archived} 个帖子, "
+                f"{'新建' if self.created else '未新建'}快讯, {self.api_calls} 次计划请求, 耗时 {self.elapsed:.1f}s")
 
 
-# --- 结束动态设置 ---
-
 class ForumManagerCog(commands.Cog, name="ForumManager"):
     """
     负责新闻论坛的每日自动化管理，包括发帖、归档和更新快讯。
     """
-    __cog_tasks__: list[tasks.Loop]
-
     def __init__(self, bot: 'NewsBot'):
         self.bot = bot
         self.logger = bot.logger
-        # 启动主任务循环
-        self.master_daily_task.start()
+        # 日期 -> 快讯帖子的持久化索引
+        self.briefing_index = BriefingThreadIndex()
+        # 批量编辑帖子时按速率限制自适应节流
+        self.edit_pacer = EditPacer(bot)
+        # 触发时间相同的服务器共用并发限制
+        self.daily_semaphore = asyncio.Semaphore(max(1, DAILY_TASK_CONCURRENCY))
+
+    async def cog_load(self):
+        # 每个服务器按自己的时区和触发时间注册每日任务
+        for guild_id, guild_config in GUILD_CONFIGS.items():
+            fm_config = guild_config.get("forum_manager_config") or {}
+            if fm_config.get("enabled", False):
+                self.schedule_daily_task(guild_id, fm_config)
 
     def cog_unload(self):
-        # 当cog卸载时，自动停止所有任务
-        self.master_daily_task.cancel()
-
-    async def _get_tag_to_virtual_role_map(self, guild_id: int) -> dict[str, str]:
-        """
-        动态地从虚拟身份组配置中构建 tag_id -> role_key 的映射。
-        """
-        mapping = {}
-        # 使用我们之前创建的 helper 函数
-        all_virtual_roles = await get_virtual_role_configs_for_guild(guild_id)
-        for role_key, _config in all_virtual_roles.items():
-            tag_id = _config.get("forum_tag_id")
-            if tag_id:  # 确保 tag_id 存在且不为 null
-                mapping[str(tag_id)] = role_key
-        return mapping
-
-    # ==================== 核心任务循环 ====================
-    @tasks.loop(time=time(hour=0, minute=0, second=0, tzinfo=pytz.timezone("Asia/Shanghai")))
-    async def master_daily_task(self):
-        """
-        主每日任务循环。每天0点触发，然后遍历所有服务器执行管理。
-        """
-        self.logger.info("主每日任务触发，开始为所有已配置的服务器执行论坛管理...")
+        # 当cog卸载时，取消所有服务器的每日任务
+        self.bot.scheduler.cancel_all(DAILY_JOB_NAME)
 
+    # ==================== 每日任务调度 ====================
+    def schedule_daily_task(self, guild_id: int, fm_config: dict):
+        """在服务器本地时间的触发时间注册每日任务，夏令时切换由调度器处理。"""
+        trigger_time_str = fm_config.get("daily_task_time", DAILY_TASK_TRIGGER_TIME)
+        try:
+            trigger_time = parse_time(trigger_time_str)
+        except ValueError:
+            self.logger.error(f"服务器 {guild_id} 的每日任务时间 '{trigger_time_str}' 格式错误，将使用默认时间 00:00")
+            trigger_time = time(hour=0, minute=0)
+        try:
+            local_tz = pytz.timezone(fm_config.get("timezone", "UTC"))
+        except pytz.UnknownTimeZoneError:
+            self.logger.error(f"服务器 {guild_id} 的时区 '{fm_config.get('timezone')}' 无效，将使用 UTC")
+            local_tz = pytz.utc
+
+        job = self.bot.scheduler.daily(
+            DAILY_JOB_NAME, lambda: self.run_scheduled_daily_task(guild_id), trigger_time, local_tz, guild_id
+        )
+        self.logger.info(
+            f"服务器 {guild_id} 的每日任务将于 {job.next_run.astimezone(local_tz):%Y-%m-%d %H:%M %Z} 执行。"
+        )
+
+    async def run_scheduled_daily_task(self, guild_id: int):
+        """调度器触发的每日任务，每个服务器在各自的本地时间独立运行。"""
         # 确保在机器人准备就绪后才执行
         await self.bot.wait_until_ready()
-
-        for guild in self.bot.guilds:
-            guild_config = GUILD_CONFIGS.get(guild.id, {})
-            fm_config = guild_config.get("forum_manager_config")
-
-            # 检查此服务器是否启用了该功能
-            if fm_config and fm_config.get("enabled", False):
-                self.logger.info(f"-> 正在为服务器 '{guild.name}' ({guild.id}) 执行任务...")
-                try:
-                    # 调用为单个服务器设计的管理函数
-                    await self.daily_forum_management(guild.id)
-                except Exception as e:
-                    self.logger.error(f"在为服务器 '{guild.name}' 执行每日任务时捕获到未处理的异常: {e}", exc_info=True)
-
-        self.logger.info("所有服务器的每日论坛管理执行完毕。")
-
-    @master_daily_task.before_loop
-    async def before_master_daily_task(self):
-        """在任务循环开始前，等待机器人完全准备就绪。"""
-        self.logger.info("每日主任务正在等待机器人上线...")
-        await self.bot.wait_until_ready()
-        self.logger.info("机器人已上线，每日主任务准备就绪。")
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            self.logger.warning(f"每日任务：找不到服务器 {guild_id}。")
+            return
+        result = await self._run_guild_daily_task(guild, self.daily_semaphore)
+        self.logger.info(f"每日论坛管理执行完毕: {result.summary()}")
+
+    async def _run_guild_daily_task(self, guild: discord.Guild, semaphore: asyncio.Semaphore) -> DailyRunResult:
+        """在并发限制和超时内为一个服务器执行每日任务，异常不会影响其他服务器。"""
+        async with semaphore:
+            self.logger.info(f"-> 正在为服务器 '{guild.name}' ({guild.id}) 执行任务...")
+            result = DailyRunResult(guild_id=guild.id, guild_name=guild.name)
+            started = asyncio.get_running_loop().time()
+            try:
+                # 调用为单个服务器设计的管理函数，进度直接记录在 result 中，超时也能保留已完成的部分
+                await asyncio.wait_for(self.daily_forum_management(guild.id, result), timeout=DAILY_TASK_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                result.error = f"超时 ({DAILY_TASK_TIMEOUT_SECONDS}s)"
+                self.logger.error(f"服务器 '{guild.name}' 的每日任务执行超时。")
+            except Exception as e:
+                result.error = str(e)
+                self.logger.error(f"在为服务器 '{guild.name}' 执行每日任务时捕获到未处理的异常: {e}", exc_info=True)
+            result.elapsed = asyncio.get_running_loop().time() - started
+            return result
 
     # --- 辅助函数 ---
     async def find_daily_briefing_thread(self, forum: discord.ForumChannel, target_date: datetime.date) -> Optional[discord.Thread]:
-        """通过标题和标签在论坛中查找指定日期的快讯帖子。(已使用健壮的日期匹配)"""
-        # ==================== 正则表达式构建 ====================
-        # 分别处理月和日
-        month = target_date.month
-        day = target_date.day
-
-        # 如果月份是单位数，则构建一个可以匹配带或不带前导零的模式 (e.g., (0?7))
-        # 否则，直接使用两位数
-        month_pattern = f"(0?{month})" if month < 10 else str(month)
-
-        # 对日期做同样处理
-        day_pattern = f"(0?{day})" if day < 10 else str(day)
-
-        # 组合成最终的日期匹配模式
-        date_pattern_str = f"{target_date.year}年{month_pattern}月{day_pattern}日"
-
-        title_pattern = re.compile(f"🗞️.*?每日快讯.*?-.*?{date_pattern_str}")
-        # =============================================================
+        """
+        查找指定日期的快讯帖子。先查持久化的日期索引 (并对照缓存验证)，
+        索引没有记录时才遍历活跃帖子，最后才翻查归档帖子。
+        """
+        # 1. 日期索引
+        thread_id = self.briefing_index.get(forum.guild.id, target_date)
+        if thread_id is not None:
+            thread = forum.guild.get_thread(thread_id)
+            if thread is None:
+                # 不在缓存中，可能已被归档
+                try:
+                    thread = await forum.guild.fetch_channel(thread_id)
+                except (discord.NotFound, discord.Forbidden):
+                    thread = None
+            if (isinstance(thread, discord.Thread) and thread.parent_id == forum.id
+                    and parse_briefing_date(thread.name) == target_date):
+                return thread
+            self.briefing_index.discard(forum.guild.id, thread_id)
 
-        # 检查活跃帖子
+        # 2. 检查活跃帖子
         for thread in forum.threads:
-            if title_pattern.search(thread.name):
+            if parse_briefing_date(thread.name) == target_date:
+                self.briefing_index.set(forum.guild.id, target_date, thread.id)
                 return thread
 
-        # 检查归档帖子 (更耗时)
+        # 3. 检查归档帖子 (更耗时)
         try:
             async for thread in forum.archived_threads(limit=200):  # 限制查找范围
-                if title_pattern.search(thread.name):
+                if parse_briefing_date(thread.name) == target_date:
+                    self.briefing_index.set(forum.guild.id, target_date, thread.id)
                     return thread
         except discord.Forbidden:
             self.logger.warning(f"无法在论坛 '{forum.name}' 中搜索归档帖子，权限不足。")
 
         return None
 
+    @commands.Cog.listener()
+    async def on_thread_create(self, thread: discord.Thread):
+        """新快讯帖子 (包括手动创建的) 创建时记录到日期索引。"""
+        fm_config = GUILD_CONFIGS.get(thread.guild.id, {}).get("forum_manager_config") or {}
+        if thread.parent_id != fm_config.get("forum_channel_id"):
+            return
+        briefing_date = parse_briefing_date(thread.name)
+        if briefing_date is not None:
+            self.briefing_index.set(thread.guild.id, briefing_date, thread.id)
+
+    @commands.Cog.listener()
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
+        self.briefing_index.discard(payload.guild_id, payload.thread_id)
+
+    def _edit_job(self, guild: discord.Guild, change: ThreadChange, result: DailyRunResult) -> EditJob:
+        """构造一个交给 EditPacer 执行的帖子编辑。"""
+        async def edit():
+            await change.thread.edit(**change.changes)
+            if change.changes.get("archived"):
+                result.archived += 1
+                self.logger.info(f"[{guild.name}] 已归档帖子: {change.thread.name}")
+        return channel_edit_key(change.thread.id), edit
+
     # --- 核心每日任务逻辑 ---
-    async def daily_forum_management(self, guild_id: int):
-        """每日任务的主体，由tasks.loop调用。"""
+    async def daily_forum_management(self, guild_id: int, result: Optional[DailyRunResult] = None,
+                                     dry_run: bool = False) -> Optional[DailyRunResult]:
+        """
+        每日任务的主体，由调度器按服务器的本地时间调用。执行情况记录在 result 中并返回；服务器未启用时返回 None。
+        dry_run 为 True 时只生成计划 (记录在 result.planned 中)，不修改任何帖子。
+        """
         # 从 task 对象获取 guild_id
         guild = self.bot.get_guild(guild_id)
         if not guild:
@@ -150,7 +216,10 @@ class ForumManagerCog(commands.Cog, name="ForumManager"):
         if not fm_config or not fm_config.get("enabled", False):
             return  # 如果服务器禁用了此功能，则跳过
 
-        self.logger.info(f"[{guild.name}] 开始执行每日论坛管理任务...")
+        self.logger.info(f"[{guild.name}] 开始执行每日论坛管理任务{'（预演）' if dry_run else ''}...")
+        if result is None:
+            result = DailyRunResult(guild_id=guild.id, guild_name=guild.name)
+        result.dry_run = dry_run
 
         # 获取配置
         forum_id = fm_config["forum_channel_id"]
@@ -170,12 +239,12 @@ class ForumManagerCog(commands.Cog, name="ForumManager"):
         forum = guild.get_channel(forum_id)
         if not isinstance(forum, discord.ForumChannel):
             self.logger.error(f"[{guild.name}] 配置的论坛频道ID {forum_id} 无效或不是论坛频道。")
-            return
+            result.error = "论坛频道无效"
+            return result
 
         # 获取服务器的本地时区
         local_tz = pytz.timezone(fm_config.get("timezone", "UTC"))
         today = datetime.now(local_tz).date()
-        yesterday = today - timedelta(days=1)
 
         self.logger.info(f"[{guild.name}] 正在查找今天的快讯帖子...")
         today_thread = await self.find_daily_briefing_thread(forum, today)
@@ -184,67 +253,52 @@ class ForumManagerCog(commands.Cog, name="ForumManager"):
         else:
             self.logger.info(f"[{guild.name}] 未找到今天的快讯帖子，将在稍后创建。")
 
-        self.logger.info(f"[{guild.name}] 正在开始归档旧的快讯帖子")
-        # --- 任务1: 归档旧的快讯帖子 ---
+        briefing_tag = forum.get_tag(briefing_tag_id)
+        past_tag = forum.get_tag(past_briefing_tag_id)
+        if not briefing_tag or not past_tag:
+            self.logger.error(f"[{guild.name}] 快讯或PAST快讯标签ID无效，跳过归档旧快讯。")
+
+        # === 使用可配置的归档截止时间 ===
+        # 只归档带有自动归档标签 (如“每日总结”) 的过时帖子，其他新闻贴不会被机器人自动关闭
+        cutoff_time_str = fm_config.get("archive_cutoff_time", "00:00")
+        cutoff_hour, cutoff_minute = map(int, cutoff_time_str.split(':'))
+        cutoff_time = datetime.now(local_tz).replace(
+            hour=cutoff_hour,
+            minute=cutoff_minute,
+            second=0,
+            microsecond=0
+        ) - timedelta(days=1)
+
+        # --- 生成计划: 每个帖子只分类一次，只包含与当前状态不同的字段 ---
+        plan = plan_forum(
+            forum, today_thread,
+            briefing_tag=briefing_tag,
+            past_tag=past_tag,
+            long_term_tag_id=long_term_tag_id,
+            auto_archive_tag_ids=auto_archive_tag_ids,
+            cutoff_time=cutoff_time,
+        )
+        result.planned = plan.describe()
+        result.api_calls = plan.api_calls
+        self.logger.info(f"[{guild.name}] 计划编辑 {len(plan.edits)} 个帖子，预计 {plan.api_calls} 次请求。")
+        if dry_run:
+            return result
+
+        # --- 任务1: 归档旧快讯和过时帖子 (按速率限制的剩余额度并行执行) ---
+        # 必须先于置顶今日快讯，旧快讯取消置顶后才能置顶新的
         try:
-            briefing_tag = forum.get_tag(briefing_tag_id)
-            past_tag = forum.get_tag(past_briefing_tag_id)
-
-            if not briefing_tag or not past_tag:
-                self.logger.error(f"[{guild.name}] 快讯或PAST快讯标签ID无效。")
-            else:
-                for thread in forum.threads:
-                    # 如果帖子已经归档，直接跳过
-                    if thread.archived:
-                        continue
-
-                    is_briefing = briefing_tag in thread.applied_tags
-                    is_past = past_tag in thread.applied_tags
-
-                    # 确定是否需要归档
-                    should_archive = False
-
-                    # 情况1: 帖子是“每日快讯”，但不是今天的帖子
-                    if is_briefing:
-                        # 如果是今天的帖子，就跳过它
-                        if today_thread and thread.id == today_thread.id:
-                            continue
-                        # 否则，它就是一个需要归档的旧快讯
-                        should_archive = True
-
-                    # 情况2: 帖子被标记为 "PAST"，但还没归档
-                    elif is_past:
-                        should_archive = True
-
-                    # 如果确定需要归档，就执行操作
-                    if should_archive:
-                        self.logger.info(f"[{guild.name}] 准备归档帖子: {thread.name}")
-
-                        # 准备新的标签列表：确保有PAST标签，移除每日快讯标签
-                        new_tags = [tag for tag in thread.applied_tags if tag.id != briefing_tag_id]
-                        if past_tag not in new_tags:
-                            new_tags.append(past_tag)
-
-                        await thread.edit(
-                            pinned=False,
-                            locked=True,
-                            archived=True,
-                            applied_tags=new_tags
-                        )
-                        self.logger.info(f"[{guild.name}] 已成功归档: {thread.name}")
-                        await asyncio.sleep(1)  # 避免速率限制
-
+            await self.edit_pacer.run([self._edit_job(guild, change, result) for change in plan.edits], "归档帖子")
         except Exception as e:
-            self.logger.error(f"[{guild.name}] 归档旧快讯时出错: {e}", exc_info=True)
+            self.logger.error(f"[{guild.name}] 归档帖子时出错: {e}", exc_info=True)
 
         self.logger.info(f"[{guild.name}] 正在开始发布今天的新闻快讯")
         # --- 任务2: 发布今天的新闻快讯 ---
         try:
             # 检查是否已存在今天的帖子
-            if today_thread:
+            if plan.briefing:
                 self.logger.info(f"[{guild.name}] 已有{today_thread.name}，进行置顶。")
-                await today_thread.edit(pinned=True, locked=True)
-            else:
+                await today_thread.edit(**plan.briefing.changes)
+            elif plan.create_briefing:
                 # 使用固定格式，避免 strftime 的平台差异
                 today_str = f"{today.year}年{today.month}月{today.day}日"
 
@@ -286,67 +340,21 @@ class ForumManagerCog(commands.Cog, name="ForumManager"):
 点击此处前往领取或取下相应新闻的身份组通知:https://discord.com/channels/1134557553011998840/1383603412956090578/1399856491745382512
 --------------------------------
 """
-                briefing_tag = forum.get_tag(briefing_tag_id)
 
                 new_thread, _ = await forum.create_thread(
                     name=post_title,
                     content=post_content,
                     applied_tags=[briefing_tag] if briefing_tag else [],
                 )
+                self.briefing_index.set(guild.id, today, new_thread.id)
+                result.created = True
                 await new_thread.edit(pinned=True, locked=True)
                 self.logger.info(f"[{guild.name}] 已成功创建、置顶并锁定今日快讯: {new_thread.name}")
         except Exception as e:
             self.logger.error(f"[{guild.name}] 创建今日快讯时出错: {e}", exc_info=True)
 
-        self.logger.info(f"[{guild.name}] 正在开始归档其他过时帖子")
-
-        # --- 任务3: 归档带有特定【每日总结】标签的帖子 ---
-        # 修改说明：以前是归档所有过时的帖子（除长期外）。
-        # 现在改为：只归档带有 "每日总结" (daily_summary_tag_id) 标签的帖子。
-        # 其他新闻贴将不再被机器人自动监控和关闭。
-        try:
-            # === 使用可配置的归档截止时间 ===
-            cutoff_time_str = fm_config.get("archive_cutoff_time", "00:00")
-            cutoff_hour, cutoff_minute = map(int, cutoff_time_str.split(':'))
-
-            cutoff_time = datetime.now(local_tz).replace(
-                hour=cutoff_hour,
-                minute=cutoff_minute,
-                second=0,
-                microsecond=0
-            ) - timedelta(days=1)
-            # =================================
-            # 遍历活跃帖子
-            for thread in forum.threads:
-                # 如果帖子已归档或锁定，跳过
-                if thread.archived:
-                    continue
-
-                # 获取当前帖子的标签ID集合
-                applied_tag_ids = {tag.id for tag in thread.applied_tags}
-
-                # 条件A: 是否包含长期更新标签 (如果有，绝对不归档)
-                is_long_term = long_term_tag_id in applied_tag_ids
-
-                # 条件B: 是否包含需要归档的标签
-                should_archive_by_tag = bool(applied_tag_ids.intersection(auto_archive_tag_ids))
-
-                # 安全检查：不要归档今天的快讯
-                if thread.created_at >= cutoff_time or not should_archive_by_tag or is_long_term:
-                    continue
-
-                # 额外检查，确保不会意外归档今天的快讯（双重保险）
-                if today_thread and thread.id == today_thread.id:
-                    continue
-
-                await thread.edit(locked=True, archived=True)
-                self.logger.info(f"[{guild.name}] 已归档过时帖子: {thread.name}")
-                await asyncio.sleep(1)
-
-        except Exception as e:
-            self.logger.error(f"[{guild.name}] 归档其他过时帖子时出错: {e}", exc_info=True)
-
         self.logger.info(f"[{guild.name}] 每日论坛管理任务执行完毕。")
+        return result
 
     # --- 斜杠指令 ---
     forum_group = app_commands.Group(
@@ -356,11 +364,27 @@ class ForumManagerCog(commands.Cog, name="ForumManager"):
     )
 
     @forum_group.command(name="手动执行每日任务", description="[记者] 手动触发一次每日发帖和归档流程。")
+    @app_commands.describe(dry_run="只列出计划的修改和预计的请求数，不实际执行")
     @is_admin()
-    async def manual_run_daily_task(self, interaction: discord.Interaction):
-        await interaction.response.send_message("⌛ 正在手动执行每日论坛管理任务...", ephemeral=True)
-        await self.daily_forum_management(interaction.guild.id)
-        await interaction.followup.send("✅ 任务执行完毕。", ephemeral=True)
+    async def manual_run_daily_task(self, interaction: discord.Interaction, dry_run: bool = False):
+        await interaction.response.send_message(
+            "⌛ 正在生成每日论坛管理计划..." if dry_run else "⌛ 正在手动执行每日论坛管理任务...", ephemeral=True
+        )
+        started = asyncio.get_running_loop().time()
+        result = await self.daily_forum_management(interaction.guild.id, dry_run=dry_run)
+        if result is None:
+            await interaction.followup.send("ℹ️ 此服务器未启用论坛管理。", ephemeral=True)
+            return
+        result.elapsed = asyncio.get_running_loop().time() - started
+        if not dry_run:
+            await interaction.followup.send(f"✅ 任务执行完毕。\n> {result.summary()}", ephemeral=True)
+            return
+
+        lines = [f"- {line}" for line in result.planned[:DRY_RUN_MAX_LINES]]
+        if len(result.planned) > DRY_RUN_MAX_LINES:
+            lines.append(f"...以及其他 {len(result.planned) - DRY_RUN_MAX_LINES} 项")
+        content = f"📝 预演完成，未修改任何帖子。\n> {result.summary()}\n" + ("\n".join(lines) or "无需修改。")
+        await interaction.followup.send(content[:2000], ephemeral=True)
 
     @forum_group.command(name="通知并更新快讯", description="[记者] 在当前帖子中使用，以通知订阅者并更新到每日快讯。")
     @is_admin()
@@ -387,25 +411,53 @@ class ForumManagerCog(commands.Cog, name="ForumManager"):
             await interaction.followup.send("❌ 内部错误：虚拟身份组或@模块未加载。", ephemeral=True)
             return
 
-        tag_map = await self._get_tag_to_virtual_role_map(interaction.guild_id)
+        # 标签 -> 新闻组的索引由配置管理器维护，这里只需一次字典查找
+        tag_role_map = vr_cog.config_manager.get_tag_role_map(interaction.guild_id)
 
-        mentioned_keys = []
+        # 所有标签对应的新闻组合并为一次投递，订阅了多个组的成员只会被提及一次
+        matched = {}
         for tag in thread.applied_tags:
-            if str(tag.id) in tag_map:
-                role_key = tag_map[str(tag.id)]
-                user_ids = await vr_cog.data_manager.get_users_in_role(role_key, interaction.guild_id)
-                if user_ids:
-                    await at_cog.perform_temp_role_ping(interaction, user_ids, tag.name, message=None, ghost_ping=True)
-                    self.logger.info(f"为帖子 '{thread.name}' 的 '{role_key}' ({len(user_ids)}人) 执行了幽灵提及。")
-                    vr_config = await get_virtual_role_configs_for_guild(interaction.guild_id)
-                    mentioned_keys.append(vr_config.get(role_key, {}).get('name', role_key))
+            role_key = tag_role_map.get(tag.id)
+            if role_key is not None:
+                matched.setdefault(role_key, tag.name)
+
+        # 提及结果: None 无人被提及 / "sent" 已送达 / "queued" 已加入后台队列 / "failed" 失败
+        ping_status = None
+        if matched:
+            user_ids = await vr_cog.data_manager.get_users_in_roles(matched, interaction.guild_id)
+            if user_ids:
+                label = " & ".join(matched.values())
+                ping_error = None
+                try:
+                    strategy = await at_cog.ping_virtual_group(
+                        interaction, list(matched), user_ids, label, message=None, ghost_ping=True
+                    )
+                    ping_status = "queued" if strategy == STRATEGY_TEMP_ROLE else "sent"
+                except app_commands.MissingPermissions as e:
+                    ping_error = f"机器人缺少权限: {', '.join(e.missing_permissions)}"
+                except discord.Forbidden as e:
+                    ping_error = f"机器人权限不足: {e.text}"
+                except Exception as e:
+                    self.logger.error(f"为帖子 '{thread.name}' 执行提及时出错: {e}", exc_info=True)
+                    ping_error = "发生内部错误"
+                if ping_error:
+                    ping_status = "failed"
+                    await interaction.followup.send(f"❌ 提及失败 ({ping_error})，仍将尝试更新今日快讯。", ephemeral=True)
+                else:
+                    self.logger.info(f"为帖子 '{thread.name}' 的 {list(matched)} ({len(user_ids)}人) 执行了幽灵提及。")
+        ping_summary = {
+            None: "无人被提及",
+            "sent": "提及完成",
+            "queued": "提及已加入后台队列 (进度显示在频道中)",
+            "failed": "提及失败",
+        }[ping_status]
 
         # 2. 更新快讯帖子
         today = datetime.now(pytz.timezone(fm_config.get("timezone", "UTC"))).date()
         briefing_thread = await self.find_daily_briefing_thread(forum, today)
 
         if not briefing_thread:
-            await interaction.followup.send("⚠️ 提及完成，但未找到今日快讯帖子，无法更新。", ephemeral=True)
+            await interaction.followup.send(f"⚠️ {ping_summary}，但未找到今日快讯帖子，无法更新。", ephemeral=True)
             return
 
         try:
@@ -456,10 +508,8 @@ class ForumManagerCog(commands.Cog, name="ForumManager"):
 
             await briefing_thread.send(embed=new_embed)
 
-            msg = f"✅ 提及完成，并已成功更新至今日快讯！"
-            if not mentioned_keys:
-                msg = f"✅ 无人被提及，但已成功更新至今日快讯！"
-            await interaction.followup.send(msg, ephemeral=True)
+            icon = "⚠️" if ping_status == "failed" else "✅"
+            await interaction.followup.send(f"{icon} {ping_summary}，已成功更新至今日快讯！", ephemeral=True)
 
         except Exception as e:
             self.logger.error(f"更新快讯帖子时出错: {e}", exc_info=True)
@@ -0,0 +1,130 @@
+# forum_manager/forum_planner.py
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Collection, Dict, List, Optional
+
+import discord
+
+# 归档原因
+REASON_OLD_BRIEFING = "旧快讯"
+REASON_PAST = "PAST标签"
+REASON_AUTO_ARCHIVE = "自动归档标签"
+REASON_TODAY_BRIEFING = "今日快讯"
+
+
+@dataclass
+class ThreadChange:
+    """一个帖子从当前状态到目标状态需要修改的字段 (即一次 thread.edit 的参数)。"""
+    thread: discord.Thread
+    changes: Dict[str, Any]
+    reasons: List[str] = field(default_factory=list)
+
+    def describe(self) -> str:
+        parts = []
+        for key, value in self.changes.items():
+            if key == "applied_tags":
+                current = {tag.id for tag in self.thread.applied_tags}
+                desired = {tag.id for tag in value}
+                parts += [f"+{tag.name}" for tag in value if tag.id not in current]
+                parts += [f"-{tag.name}" for tag in self.thread.applied_tags if tag.id not in desired]
+            else:
+                parts.append(f"{key}={value}")
+        return f"{self.thread.name} [{' / '.join(self.reasons)}]: {', '.join(parts)}"
+
+
+@dataclass
+class ForumPlan:
+    """一次每日任务对论坛的全部修改。"""
+    edits: List[ThreadChange] = field(default_factory=list)
+    # 今日快讯需要的置顶/锁定 (已有帖子时)，必须在旧快讯取消置顶之后执行
+    briefing: Optional[ThreadChange] = None
+    # 是否需要新建今日快讯 (创建 + 置顶共两次请求)
+    create_briefing: bool = False
+
+    @property
+    def api_calls(self) -> int:
+        return len(self.edits) + (1 if self.briefing else 0) + (2 if self.create_briefing else 0)
+
+    def describe(self) -> List[str]:
+        lines = [change.describe() for change in self.edits]
+        if self.briefing:
+            lines.append(self.briefing.describe())
+        if self.create_briefing:
+            lines.append(f"新建今日快讯并置顶 [{REASON_TODAY_BRIEFING}]")
+        return lines
+
+
+def diff_thread(thread: discord.Thread, *, pinned: Optional[bool] = None, locked: Optional[bool] = None,
+                archived: Optional[bool] = None,
+                applied_tags: Optional[List[discord.ForumTag]] = None) -> Dict[str, Any]:
+    """只返回与帖子当前状态不同的字段，None 表示不关心该字段。"""
+    changes: Dict[str, Any] = {}
+    if pinned is not None and thread.flags.pinned != pinned:
+        changes["pinned"] = pinned
+    if locked is not None and thread.locked != locked:
+        changes["locked"] = locked
+    if applied_tags is not None and {tag.id for tag in applied_tags} != {tag.id for tag in thread.applied_tags}:
+        changes["applied_tags"] = applied_tags
+    if archived is not None and thread.archived != archived:
+        changes["archived"] = archived
+    return changes
+
+
+def plan_forum(
+        forum: discord.ForumChannel,
+        today_thread: Optional[discord.Thread],
+        *,
+        briefing_tag: Optional[discord.ForumTag],
+        past_tag: Optional[discord.ForumTag],
+        long_term_tag_id: Optional[int],
+        auto_archive_tag_ids: Collection[int],
+        cutoff_time: datetime
+) -> ForumPlan:
+    """
+    只遍历一次活跃帖子，为每个帖子确定唯一的目标状态，同时满足多条归档规则的帖子合并为一次编辑。
+    快讯或PAST标签无效时跳过旧快讯规则 (与自动归档规则互不影响)。
+    """
+    plan = ForumPlan()
+    today_id = today_thread.id if today_thread else None
+
+    for thread in forum.threads:
+        if thread.archived or thread.id == today_id:
+            continue
+
+        applied_tag_ids = {tag.id for tag in thread.applied_tags}
+        reasons = []
+        desired: Dict[str, Any] = {}
+
+        # 规则1: 不是今天的“每日快讯”，或带有 PAST 标签但还没归档 -> 换成 PAST 标签、取消置顶、锁定并归档
+        if briefing_tag and past_tag:
+            if briefing_tag.id in applied_tag_ids:
+                reasons.append(REASON_OLD_BRIEFING)
+            elif past_tag.id in applied_tag_ids:
+                reasons.append(REASON_PAST)
+            if reasons:
+                new_tags = [tag for tag in thread.applied_tags if tag.id != briefing_tag.id]
+                if past_tag.id not in applied_tag_ids:
+                    new_tags.append(past_tag)
+                desired.update(pinned=False, locked=True, archived=True, applied_tags=new_tags)
+
+        # 规则2: 带有自动归档标签、创建于截止时间之前且不是长期更新的帖子 -> 锁定并归档
+        if (applied_tag_ids.intersection(auto_archive_tag_ids)
+                and long_term_tag_id not in applied_tag_ids
+                and thread.created_at < cutoff_time):
+            reasons.append(REASON_AUTO_ARCHIVE)
+            desired.update(locked=True, archived=True)
+
+        if reasons:
+            changes = diff_thread(thread, **desired)
+            if changes:
+                plan.edits.append(ThreadChange(thread, changes, reasons))
+
+    if today_thread is None:
+        plan.create_briefing = True
+    else:
+        changes = diff_thread(today_thread, pinned=True, locked=True, archived=False)
+        if changes:
+            plan.briefing = ThreadChange(today_thread, changes, [REASON_TODAY_BRIEFING])
+    return plan
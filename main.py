@@ -16,6 +16,10 @@ from at.at_cog import AtCog
 from forum_manager.forum_manager_cog import ForumManagerCog
 from virtual_role.virtual_role_cog import VirtualRoleCog
 from core.embed_link.embed_manager import EmbedLinkManager
+from utility import member_cache
+from utility.rate_limit import RateLimitMonitor
+from utility.scheduler import Scheduler
+from utility.write_behind import WriteBehindWriter
 
 # ===================================================================
 # 日志设置
@@ -52,9 +56,18 @@ class NewsBot(commands.Bot):
         # 设置机器人需要监听的意图 (Intents)
         intents = discord.Intents.default()
         intents.members = True
-        super().__init__(command_prefix='!', intents=intents, **kwargs)
+        # 通过 aiohttp 的请求追踪记录每个路由的速率限制状态，供批量任务调度使用
+        rate_limits = RateLimitMonitor()
+        # 成员和消息缓存策略见 utility/member_cache.py
+        super().__init__(
+            command_prefix='!', intents=intents, http_trace=rate_limits.trace_config(),
+            **member_cache.client_options(), **kwargs
+        )
         # 将 logger 实例正确地附加到 bot 对象上
         self.logger: logging.Logger = logger
+        self.rate_limits: RateLimitMonitor = rate_limits
+        # 所有定时任务共用的调度器，各模块通过 bot.scheduler.daily / every 注册任务
+        self.scheduler: Scheduler = Scheduler()
 
     async def on_ready(self):
         """当机器人成功登录并准备就绪时调用"""
@@ -77,6 +90,7 @@ class NewsBot(commands.Bot):
     async def setup_hook(self):
         """在机器人登录前执行的异步设置。"""
         await EmbedLinkManager.initialize_all_managers()
+        self.scheduler.start()
         await cog_manager.load_all_enabled()
         self.logger.info("开始同步应用命令...")
 
@@ -89,6 +103,13 @@ class NewsBot(commands.Bot):
             except discord.HTTPException as e:
                 self.logger.error(f"同步命令到服务器 {guild_id} 失败: {e}")
 
+    async def close(self):
+        """关闭机器人。父类会先卸载所有 Cog (各模块在 cog_unload 中提交最后的写入)，之后再停止写线程。"""
+        await super().close()
+        self.scheduler.stop()
+        await asyncio.to_thread(WriteBehindWriter.default().close)
+        self.logger.info("所有待写入的数据已保存。")
+
 
 # ===================================================================
 # Cog 管理器
@@ -165,6 +186,10 @@ async def main():
         logger.error("机器人 Token 无效，请检查环境中的 TOKEN 设置。")
     except Exception as e:
         logger.critical(f"机器人运行时发生致命错误: {e}", exc_info=True)
+    finally:
+        # 无论以何种方式退出，都要卸载 Cog 并等待后台写入完成
+        if not bot.is_closed():
+            await bot.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+# utility/edit_pacer.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+import discord
+
+import config
+from utility.rate_limit import route_key
+
+if TYPE_CHECKING:
+    from main import NewsBot
+
+# 同时进行的编辑请求数。编辑不同帖子走不同的速率限制桶 (以频道ID为主参数)，可以并行
+EDIT_CONCURRENCY = getattr(config, "FORUM_EDIT_CONCURRENCY", 3)
+# 每个桶预留的额度，剩余额度低于此值时等待重置，给同一路由上的其他请求留出余量
+EDIT_BUCKET_RESERVE = 1
+# 每个帖子的编辑都是独立的桶，第一次请求前没有响应头可以参考，因此按已知限额主动保持间隔:
+# 还没有观察到某个路由的响应头时，假设它是 PATCH /channels/{id} 常见的 5 次 / 5 秒
+EDIT_ROUTE_DEFAULT_LIMIT = (5, 5.0)
+# 所有编辑 (所有服务器、所有帖子) 之间的最小间隔 (秒)，避免大量互不相同的桶叠加后触发全局或未公开的服务器级限制
+EDIT_MIN_INTERVAL_SECONDS = getattr(config, "FORUM_EDIT_MIN_INTERVAL_SECONDS", 0.25)
+# 观察到 429 后暂停所有编辑的初始时长 (秒)，连续触发时加倍
+BACKOFF_INITIAL_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+logger = logging.getLogger("NewsBot.EditPacer")
+
+_GLOBAL_KEY = "*"
+# 记录的路由数超过该值时清理已经过期的间隔记录
+_INTERVAL_PRUNE_SIZE = 1024
+
+# (路由键, 执行一次编辑的协程工厂)
+EditJob = Tuple[str, Callable[[], Awaitable[Any]]]
+
+
+def channel_edit_key(channel_id: int) -> str:
+    """编辑频道/帖子 (PATCH /channels/{id}) 的路由键。"""
+    return route_key("PATCH", f"/api/v{discord.http.INTERNAL_API_VERSION}/channels/{channel_id}")
+
+
+@dataclass
+class PacedRunResult:
+    succeeded: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+
+class EditPacer:
+    """
+    批量编辑的自适应节流，替代每次编辑后固定的 sleep。
+
+    - 发请求前通过 bot.rate_limits 查询该路由桶的剩余额度，只在额度将要用尽时等待重置。
+    - 响应头只能反映已经请求过的桶，因此另外主动保持最小间隔：同一路由按其限额 (未知时按
+      EDIT_ROUTE_DEFAULT_LIMIT) 均匀分布请求，所有编辑之间至少间隔 EDIT_MIN_INTERVAL_SECONDS。
+      间隔记录在 EditPacer 上，多个服务器同时执行的批量编辑共用。
+    - 少量 worker 并行处理不同帖子的编辑。
+    - 批量执行期间一旦出现 429，所有 worker 暂停一段时间 (连续触发时加倍)，之后恢复。
+    """
+
+    def __init__(self, bot: 'NewsBot', concurrency: int = EDIT_CONCURRENCY):
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.intervals = _IntervalGate()
+
+    async def run(self, jobs: Iterable[EditJob], description: str = "编辑") -> PacedRunResult:
+        queue: asyncio.Queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        result = PacedRunResult()
+        if queue.empty():
+            return result
+
+        monitor = getattr(self.bot, "rate_limits", None)
+        state = _BackoffState(monitor.ratelimited_count if monitor else 0)
+        started = time.monotonic()
+        workers = [
+            asyncio.create_task(self._worker(queue, monitor, state, self.intervals, result, description))
+            for _ in range(min(self.concurrency, queue.qsize()))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        result.elapsed = time.monotonic() - started
+        logger.debug(f"批量{description}: 成功 {result.succeeded}, 失败 {result.failed}, 耗时 {result.elapsed:.1f}s")
+        return result
+
+    @staticmethod
+    async def _worker(queue: asyncio.Queue, monitor, state: '_BackoffState', intervals: '_IntervalGate',
+                      result: PacedRunResult, description: str):
+        while True:
+            try:
+                key, edit = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            await state.wait()
+            await intervals.wait(_GLOBAL_KEY, EDIT_MIN_INTERVAL_SECONDS)
+            await intervals.wait(key, _route_interval(monitor, key))
+            if monitor:
+                await monitor.acquire(key, reserve=EDIT_BUCKET_RESERVE)
+            try:
+                await edit()
+                result.succeeded += 1
+            except discord.HTTPException as e:
+                logger.warning(f"{description}失败 ({key}): {e}")
+                result.failed += 1
+            if monitor:
+                state.observe(monitor.ratelimited_count)
+
+
+def _route_interval(monitor, key: str) -> float:
+    """同一路由上两次请求之间的最小间隔：时间窗口 / 每个窗口的请求数。"""
+    state = monitor.get_state(key) if monitor else None
+    if state is not None and state.reset_after > 0:
+        return state.reset_after / max(state.limit, 1)
+    limit, window = EDIT_ROUTE_DEFAULT_LIMIT
+    return window / limit
+
+
+class _IntervalGate:
+    """按键保持请求之间的最小间隔。调用方在等待之前就预约好自己的时刻，并发的调用方依次排开。"""
+
+    def __init__(self):
+        # { 键: 下一个请求最早可以发出的 time.monotonic() }
+        self._next_at: Dict[str, float] = {}
+
+    async def wait(self, key: str, interval: float):
+        now = time.monotonic()
+        if len(self._next_at) > _INTERVAL_PRUNE_SIZE:
+            self._next_at = {k: t for k, t in self._next_at.items() if t > now}
+        at = max(now, self._next_at.get(key, 0.0))
+        self._next_at[key] = at + interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+class _BackoffState:
+    """一次批量执行中共享的退避状态。"""
+
+    def __init__(self, ratelimited_count: int):
+        self._last_count = ratelimited_count
+        self._pause_until = 0.0
+        self._backoff = BACKOFF_INITIAL_SECONDS
+
+    def observe(self, ratelimited_count: int):
+        if ratelimited_count > self._last_count:
+            self._last_count = ratelimited_count
+            self._pause_until = time.monotonic() + self._backoff
+            logger.info(f"批量编辑触发了速率限制，暂停 {self._backoff:.0f}s。")
+            self._backoff = min(self._backoff * 2, BACKOFF_MAX_SECONDS)
+        elif time.monotonic() > self._pause_until:
+            self._backoff = BACKOFF_INITIAL_SECONDS
+
+    async def wait(self):
+        delay = self._pause_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,99 @@
+# utility/member_cache.py
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Dict, Iterable
+
+import discord
+
+import config
+
+# 成员缓存策略:
+#   "full"        启动时缓存所有服务器的全部成员 (discord.py 默认行为)
+#   "subscribers" 不在启动时拉取成员列表，只在需要时按ID查询并缓存用到的成员 (订阅者等)，
+#                 启动时间和内存占用随订阅人数而不是服务器人数增长。
+#                 代价是网关请求：每个未缓存的ID都要通过网关 (OP 8, 每批 100 个) 查询。查到的成员会留在缓存中
+#                 直到离开服务器；查不到的ID在 ABSENT_CACHE_MINUTES 内不再重复查询，
+#                 因此定期清理/校正只会为新订阅者和缓存过期的离开成员发出请求。
+MEMBER_CACHE_POLICY = getattr(config, "MEMBER_CACHE_POLICY", "full")
+# 按需缓存时，确认不在服务器内的ID多长时间内不再重复查询 (分钟)，应大于订阅清理的间隔；
+# 期间重新加入的成员会通过 on_member_join 立即移出该记录
+ABSENT_CACHE_MINUTES = getattr(config, "MEMBER_ABSENT_CACHE_MINUTES", 360)
+# 每个频道缓存的最近消息数，机器人不需要读取历史消息时可以调小或设为 None
+MESSAGE_CACHE_SIZE = getattr(config, "MESSAGE_CACHE_SIZE", 1000)
+# 网关按ID查询成员时每次请求的上限
+QUERY_BATCH_SIZE = 100
+
+logger = logging.getLogger("NewsBot.MemberCache")
+
+# 已确认不在服务器内的ID: { guild_id: { user_id: 过期时间 (monotonic) } }
+_absent: Dict[int, Dict[int, float]] = {}
+
+
+def is_lazy() -> bool:
+    return MEMBER_CACHE_POLICY == "subscribers"
+
+
+def client_options() -> Dict[str, Any]:
+    """传给 discord.Client 的缓存相关参数。"""
+    options: Dict[str, Any] = {"max_messages": MESSAGE_CACHE_SIZE}
+    if is_lazy():
+        # 不缓存新加入的成员和语音状态，成员只通过 resolve_members 按需进入缓存
+        options["chunk_guilds_at_startup"] = False
+        options["member_cache_flags"] = discord.MemberCacheFlags.none()
+    return options
+
+
+def mark_absent(guild_id: int, user_id: int):
+    """记录一个已确认不在服务器内的成员 (例如收到离开事件时)。完整缓存成员列表时不需要记录。"""
+    if is_lazy():
+        _absent.setdefault(guild_id, {})[user_id] = time.monotonic() + ABSENT_CACHE_MINUTES * 60
+
+
+def mark_present(guild_id: int, user_id: int):
+    """成员 (重新) 加入服务器时调用，下次解析时重新查询。"""
+    guild_absent = _absent.get(guild_id)
+    if guild_absent:
+        guild_absent.pop(user_id, None)
+
+
+async def resolve_members(guild: discord.Guild, user_ids: Iterable[int]) -> Dict[int, discord.Member]:
+    """
+    返回 user_ids 中仍在服务器内的成员。
+
+    成员列表完整 (guild.chunked) 时只查缓存；否则未命中缓存、且最近没有被确认为不在服务器内的ID
+    按每批 100 个通过网关查询，查到的成员会被缓存，未返回的即为不在服务器内 (记录下来，过期前不再查询)。
+    查询超时会抛出 asyncio.TimeoutError。
+    """
+    found: Dict[int, discord.Member] = {}
+    missing = []
+    now = time.monotonic()
+    guild_absent = _absent.get(guild.id, {})
+    for user_id in [user_id for user_id, expires_at in guild_absent.items() if expires_at <= now]:
+        del guild_absent[user_id]
+    skipped = 0
+    for user_id in user_ids:
+        member = guild.get_member(user_id)
+        if member is not None:
+            found[user_id] = member
+        elif guild.chunked:
+            continue
+        elif user_id in guild_absent:
+            skipped += 1
+        else:
+            missing.append(user_id)
+
+    queried = 0
+    for i in range(0, len(missing), QUERY_BATCH_SIZE):
+        batch = missing[i:i + QUERY_BATCH_SIZE]
+        for member in await guild.query_members(user_ids=batch, limit=len(batch), cache=True):
+            found[member.id] = member
+            queried += 1
+        for user_id in batch:
+            if user_id not in found:
+                mark_absent(guild.id, user_id)
+    if missing or skipped:
+        logger.debug(f"服务器 {guild.id}: 按需查询了 {len(missing)} 名成员，其中 {queried} 名仍在服务器内；"
+                     f"{skipped} 名近期已确认不在服务器内，未重复查询。")
+    return found
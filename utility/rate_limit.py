@@ -0,0 +1,111 @@
+# utility/rate_limit.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger("NewsBot.RateLimit")
+
+# 路径中的 Snowflake ID。第一个 guilds/channels/webhooks 之后的 ID 是 Discord 划分速率限制桶的主参数，需要保留
+_SNOWFLAKE_PATTERN = re.compile(r'/\d+(?=/|$)')
+_MAJOR_PARAMETER_PATTERN = re.compile(r'^/api/v\d+/(guilds|channels|webhooks)/(\d+)')
+
+
+def route_key(method: str, path: str) -> str:
+    """
+    把请求归一化为速率限制的路由键，例如
+    PUT /api/v10/guilds/1/members/2/roles/3 -> "PUT /guilds/1/members/{id}/roles/{id}"。
+    """
+    major = _MAJOR_PARAMETER_PATTERN.match(path)
+    if major:
+        rest = path[major.end():]
+        normalized = f"/{major.group(1)}/{major.group(2)}" + _SNOWFLAKE_PATTERN.sub('/{id}', rest)
+    else:
+        normalized = _SNOWFLAKE_PATTERN.sub('/{id}', re.sub(r'^/api/v\d+', '', path))
+    return f"{method.upper()} {normalized}"
+
+
+@dataclass
+class BucketState:
+    """从最近一次响应头得到的速率限制桶状态。"""
+    bucket: Optional[str]
+    limit: int
+    remaining: int
+    reset_at: float  # time.monotonic() 时间
+    reset_after: float = 0.0  # 收到响应时距离重置的秒数，可近似为该桶的时间窗口
+
+    def wait_time(self) -> float:
+        if self.remaining > 0:
+            return 0.0
+        return max(0.0, self.reset_at - time.monotonic())
+
+
+class RateLimitMonitor:
+    """
+    通过 aiohttp 的 TraceConfig 观察 discord.py 发出的每个 REST 请求，记录各路由的
+    X-RateLimit-* 响应头和 429 次数。批量任务可以在发请求前查询剩余额度，主动等待桶重置，
+    让请求保持在限额之内而不是撞上 429。
+
+    discord.py 本身也会按桶排队请求，这里的状态只用于调度和监控，不会替代它的处理。
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, BucketState] = {}
+        self.ratelimited_count = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """传给 discord.Client(http_trace=...) 的 TraceConfig。"""
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(self._on_request_end)
+        return trace_config
+
+    async def _on_request_end(self, _session, _context, params: aiohttp.TraceRequestEndParams):
+        headers = params.response.headers
+        key = route_key(params.method, params.url.path)
+        if params.response.status == 429:
+            self.ratelimited_count += 1
+            scope = headers.get('X-RateLimit-Scope', 'unknown')
+            logger.warning(f"{key} 触发了速率限制 (scope: {scope}, retry-after: {headers.get('Retry-After')})")
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        if remaining is None:
+            return
+        try:
+            reset_after = float(headers.get('X-RateLimit-Reset-After', 0))
+            self._routes[key] = BucketState(
+                bucket=headers.get('X-RateLimit-Bucket'),
+                limit=int(headers.get('X-RateLimit-Limit', 1)),
+                remaining=int(remaining),
+                reset_at=time.monotonic() + reset_after,
+                reset_after=reset_after,
+            )
+        except ValueError:
+            pass
+
+    def get_state(self, key: str) -> Optional[BucketState]:
+        return self._routes.get(key)
+
+    async def acquire(self, key: str, reserve: int = 0):
+        """
+        在向路由发请求之前调用：额度用尽时等待到桶重置。
+        在响应头到达之前先在本地扣减一次额度，避免并发的调用方同时认为还有剩余。
+        reserve > 0 时为其他请求预留额度，剩余额度不超过 reserve 时就开始等待。
+        """
+        while True:
+            state = self._routes.get(key)
+            if state is None:
+                return
+            wait = state.wait_time() if state.remaining > reserve else max(0.0, state.reset_at - time.monotonic())
+            if wait <= 0:
+                state.remaining -= 1
+                return
+            await asyncio.sleep(wait)
+            if state is self._routes.get(key):
+                # 等待期间没有新的响应更新状态，说明桶已经按时重置
+                state.remaining = state.limit
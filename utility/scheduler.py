@@ -0,0 +1,196 @@
+# utility/scheduler.py
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta, tzinfo
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pytz
+
+# 调度循环单次最长睡眠时间 (秒)。到期时间按 UTC 墙上时钟计算，定期醒来可以修正系统时钟的跳变
+MAX_SLEEP_SECONDS = 60.0
+# 不属于任何服务器的任务使用的 guild_id
+GLOBAL_JOB = 0
+
+logger = logging.getLogger("NewsBot.Scheduler")
+
+# 给定上一次计划运行的时间 (UTC)，返回下一次运行时间 (UTC)
+NextRun = Callable[[datetime], datetime]
+
+
+def utcnow() -> datetime:
+    return datetime.now(pytz.utc)
+
+
+def parse_time(value: str) -> time:
+    """解析 "HH:MM" 格式的时间，格式错误时抛出 ValueError。"""
+    hour, minute = map(int, value.split(':'))
+    return time(hour=hour, minute=minute)
+
+
+def localize(tz: tzinfo, naive: datetime) -> datetime:
+    """
+    把本地时间转换为带时区的时间，处理夏令时切换:
+    重复的时刻 (回拨) 取第一次出现，不存在的时刻 (前拨) 顺延到跳变之后。
+    """
+    if not hasattr(tz, "localize"):
+        return naive.replace(tzinfo=tz)
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        return tz.localize(naive, is_dst=True)
+    except pytz.NonExistentTimeError:
+        return tz.normalize(tz.localize(naive, is_dst=False))
+
+
+def daily_at(local_time: time, tz: tzinfo) -> NextRun:
+    """每天在 tz 时区的 local_time 运行，夏令时切换前后都按当地时间计算。"""
+    def next_run(after: datetime) -> datetime:
+        day = after.astimezone(tz).date()
+        while True:
+            candidate = localize(tz, datetime.combine(day, local_time)).astimezone(pytz.utc)
+            if candidate > after:
+                return candidate
+            day += timedelta(days=1)
+    return next_run
+
+
+def every(interval: timedelta) -> NextRun:
+    """每隔 interval 运行一次。"""
+    def next_run(after: datetime) -> datetime:
+        return after + interval
+    return next_run
+
+
+@dataclass(eq=False)
+class ScheduledJob:
+    name: str
+    guild_id: int
+    callback: Callable[[], Awaitable[Any]]
+    next_run_after: NextRun
+    next_run: datetime
+    cancelled: bool = False
+    running: Optional[asyncio.Task] = field(default=None, repr=False)
+
+
+class Scheduler:
+    """
+    所有定时任务共用的调度器：一个按 (下次运行的UTC时间, guild_id) 排序的最小堆和一个后台循环。
+
+    - 每个任务用 (name, guild_id) 标识，重复注册会替换旧任务；取消的任务在出堆时丢弃。
+    - 循环只睡到堆顶任务到期 (有新任务插到前面时会被唤醒)，到期的任务在独立的 Task 中运行，
+      运行时间较长的任务不会推迟其他任务；同一任务上一次还没结束时跳过本次。
+    - 每个服务器可以按自己的时区注册任务，到期时间自然分散在一天中。
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int, int, ScheduledJob]] = []
+        self._jobs: Dict[Tuple[str, int], ScheduledJob] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- 生命周期 ---
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for job in self._jobs.values():
+            if job.running:
+                job.running.cancel()
+
+    # --- 注册 ---
+
+    def schedule(self, name: str, callback: Callable[[], Awaitable[Any]], next_run_after: NextRun,
+                 guild_id: int = GLOBAL_JOB, first_run: Optional[datetime] = None) -> ScheduledJob:
+        """注册一个任务，first_run 为空时从现在开始计算第一次运行时间。"""
+        self.cancel(name, guild_id)
+        job = ScheduledJob(name, guild_id, callback, next_run_after, first_run or next_run_after(utcnow()))
+        self._jobs[(name, guild_id)] = job
+        self._push(job)
+        return job
+
+    def daily(self, name: str, callback: Callable[[], Awaitable[Any]], at: time, tz: tzinfo,
+              guild_id: int = GLOBAL_JOB) -> ScheduledJob:
+        return self.schedule(name, callback, daily_at(at, tz), guild_id)
+
+    def every(self, name: str, callback: Callable[[], Awaitable[Any]], interval: timedelta,
+              guild_id: int = GLOBAL_JOB, run_now: bool = False) -> ScheduledJob:
+        return self.schedule(name, callback, every(interval), guild_id, first_run=utcnow() if run_now else None)
+
+    def cancel(self, name: str, guild_id: int = GLOBAL_JOB):
+        job = self._jobs.pop((name, guild_id), None)
+        if job:
+            job.cancelled = True
+
+    def cancel_all(self, name: str):
+        """取消所有服务器上名为 name 的任务。"""
+        for key in [key for key in self._jobs if key[0] == name]:
+            self.cancel(*key)
+
+    def get(self, name: str, guild_id: int = GLOBAL_JOB) -> Optional[ScheduledJob]:
+        return self._jobs.get((name, guild_id))
+
+    def upcoming(self) -> List[ScheduledJob]:
+        """按下次运行时间排列的所有任务。"""
+        return sorted(self._jobs.values(), key=lambda job: (job.next_run, job.guild_id))
+
+    # --- 调度循环 ---
+
+    def _push(self, job: ScheduledJob):
+        was_first = not self._heap or (job.next_run, job.guild_id) < self._heap[0][:2]
+        heapq.heappush(self._heap, (job.next_run, job.guild_id, next(self._counter), job))
+        if was_first:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            while self._heap and self._heap[0][3].cancelled:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            delay = (self._heap[0][0] - utcnow()).total_seconds()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, MAX_SLEEP_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due, _, _, job = heapq.heappop(self._heap)
+            # 从计划时间 (而不是实际醒来的时间) 计算下一次，避免固定间隔的任务逐渐漂移；
+            # 落后太多时 (例如长时间断线) 跳过错过的几次
+            now = utcnow()
+            job.next_run = job.next_run_after(due)
+            if job.next_run <= now:
+                job.next_run = job.next_run_after(now)
+            self._push(job)
+            self._launch(job)
+
+    def _launch(self, job: ScheduledJob):
+        if job.running and not job.running.done():
+            logger.warning(f"任务 {job.name} (服务器 {job.guild_id}) 上一次运行尚未结束，跳过本次。")
+            return
+        job.running = asyncio.create_task(self._invoke(job))
+
+    @staticmethod
+    async def _invoke(job: ScheduledJob):
+        try:
+            await job.callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"任务 {job.name} (服务器 {job.guild_id}) 执行出错: {e}", exc_info=True)
@@ -0,0 +1,135 @@
+# utility/search_index.py
+from __future__ import annotations
+
+import re
+from collections import OrderedDict
+from typing import Collection, Dict, Generic, Hashable, Iterable, List, Optional, Sequence, Set, Tuple, TypeVar
+
+try:
+    from pypinyin import Style, lazy_pinyin
+
+    HAS_PINYIN = True
+except ImportError:
+    HAS_PINYIN = False
+
+T = TypeVar("T", bound=Hashable)
+
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_NON_WORD_PATTERN = re.compile(r'\W+')
+
+# 匹配等级，数值越小排名越靠前
+_RANK_EXACT, _RANK_PREFIX, _RANK_SUBSTRING = 0, 1, 2
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE_PATTERN.sub('', text).lower()
+
+
+def search_forms(text: str) -> List[str]:
+    """
+    一段文本可以被搜索到的所有形式：原文 (小写、去空白)，以及含有汉字时的全拼和首字母。
+    例如 "新日报读者" -> ["新日报读者", "xinribaoduzhe", "xrbdz"]。未安装 pypinyin 时只有原文。
+    """
+    forms = [_normalize(text)]
+    if HAS_PINYIN and _CJK_PATTERN.search(text):
+        # 拼音形式去掉表情和标点，使 "🔔 新日报读者" 也能被 "xrbdz" 前缀匹配
+        forms.append(_NON_WORD_PATTERN.sub('', "".join(lazy_pinyin(text))).lower())
+        forms.append(_NON_WORD_PATTERN.sub('', "".join(lazy_pinyin(text, style=Style.FIRST_LETTER))).lower())
+    return list(dict.fromkeys(form for form in forms if form))
+
+
+class SearchIndex(Generic[T]):
+    """
+    面向自动补全的小型搜索索引，在数据变更时整体重建。
+
+    - 候选查找: 所有搜索形式的 1/2/3 元组 (n-gram) 倒排索引。长度 >= 3 的查询取各个三元组的交集，
+      更短的查询直接查对应的一元/二元组，之后再逐个确认匹配。
+    - 排名: 完全匹配 > 前缀匹配 > 子串匹配，同一等级内保持条目的原始顺序。
+    - 每个用户缓存最近一次查询的完整匹配结果，连续输入时 (新查询以旧查询开头) 只在上次的结果中继续筛选。
+    """
+
+    def __init__(self, entries: Iterable[Tuple[T, Sequence[str]]], user_cache_size: int = 256):
+        self._values: List[T] = []
+        self._forms: List[List[str]] = []
+        # { n-gram (n = 1, 2, 3): 包含它的条目序号 }
+        self._ngrams: Dict[str, Set[int]] = {}
+        for value, texts in entries:
+            entry_id = len(self._values)
+            forms = list(dict.fromkeys(form for text in texts for form in search_forms(text)))
+            self._values.append(value)
+            self._forms.append(forms)
+            for form in forms:
+                for n in (1, 2, 3):
+                    for i in range(len(form) - n + 1):
+                        self._ngrams.setdefault(form[i:i + n], set()).add(entry_id)
+
+        self._user_cache_size = user_cache_size
+        # { user_id: (查询, 按排名排列的匹配条目序号) }
+        self._user_cache: OrderedDict[int, Tuple[str, List[int]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _candidates(self, query: str) -> Set[int]:
+        if len(query) < 3:
+            return self._ngrams.get(query, set())
+        candidates: Optional[Set[int]] = None
+        for i in range(len(query) - 2):
+            entry_ids = self._ngrams.get(query[i:i + 3])
+            if not entry_ids:
+                return set()
+            candidates = set(entry_ids) if candidates is None else candidates & entry_ids
+        return candidates
+
+    def _rank(self, entry_id: int, query: str) -> Optional[int]:
+        best = None
+        for form in self._forms[entry_id]:
+            if form == query:
+                return _RANK_EXACT
+            if form.startswith(query):
+                best = _RANK_PREFIX
+            elif best is None and query in form:
+                best = _RANK_SUBSTRING
+        return best
+
+    def _match(self, query: str, candidates: Optional[Iterable[int]]) -> List[int]:
+        if candidates is None:
+            candidates = self._candidates(query)
+        ranked = []
+        for entry_id in candidates:
+            rank = self._rank(entry_id, query)
+            if rank is not None:
+                ranked.append((rank, entry_id))
+        ranked.sort()
+        return [entry_id for _, entry_id in ranked]
+
+    def search(self, query: str, limit: int = 25, allowed: Optional[Collection[T]] = None,
+               user_id: Optional[int] = None) -> List[T]:
+        """
+        返回匹配查询的条目 (最多 limit 个)。
+        allowed 不为 None 时只返回其中的条目；传入 user_id 可以复用该用户上一次查询的结果。
+        """
+        query = _normalize(query)
+        if not query:
+            entry_ids: Iterable[int] = range(len(self._values))
+        else:
+            candidates = None
+            cached = self._user_cache.get(user_id) if user_id is not None else None
+            if cached is not None and query.startswith(cached[0]):
+                candidates = cached[1]
+            entry_ids = self._match(query, candidates)
+            if user_id is not None:
+                self._user_cache[user_id] = (query, entry_ids)
+                self._user_cache.move_to_end(user_id)
+                if len(self._user_cache) > self._user_cache_size:
+                    self._user_cache.popitem(last=False)
+
+        results = []
+        for entry_id in entry_ids:
+            value = self._values[entry_id]
+            if allowed is None or value in allowed:
+                results.append(value)
+                if len(results) == limit:
+                    break
+        return results
@@ -0,0 +1,122 @@
+# utility/write_behind.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Union
+
+logger = logging.getLogger("NewsBot.WriteBehind")
+
+
+def write_file_atomic(path: str, content: Union[str, bytes]) -> None:
+    """
+    原子地写入文件：先写入同目录下的临时文件并 fsync，再用 os.replace 替换目标文件。
+    进程在任何时刻崩溃，目标文件要么是旧内容，要么是完整的新内容。
+    """
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path) or ".")
+
+
+def fsync_directory(directory: str) -> None:
+    """确保目录项 (重命名/创建/删除) 已落盘。Windows 不支持对目录 fsync，直接跳过。"""
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteBehindWriter:
+    """
+    写后台服务：所有磁盘写入都在一个专用线程中按提交顺序执行，事件循环只负责投递任务。
+
+    - submit(): 投递一个任务，返回 concurrent.futures.Future。
+    - run(): submit() 的异步版本，等待任务完成并返回结果。
+    - schedule(): 按 key 合并的任务，同一个 key 在执行前被多次调度时只执行最后一次 (用于整文件保存)。
+    - flush(): 等待此前投递的所有任务完成。
+    """
+
+    _default: Optional[WriteBehindWriter] = None
+
+    def __init__(self, name: str = "newsbot-writer"):
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._pending: Dict[Any, Callable[[], Any]] = {}
+        self._pending_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def default(cls) -> WriteBehindWriter:
+        """进程内共享的写线程。"""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    # --- 线程内部 ---
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fn, args, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                logger.error(f"后台写入任务 {getattr(fn, '__qualname__', fn)} 失败: {e}", exc_info=True)
+                future.set_exception(e)
+
+    def _run_pending(self, key: Any):
+        with self._pending_lock:
+            fn = self._pending.pop(key)
+        return fn()
+
+    # --- 公共接口 ---
+
+    def is_idle(self) -> bool:
+        """队列中是否没有等待执行的任务，写线程可据此决定是否进行一次合并的 fsync。"""
+        return self._queue.empty()
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        if self._closed:
+            raise RuntimeError("WriteBehindWriter 已关闭。")
+        future: Future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def schedule(self, key: Any, fn: Callable[[], Any]) -> None:
+        """调度一个可合并的任务。如果同一 key 的任务还在排队，只替换它要执行的函数。"""
+        with self._pending_lock:
+            already_queued = key in self._pending
+            self._pending[key] = fn
+        if not already_queued:
+            self.submit(self._run_pending, key)
+
+    async def flush(self) -> None:
+        await self.run(lambda: None)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """执行完所有排队的任务后停止写线程。"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
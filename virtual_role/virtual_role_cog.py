@@ -1,23 +1,38 @@
 # virtual_role_cog.py (完全重构)
+import time
 import typing
+from datetime import datetime
+from typing import Dict, List
 
 import discord
 from discord import app_commands, Color
-from discord.ext import commands
+from discord.ext import commands, tasks
 
+import config
 from config_data import DEFAULT_VIRTUAL_ROLE_ALLOWED
 from virtual_role.virtual_role_config_manager import VirtualRoleConfigManager
 from virtual_role.virtual_role_data_manager import VirtualRoleDataManager
 from virtual_role.virtual_role_helper import get_virtual_role_configs_for_guild
+from virtual_role.virtual_role_shadow import SHADOW_ROLE_SYNC_MINUTES, SHADOW_ROLES_ENABLED, ShadowRoleManager
+from virtual_role.virtual_role_transfer import parse_subscriptions_file, write_subscriptions_file
 from virtual_role.virtual_role_view import (
     VirtualRolePanelView, RoleEditSelectView, RoleDeleteSelectView, RoleEditModal, RoleSortView
 )
 # 假设您有 is_super_admin_check 函数
+from utility import member_cache
+from utility.member_cache import resolve_members
 from utility.permison import is_admin, is_admin_check, is_super_admin_check
+from utility.search_index import SearchIndex
 
 if typing.TYPE_CHECKING:
     from main import NewsBot
 
+# 成员离开服务器后保留其订阅的小时数，期间重新加入则订阅不受影响；0 表示收到离开事件后立即清理
+# (定期检查中发现的离开成员无论如何都要在两次检查中都不在服务器内才会被清理)
+PRUNE_GRACE_HOURS = getattr(config, "VIRTUAL_ROLE_PRUNE_GRACE_HOURS", 24)
+# 定期检查订阅者是否仍在服务器内、清理已离开成员的间隔 (分钟)，用于补上机器人离线期间错过的离开事件
+PRUNE_INTERVAL_MINUTES = getattr(config, "VIRTUAL_ROLE_PRUNE_INTERVAL_MINUTES", 60)
+
 
 class VirtualRoleCog(commands.Cog):
     def __init__(self, bot: 'NewsBot'):
@@ -27,6 +42,116 @@ class VirtualRoleCog(commands.Cog):
         # 持久化视图现在不需要 cog 实例
         self.bot.add_view(VirtualRolePanelView())
         self.bot.logger.info("持久化视图 'VirtualRolePanelView' 已注册。")
+        # { guild_id: { user_id: 离开时间戳 } }，处于宽限期、尚未清理订阅的成员
+        self._departed_members: Dict[int, Dict[int, float]] = {}
+        # 影子身份组 (可选)，未启用时为 None
+        self.shadow_roles: typing.Optional[ShadowRoleManager] = ShadowRoleManager(bot) if SHADOW_ROLES_ENABLED else None
+        # { guild_id: ((role_key, 名称) 列表, 搜索索引) }，新闻组不变时复用同一个索引
+        self._role_search_indexes: Dict[int, typing.Tuple[typing.Tuple[typing.Tuple[str, str], ...], SearchIndex[str]]] = {}
+
+    async def cog_load(self):
+        self.prune_departed_members_task.start()
+        if self.shadow_roles:
+            self.shadow_roles.start()
+            self.reconcile_shadow_roles_task.start()
+
+    async def cog_unload(self):
+        self.prune_departed_members_task.cancel()
+        if self.shadow_roles:
+            self.reconcile_shadow_roles_task.cancel()
+            self.shadow_roles.stop()
+        # 机器人关闭时会卸载所有 Cog，确保订阅数据和配置都已写入磁盘
+        await self.data_manager.flush()
+        await self.config_manager.flush()
+
+    # ===================================================================
+    # 已离开成员的订阅清理
+    # ===================================================================
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        user_id = payload.user.id
+        member_cache.mark_absent(payload.guild_id, user_id)
+        if not await self.data_manager.get_user_roles(user_id, payload.guild_id):
+            return
+        if PRUNE_GRACE_HOURS <= 0:
+            await self.data_manager.remove_user(user_id, payload.guild_id)
+        else:
+            self._departed_members.setdefault(payload.guild_id, {})[user_id] = time.time()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        member_cache.mark_present(member.guild.id, member.id)
+        # 在宽限期内重新加入，保留原有订阅
+        self._departed_members.get(member.guild.id, {}).pop(member.id, None)
+
+    async def prune_departed_members(self, guild: discord.Guild) -> int:
+        """
+        找出已离开服务器的订阅者，清理宽限期已过的成员的订阅，返回清理的订阅条数。
+
+        只有在上一次检查 (或离开事件) 中已被记录、这次仍不在服务器内的成员才会被清理，
+        一次查询失误 (网关超时、成员列表不完整) 不会导致订阅被删除。
+        """
+        now = time.time()
+        grace_seconds = PRUNE_GRACE_HOURS * 3600
+        previous = self._departed_members.get(guild.id, {})
+        subscribed = await self.data_manager.get_subscribed_user_ids(guild.id)
+        if not subscribed:
+            self._departed_members.pop(guild.id, None)
+            return 0
+        # 成员缓存不完整时按ID查询订阅者是否仍在服务器内
+        try:
+            present = await resolve_members(guild, subscribed)
+        except Exception as e:
+            self.bot.logger.warning(f"服务器 {guild.id}: 查询订阅者是否在服务器内时出错，本次不清理: {e}")
+            return 0
+        if not present:
+            # 所有订阅者都不在服务器内几乎不可能，更可能是查询结果不完整
+            self.bot.logger.warning(f"服务器 {guild.id}: {len(subscribed)} 名订阅者均未找到，本次不清理。")
+            return 0
+        # 只保留仍有订阅且仍不在服务器内的成员，首次发现的离开成员从现在开始计算宽限期
+        departed = {
+            user_id: previous.get(user_id, now)
+            for user_id in subscribed
+            if user_id not in present
+        }
+        expired = [
+            user_id for user_id, departed_at in departed.items()
+            if user_id in previous and now - departed_at >= grace_seconds
+        ]
+        for user_id in expired:
+            del departed[user_id]
+        self._departed_members[guild.id] = departed
+
+        if not expired:
+            return 0
+        removed = await self.data_manager.remove_users(expired, guild.id)
+        self.bot.logger.info(f"服务器 {guild.id}: 已清理 {len(expired)} 名离开成员的 {removed} 条订阅。")
+        return removed
+
+    @tasks.loop(minutes=PRUNE_INTERVAL_MINUTES)
+    async def prune_departed_members_task(self):
+        for guild in self.bot.guilds:
+            # 只检查已加载的服务器，避免定期任务把所有服务器的订阅数据都读入内存；
+            # 尚未加载的服务器在首次被访问后的下一次检查中处理 (宽限期从那时开始计算)
+            if not self.data_manager.is_loaded(guild.id):
+                continue
+            try:
+                await self.prune_departed_members(guild)
+            except Exception as e:
+                self.bot.logger.error(f"清理服务器 {guild.id} 的离开成员订阅时出错: {e}", exc_info=True)
+
+    @prune_departed_members_task.before_loop
+    async def before_prune_departed_members_task(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(minutes=SHADOW_ROLE_SYNC_MINUTES)
+    async def reconcile_shadow_roles_task(self):
+        await self.shadow_roles.reconcile_all()
+
+    @reconcile_shadow_roles_task.before_loop
+    async def before_reconcile_shadow_roles_task(self):
+        await self.bot.wait_until_ready()
 
     # ===================================================================
     # 用户命令
@@ -82,22 +207,17 @@ class VirtualRoleCog(commands.Cog):
             description="以下是服务器内各新闻订阅组的当前成员数量。",
             color=discord.Color.from_rgb(114, 137, 218)
         )
-        stats_lines = []
-        total_subscribers, unique_subscribers = 0, set()
+        role_counts, total_subscribers, unique_subscribers = await self.data_manager.get_subscriber_stats(
+            virtual_roles_config.keys(), guild_id
+        )
         sorted_roles = sorted(virtual_roles_config.items(), key=lambda item: item[1]['name'])
-
-        for role_key, config in sorted_roles:
-            user_ids = await self.data_manager.get_users_in_role(role_key, guild_id)
-            subscriber_count = len(user_ids)
-            stats_lines.append(f"**{config['name']}**: `{subscriber_count}` 人")
-            total_subscribers += subscriber_count
-            unique_subscribers.update(user_ids)
+        stats_lines = [f"**{config['name']}**: `{role_counts[role_key]}` 人" for role_key, config in sorted_roles]
 
         if stats_lines:
             embed.description += "\n\n" + "\n".join(stats_lines)
 
         embed.add_field(name="总订阅人次", value=str(total_subscribers), inline=True)
-        embed.add_field(name="独立订阅人数", value=str(len(unique_subscribers)), inline=True)
+        embed.add_field(name="独立订阅人数", value=str(unique_subscribers), inline=True)
         embed.set_footer(text=f"由 {interaction.user.display_name} 查询")
         await interaction.followup.send(embed=embed, ephemeral=True)
 
@@ -164,5 +284,90 @@ class VirtualRoleCog(commands.Cog):
         view = RoleSortView(self, roles, guild_id)
         await interaction.response.send_message(embed=view.generate_embed(), view=view, ephemeral=True)
 
+    # --- 批量订阅管理 ---
+
+    async def virtual_role_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        """新闻组的自动补全，与 /发送at通知 使用相同的搜索索引 (支持拼音、首字母和子串匹配)。"""
+        roles = await self.config_manager.get_guild_roles_ordered(interaction.guild.id)
+        entries = tuple((key, config['name']) for key, config in roles.items())
+        cached = self._role_search_indexes.get(interaction.guild.id)
+        if cached is None or cached[0] != entries:
+            cached = self._role_search_indexes[interaction.guild.id] = (
+                entries, SearchIndex((key, (key, name)) for key, name in entries)
+            )
+        return [
+            app_commands.Choice(name=roles[key]['name'][:100], value=key)
+            for key in cached[1].search(current, user_id=interaction.user.id)
+        ]
+
+    @manage_roles_group.command(name="复制身份组成员", description="将一个真实身份组的所有成员批量加入新闻订阅组。")
+    @app_commands.describe(role="要复制成员的真实身份组", target="要加入的新闻订阅组")
+    @app_commands.autocomplete(target=virtual_role_autocomplete)
+    @is_admin()
+    async def copy_role_members(self, interaction: discord.Interaction, role: discord.Role, target: str):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        target_config = await self.config_manager.get_role_config(interaction.guild.id, target)
+        if not target_config:
+            await interaction.followup.send(f"❌ 找不到新闻订阅组 `{target}`。", ephemeral=True)
+            return
+
+        # 按需缓存成员时，需要先拉取完整的成员列表才能得到身份组的全部成员
+        if not interaction.guild.chunked:
+            await interaction.guild.chunk()
+        user_ids = [member.id for member in role.members if not member.bot]
+        added = await self.data_manager.add_users_to_role(user_ids, target, interaction.guild.id)
+        await interaction.followup.send(
+            f"✅ 已将身份组 **{role.name}** 的 {len(user_ids)} 名成员复制到 **{target_config['name']}**，"
+            f"新增 {added} 条订阅。",
+            ephemeral=True
+        )
+
+    @manage_roles_group.command(name="导出订阅", description="将本服务器的所有订阅记录导出为文件。")
+    @app_commands.describe(fmt="导出文件格式")
+    @app_commands.choices(fmt=[
+        app_commands.Choice(name="CSV", value="csv"),
+        app_commands.Choice(name="JSON Lines", value="jsonl"),
+    ])
+    @is_admin()
+    async def export_subscriptions(self, interaction: discord.Interaction, fmt: str = "csv"):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        rows = await self.data_manager.export_subscriptions(interaction.guild.id)
+        buffer = write_subscriptions_file(rows, fmt)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        export_file = discord.File(buffer, filename=f"subscriptions_{interaction.guild.id}_{timestamp}.{fmt}")
+        await interaction.followup.send("📦 这是本服务器的订阅记录导出文件：", file=export_file, ephemeral=True)
+
+    @manage_roles_group.command(name="导入订阅", description="从 CSV/JSONL 文件批量添加或移除订阅记录。")
+    @app_commands.describe(file="包含 user_id 和 role_key 两列的 .csv 或 .jsonl 文件", mode="对文件中的记录执行的操作")
+    @app_commands.choices(mode=[
+        app_commands.Choice(name="添加订阅", value="add"),
+        app_commands.Choice(name="移除订阅", value="remove"),
+    ])
+    @is_admin()
+    async def import_subscriptions(self, interaction: discord.Interaction, file: discord.Attachment, mode: str = "add"):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        guild_id = interaction.guild.id
+        try:
+            rows = parse_subscriptions_file(file.filename, await file.read())
+        except ValueError as e:
+            await interaction.followup.send(f"❌ 导入失败：{e}", ephemeral=True)
+            return
+
+        known_keys = set(await self.config_manager.get_guild_roles_ordered(guild_id))
+        unknown_keys = {role_key for _, role_key in rows} - known_keys
+        if unknown_keys:
+            await interaction.followup.send(
+                f"❌ 导入失败：文件中包含未配置的订阅组 `{'`, `'.join(sorted(unknown_keys))}`。",
+                ephemeral=True
+            )
+            return
+
+        if mode == "remove":
+            changed = await self.data_manager.remove_subscriptions(rows, guild_id)
+            await interaction.followup.send(f"✅ 已处理 {len(rows)} 条记录，移除了 {changed} 条订阅。", ephemeral=True)
+        else:
+            changed = await self.data_manager.import_subscriptions(rows, guild_id)
+            await interaction.followup.send(f"✅ 已处理 {len(rows)} 条记录，新增了 {changed} 条订阅。", ephemeral=True)
+
 async def setup(bot: 'NewsBot') -> None:
     await bot.add_cog(VirtualRoleCog(bot))
\ No newline at end of file
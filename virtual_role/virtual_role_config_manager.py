@@ -1,12 +1,24 @@
 # virtual_role/virtual_role_config_manager.py
 import asyncio
 import json
+import logging
 import os
-from typing import Dict, Any, List, Optional
+from collections import defaultdict
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional
+
+from utility.write_behind import WriteBehindWriter, write_file_atomic
 
 CONFIG_DIR = "data"
 CONFIG_FILE = os.path.join(CONFIG_DIR, "virtual_roles_config.json")
 
+# 只读的、已排序的服务器角色配置: { role_key: {details} }
+GuildRolesView = Mapping[str, Mapping[str, Any]]
+_EMPTY_ROLES: GuildRolesView = MappingProxyType({})
+_EMPTY_TAG_INDEX: Mapping[int, str] = MappingProxyType({})
+
+logger = logging.getLogger("NewsBot.VirtualRoleConfig")
+
 
 class VirtualRoleConfigManager:
     _instance = None
@@ -23,35 +35,39 @@ class VirtualRoleConfigManager:
         self._initialized = True
 
         # 新数据结构: { guild_id_str: { "roles": { role_key: {details} }, "order": [keys] } }
+        # 写时复制：修改时总是构建新的服务器配置并替换顶层字典，已交给写线程的快照引用永远不会被修改
         self._config_data: Dict[str, Dict[str, Any]] = {}
+        # 每个服务器预先构建好的只读视图和版本号。读取方直接返回视图，不需要加锁；
+        # 每次提交修改都会替换视图并递增版本号，调用方可以用版本号判断自己的缓存是否过期。
+        self._views: Dict[int, GuildRolesView] = {}
+        # 每个服务器的 forum_tag_id (int) -> role_key 反向索引，与视图一起重建
+        self._tag_indexes: Dict[int, Mapping[int, str]] = {}
+        self._versions: Dict[int, int] = defaultdict(int)
         self._lock = asyncio.Lock()
-        self._dirty = False
-        self._save_task = None
+        self._writer = WriteBehindWriter.default()
         os.makedirs(CONFIG_DIR, exist_ok=True)
         self.load_config()
 
     def _migrate_config_if_needed(self):
-        """检查并迁移旧格式的配置文件。"""
+        """检查并迁移旧格式的配置文件，同时修复顺序列表与角色字典不一致的服务器。"""
         migrated = False
         for guild_id_str, guild_config in self._config_data.items():
             # 旧格式的 value 是一个角色字典，而不是包含 "roles" 和 "order" 的字典
             if not isinstance(guild_config, dict) or "roles" not in guild_config or "order" not in guild_config:
-                new_config = {
+                guild_config = self._config_data[guild_id_str] = {
                     "roles": guild_config,
                     "order": list(guild_config.keys())
                 }
-                self._config_data[guild_id_str] = new_config
+                migrated = True
+            if self._repair_order(guild_config):
                 migrated = True
 
         if migrated:
-            self._dirty = True
             # 同步保存一次以完成迁移
             try:
-                with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(self._config_data, f, indent=4, ensure_ascii=False)
-                self._dirty = False
-            except Exception:
-                # 如果同步保存失败，至少标记为脏数据，等待异步保存
+                write_file_atomic(CONFIG_FILE, self._serialize(self._config_data))
+            except OSError:
+                # 如果同步保存失败，下一次修改时会再次保存
                 pass
 
     def load_config(self):
@@ -62,62 +78,97 @@ class VirtualRoleConfigManager:
                 self._migrate_config_if_needed()
         except (FileNotFoundError, json.JSONDecodeError):
             self._config_data = {}
+        for guild_id_str, guild_config in self._config_data.items():
+            self._publish_view(int(guild_id_str), guild_config)
+
+    @staticmethod
+    def _repair_order(guild_config: Dict[str, Any]) -> bool:
+        """让顺序列表与角色字典的键完全一致，返回是否做了修改。"""
+        roles_dict = guild_config["roles"]
+        order_list = guild_config["order"]
+        if len(order_list) == len(roles_dict) and set(order_list) == set(roles_dict):
+            return False
+        # 过滤掉顺序列表中不存在于角色字典中的key (以及重复的key)
+        clean_order = list(dict.fromkeys(key for key in order_list if key in roles_dict))
+        # 将角色字典中存在但不在顺序列表中的key添加到末尾
+        clean_order.extend(key for key in roles_dict if key not in clean_order)
+        guild_config["order"] = clean_order
+        return True
 
-    async def _save_config(self):
-        async with self._lock:
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self._config_data, f, indent=4, ensure_ascii=False)
-            self._dirty = False
+    def _publish_view(self, guild_id: int, guild_config: Optional[Dict[str, Any]]):
+        """为服务器构建新的只读视图和论坛标签索引，并递增版本号。"""
+        if guild_config:
+            roles_dict = guild_config["roles"]
+            self._views[guild_id] = MappingProxyType({
+                key: MappingProxyType(roles_dict[key]) for key in guild_config["order"]
+            })
+            self._tag_indexes[guild_id] = MappingProxyType(self._build_tag_index(guild_id, guild_config))
+        else:
+            self._views.pop(guild_id, None)
+            self._tag_indexes.pop(guild_id, None)
+        self._versions[guild_id] += 1
+
+    @staticmethod
+    def _build_tag_index(guild_id: int, guild_config: Dict[str, Any]) -> Dict[int, str]:
+        tag_index: Dict[int, str] = {}
+        roles_dict = guild_config["roles"]
+        for role_key in guild_config["order"]:
+            tag_id = roles_dict[role_key].get("forum_tag_id")
+            if not tag_id:
+                continue
+            try:
+                tag_index[int(tag_id)] = role_key
+            except (TypeError, ValueError):
+                logger.warning(f"服务器 {guild_id} 的新闻组 '{role_key}' 的论坛标签ID '{tag_id}' 无效，已忽略。")
+        return tag_index
 
-    async def schedule_save(self):
-        self._dirty = True
-        if self._save_task and not self._save_task.done():
-            self._save_task.cancel()
-        self._save_task = asyncio.create_task(self._delayed_save())
+    @staticmethod
+    def _serialize(config_data: Dict[str, Dict[str, Any]]) -> str:
+        return json.dumps(config_data, indent=4, ensure_ascii=False)
 
-    async def _delayed_save(self):
-        try:
-            await asyncio.sleep(2.0)
-            if self._dirty:
-                await self._save_config()
-        except asyncio.CancelledError:
-            pass
-
-    async def get_guild_roles_ordered(self, guild_id: int) -> Dict[str, Dict[str, Any]]:
-        """获取一个服务器的所有角色配置，并按照存储的顺序排序。"""
-        async with self._lock:
-            guild_config = self._config_data.get(str(guild_id), {})
-            if not guild_config:
-                return {}
-
-            roles_dict = guild_config.get("roles", {})
-            order_list = guild_config.get("order", [])
-
-            # 数据一致性检查和修复
-            role_keys_in_dict = set(roles_dict.keys())
-            role_keys_in_order = set(order_list)
-
-            if role_keys_in_dict != role_keys_in_order:
-                # 过滤掉顺序列表中不存在于角色字典中的key
-                clean_order = [key for key in order_list if key in roles_dict]
-                # 将角色字典中存在但不在顺序列表中的key添加到末尾
-                for key in roles_dict:
-                    if key not in clean_order:
-                        clean_order.append(key)
-                guild_config["order"] = clean_order
-                await self.schedule_save()  # 修复了数据，安排保存
-
-            # 构建排序后的字典
-            ordered_roles = {}
-            for role_key in guild_config.get("order", []):
-                if role_key in roles_dict:
-                    ordered_roles[role_key] = roles_dict[role_key]
-            return ordered_roles
-
-    async def get_role_config(self, guild_id: int, role_key: str) -> Optional[Dict[str, Any]]:
-        async with self._lock:
-            guild_config = self._config_data.get(str(guild_id), {})
-            return guild_config.get("roles", {}).get(role_key)
+    async def schedule_save(self):
+        """把当前配置交给写线程保存。快照只是一个引用，序列化和写入都不在事件循环中进行。"""
+        snapshot = self._config_data
+        self._writer.schedule(CONFIG_FILE, lambda: write_file_atomic(CONFIG_FILE, self._serialize(snapshot)))
+
+    async def flush(self):
+        """等待所有已调度的保存完成，在关闭机器人前调用。"""
+        await self._writer.flush()
+
+    def _copy_guild_config(self, guild_id_str: str) -> Dict[str, Any]:
+        """复制一个服务器的配置，用于写时复制。角色详情字典只会被整体替换，因此浅复制即可。"""
+        guild_config = self._config_data.get(guild_id_str) or {}
+        return {"roles": dict(guild_config.get("roles", {})), "order": list(guild_config.get("order", []))}
+
+    def _commit_guild_config(self, guild_id_str: str, guild_config: Optional[Dict[str, Any]]):
+        """用新的服务器配置替换旧配置，guild_config 为 None 时删除该服务器。"""
+        new_config_data = dict(self._config_data)
+        if guild_config is None:
+            new_config_data.pop(guild_id_str, None)
+        else:
+            self._repair_order(guild_config)
+            new_config_data[guild_id_str] = guild_config
+        self._config_data = new_config_data
+        self._publish_view(int(guild_id_str), guild_config)
+
+    def get_guild_version(self, guild_id: int) -> int:
+        """服务器配置的版本号，每次修改后递增。"""
+        return self._versions[guild_id]
+
+    def get_guild_roles_view(self, guild_id: int) -> GuildRolesView:
+        """get_guild_roles_ordered 的同步版本，供需要在同步代码中读取配置的调用方使用。"""
+        return self._views.get(guild_id, _EMPTY_ROLES)
+
+    async def get_guild_roles_ordered(self, guild_id: int) -> GuildRolesView:
+        """获取一个服务器的所有角色配置 (按存储的顺序排列的只读视图)，O(1) 且不需要加锁。"""
+        return self._views.get(guild_id, _EMPTY_ROLES)
+
+    async def get_role_config(self, guild_id: int, role_key: str) -> Optional[Mapping[str, Any]]:
+        return self._views.get(guild_id, _EMPTY_ROLES).get(role_key)
+
+    def get_tag_role_map(self, guild_id: int) -> Mapping[int, str]:
+        """服务器的 forum_tag_id -> role_key 只读映射。"""
+        return self._tag_indexes.get(guild_id, _EMPTY_TAG_INDEX)
 
     async def add_role(
             self, guild_id: int, role_key: str, name: str, description: str,
@@ -125,10 +176,8 @@ class VirtualRoleConfigManager:
     ) -> bool:
         guild_id_str = str(guild_id)
         async with self._lock:
-            if guild_id_str not in self._config_data:
-                self._config_data[guild_id_str] = {"roles": {}, "order": []}
-
-            guild_roles = self._config_data[guild_id_str]["roles"]
+            guild_config = self._copy_guild_config(guild_id_str)
+            guild_roles = guild_config["roles"]
             if role_key in guild_roles:
                 return False
 
@@ -137,7 +186,8 @@ class VirtualRoleConfigManager:
                 "allowed_by_roles": [str(r) for r in allowed_by_roles],
                 "forum_tag_id": str(forum_tag_id) if forum_tag_id else None
             }
-            self._config_data[guild_id_str]["order"].append(role_key)
+            guild_config["order"].append(role_key)
+            self._commit_guild_config(guild_id_str, guild_config)
         await self.schedule_save()
         return True
 
@@ -147,10 +197,10 @@ class VirtualRoleConfigManager:
     ) -> bool:
         guild_id_str = str(guild_id)
         async with self._lock:
-            guild_config = self._config_data.get(guild_id_str)
-            if not guild_config: return False
+            if not self._config_data.get(guild_id_str): return False
 
-            guild_roles = guild_config.get("roles", {})
+            guild_config = self._copy_guild_config(guild_id_str)
+            guild_roles = guild_config["roles"]
             if new_key != old_key and new_key in guild_roles:
                 return False
 
@@ -167,6 +217,7 @@ class VirtualRoleConfigManager:
                 "allowed_by_roles": [str(r) for r in allowed_by_roles],
                 "forum_tag_id": str(forum_tag_id) if forum_tag_id else None
             }
+            self._commit_guild_config(guild_id_str, guild_config)
         await self.schedule_save()
         return True
 
@@ -174,14 +225,13 @@ class VirtualRoleConfigManager:
         guild_id_str = str(guild_id)
         async with self._lock:
             if guild_id_str in self._config_data:
-                guild_config = self._config_data[guild_id_str]
-                if role_key in guild_config.get("roles", {}):
+                guild_config = self._copy_guild_config(guild_id_str)
+                if role_key in guild_config["roles"]:
                     del guild_config["roles"][role_key]
-                    if role_key in guild_config.get("order", []):
+                    if role_key in guild_config["order"]:
                         guild_config["order"].remove(role_key)
 
-                    if not guild_config["roles"]:
-                        del self._config_data[guild_id_str]
+                    self._commit_guild_config(guild_id_str, guild_config if guild_config["roles"] else None)
 
                     await self.schedule_save()
                     return True
@@ -194,13 +244,14 @@ class VirtualRoleConfigManager:
             if guild_id_str not in self._config_data:
                 return False
 
-            guild_config = self._config_data[guild_id_str]
-            current_keys = set(guild_config.get("roles", {}).keys())
+            guild_config = self._copy_guild_config(guild_id_str)
+            current_keys = set(guild_config["roles"].keys())
             new_order_keys = set(new_order)
 
             if current_keys != new_order_keys:
                 return False  # 键集合不匹配，可能是排序期间发生了增删
 
-            guild_config["order"] = new_order
+            guild_config["order"] = list(new_order)
+            self._commit_guild_config(guild_id_str, guild_config)
         await self.schedule_save()
         return True
\ No newline at end of file
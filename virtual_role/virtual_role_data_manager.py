@@ -1,12 +1,32 @@
 # virtual_role_data_manager.py
 import asyncio
-import json
+import logging
 import os
 from collections import defaultdict
-from typing import List
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-DATA_DIR = "data"
-DATA_FILE = os.path.join(DATA_DIR, "user_virtual_roles.json")
+import config
+from virtual_role.virtual_role_index import GuildSubscriptions
+from virtual_role.virtual_role_storage import DATA_DIR, create_storage
+
+# 可选值: "sqlite" (默认，每次变更只写一行) 或 "journal" (二进制快照 + 追加日志)
+STORAGE_BACKEND = getattr(config, "VIRTUAL_ROLE_STORAGE_BACKEND", "sqlite")
+
+logger = logging.getLogger("NewsBot.VirtualRoleData")
+
+
+@dataclass(frozen=True)
+class SubscriptionChange:
+    """一次已提交的订阅变更，added/removed 为 (user_id, role_key)。"""
+    guild_id: int
+    added: Sequence[Tuple[int, str]] = ()
+    removed: Sequence[Tuple[int, str]] = ()
+    # 身份组 key 被重命名时为 (old_key, new_key)
+    renamed: Optional[Tuple[str, str]] = None
+
+
+SubscriptionListener = Callable[[SubscriptionChange], None]
 
 
 class VirtualRoleDataManager:
@@ -23,112 +43,177 @@ class VirtualRoleDataManager:
             return
         self._initialized = True
 
-        # 新数据结构: { guild_id_str: { user_id_str: [roles] } }
-        self._guild_data = {}
-        # 反向映射: { guild_id_str: { role_key: [user_ids] } }
-        self._guild_role_users = defaultdict(lambda: defaultdict(list))
-        self._lock = asyncio.Lock()
-        self._dirty = False
-        self._save_task = None
+        # { guild_id: GuildSubscriptions }，读取方直接读取，不需要加锁
+        self._guilds: Dict[int, GuildSubscriptions] = {}
+        # 写入方按服务器加锁，一个服务器的重命名不会阻塞其他服务器
+        self._guild_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # 正在加载的服务器，同时访问同一个未加载服务器的调用方共用一次加载
+        self._loading: Dict[int, asyncio.Task] = {}
         os.makedirs(DATA_DIR, exist_ok=True)
-        self.load_data()
-
-    def load_data(self):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                self._guild_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self._guild_data = {}
-        self._rebuild_reverse_map()
-
-    def _rebuild_reverse_map(self):
-        self._guild_role_users.clear()
-        for guild_id_str, user_roles_map in self._guild_data.items():
-            for user_id_str, roles in user_roles_map.items():
-                user_id = int(user_id_str)
-                for role_key in roles:
-                    self._guild_role_users[guild_id_str][role_key].append(user_id)
-
-    async def save_data(self):
-        self._dirty = True
-        if self._save_task:
-            self._save_task.cancel()
-        self._save_task = asyncio.create_task(self._delayed_save())
-
-    async def _delayed_save(self):
-        try:
-            await asyncio.sleep(1.5)
-            async with self._lock:
-                if self._dirty:
-                    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                        json.dump(self._guild_data, f, indent=4, ensure_ascii=False)
-                    self._dirty = False
-        except asyncio.CancelledError:
-            pass
-        finally:
-            self._save_task = None
+        self._storage = create_storage(STORAGE_BACKEND)
+        self._listeners: List[SubscriptionListener] = []
+
+    def add_listener(self, listener: SubscriptionListener):
+        """注册订阅变更的监听函数。监听函数在持有服务器锁时被同步调用，不能阻塞，应只把变更放入自己的队列。"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: SubscriptionListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, change: SubscriptionChange):
+        for listener in self._listeners:
+            try:
+                listener(change)
+            except Exception as e:
+                logger.error(f"订阅变更监听函数 {listener} 出错: {e}", exc_info=True)
+
+    async def _get_guild(self, guild_id: int) -> GuildSubscriptions:
+        """
+        返回服务器的订阅数据，第一次访问时才从存储后端加载并构建索引。
+        读取存储和构建索引都在线程池中进行，不阻塞事件循环；同一个服务器只会被加载一次。
+        """
+        guild = self._guilds.get(guild_id)
+        if guild is not None:
+            return guild
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = self._loading[guild_id] = asyncio.create_task(self._load_guild(guild_id))
+            task.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+        # 某个调用方被取消时不影响其他等待同一次加载的调用方
+        return await asyncio.shield(task)
+
+    async def _load_guild(self, guild_id: int) -> GuildSubscriptions:
+        def _load():
+            return GuildSubscriptions.from_role_users(self._storage.load_guild(guild_id))
+        guild = self._guilds[guild_id] = await asyncio.to_thread(_load)
+        return guild
+
+    def is_loaded(self, guild_id: int) -> bool:
+        """该服务器的订阅数据是否已经加载到内存 (不会触发加载)。"""
+        return guild_id in self._guilds
+
+    async def flush(self):
+        """等待所有已提交的订阅变更写入磁盘，在关闭机器人前调用。"""
+        await self._storage.flush()
 
     # --- 所有公共方法都增加了 guild_id 参数 ---
 
-    async def get_user_roles(self, user_id: int, guild_id: int) -> List[str]:
-        guild_id_str, user_id_str = str(guild_id), str(user_id)
-        async with self._lock:
-            return self._guild_data.get(guild_id_str, {}).get(user_id_str, [])
-
-    async def get_users_in_role(self, role_key: str, guild_id: int) -> List[int]:
-        guild_id_str = str(guild_id)
-        async with self._lock:
-            return self._guild_role_users.get(guild_id_str, {}).get(role_key, [])
+    async def get_user_roles(self, user_id: int, guild_id: int) -> Sequence[str]:
+        return (await self._get_guild(guild_id)).roles_of(user_id)
+
+    async def get_users_in_role(self, role_key: str, guild_id: int) -> Sequence[int]:
+        """返回身份组成员ID的只读视图，之后的订阅变更不会影响已返回的视图。"""
+        return (await self._get_guild(guild_id)).index.members(role_key)
+
+    async def get_users_in_roles(self, role_keys: Iterable[str], guild_id: int) -> FrozenSet[int]:
+        """返回订阅了任意一个指定身份组的用户ID集合 (并集)。"""
+        return (await self._get_guild(guild_id)).index.union(role_keys)
+
+    async def get_role_counts(self, role_keys: Iterable[str], guild_id: int) -> Dict[str, int]:
+        """每个身份组的当前订阅人数，O(1) 读取计数器，不复制成员列表。"""
+        index = (await self._get_guild(guild_id)).index
+        return {role_key: index.count(role_key) for role_key in role_keys}
+
+    async def get_subscriber_stats(self, role_keys: Iterable[str], guild_id: int) -> Tuple[Dict[str, int], int, int]:
+        """
+        返回 (各身份组人数, 总订阅人次, 独立订阅人数)，只统计 role_keys 中的身份组。
+        当服务器内没有已删除身份组遗留的订阅记录时，总数和独立人数都直接读取计数器。
+        """
+        guild = await self._get_guild(guild_id)
+        counts = await self.get_role_counts(role_keys, guild_id)
+        if guild.index.role_keys() <= counts.keys():
+            return counts, guild.total_subscriptions, guild.unique_subscribers
+        # 存在遗留的订阅记录，需要排除它们，独立人数退化为对已配置身份组取并集
+        return counts, sum(counts.values()), len(guild.index.union(counts))
 
     async def add_role_to_user(self, user_id: int, role_key: str, guild_id: int):
-        guild_id_str, user_id_str = str(guild_id), str(user_id)
-        async with self._lock:
-            if guild_id_str not in self._guild_data:
-                self._guild_data[guild_id_str] = {}
-            if user_id_str not in self._guild_data[guild_id_str]:
-                self._guild_data[guild_id_str][user_id_str] = []
-
-            if role_key not in self._guild_data[guild_id_str][user_id_str]:
-                self._guild_data[guild_id_str][user_id_str].append(role_key)
-                self._guild_role_users[guild_id_str][role_key].append(user_id)
-                await self.save_data()
+        async with self._guild_locks[guild_id]:
+            if (await self._get_guild(guild_id)).add(user_id, role_key):
+                await self._storage.add(guild_id, user_id, role_key)
+                self._notify(SubscriptionChange(guild_id, added=((user_id, role_key),)))
 
     async def rename_role_key(self, guild_id: int, old_key: str, new_key: str):
         """当一个虚拟身份组的key被重命名时，更新所有相关用户的记录。"""
-        guild_id_str = str(guild_id)
-        async with self._lock:
-            # 检查是否有这个服务器的数据
-            if guild_id_str not in self._guild_data:
-                return
-
-            user_roles_map = self._guild_data[guild_id_str]
-            updated = False
-
-            # 遍历该服务器的所有用户
-            for user_id_str, roles in user_roles_map.items():
-                if old_key in roles:
-                    roles.remove(old_key)
-                    if new_key not in roles:
-                        roles.append(new_key)
-                    updated = True
-
-            # 如果发生了更新，重建反向映射并保存
-            if updated:
-                self._rebuild_reverse_map()
-                await self.save_data()
+        async with self._guild_locks[guild_id]:
+            if (await self._get_guild(guild_id)).rename(old_key, new_key):
+                await self._storage.rename(guild_id, old_key, new_key)
+            # 即使没有订阅记录也要通知，监听方可能按 key 保存了其他状态
+            self._notify(SubscriptionChange(guild_id, renamed=(old_key, new_key)))
 
     async def remove_role_from_user(self, user_id: int, role_key: str, guild_id: int):
-        guild_id_str, user_id_str = str(guild_id), str(user_id)
-        async with self._lock:
-            if guild_id_str in self._guild_data and user_id_str in self._guild_data[guild_id_str]:
-                if role_key in self._guild_data[guild_id_str][user_id_str]:
-                    self._guild_data[guild_id_str][user_id_str].remove(role_key)
-                    if not self._guild_data[guild_id_str][user_id_str]:
-                        del self._guild_data[guild_id_str][user_id_str]
-                    if not self._guild_data[guild_id_str]:
-                        del self._guild_data[guild_id_str]
-
-                    if role_key in self._guild_role_users[guild_id_str] and user_id in self._guild_role_users[guild_id_str][role_key]:
-                        self._guild_role_users[guild_id_str][role_key].remove(user_id)
-
-                    await self.save_data()
+        async with self._guild_locks[guild_id]:
+            if (await self._get_guild(guild_id)).remove(user_id, role_key):
+                await self._storage.remove(guild_id, user_id, role_key)
+                self._notify(SubscriptionChange(guild_id, removed=((user_id, role_key),)))
+
+    # --- 批量操作：整个批次只加一次锁、只重建一次反向索引、只产生一次持久化写入 ---
+
+    async def add_users_to_role(self, user_ids: Iterable[int], role_key: str, guild_id: int) -> int:
+        """批量订阅，返回实际新增的人数。"""
+        return await self.import_subscriptions(((user_id, role_key) for user_id in user_ids), guild_id)
+
+    async def remove_users_from_role(self, user_ids: Iterable[int], role_key: str, guild_id: int) -> int:
+        """批量退订，返回实际移除的人数。"""
+        return await self.remove_subscriptions(((user_id, role_key) for user_id in user_ids), guild_id)
+
+    async def import_subscriptions(self, rows: Iterable[Tuple[int, str]], guild_id: int) -> int:
+        """批量导入 (user_id, role_key) 订阅记录，已存在的记录会被跳过，返回实际新增的条数。"""
+        role_users: Dict[str, List[int]] = defaultdict(list)
+        for user_id, role_key in rows:
+            role_users[role_key].append(user_id)
+
+        async with self._guild_locks[guild_id]:
+            guild = await self._get_guild(guild_id)
+            added: List[Tuple[int, str]] = []
+            for role_key, user_ids in role_users.items():
+                added.extend((user_id, role_key) for user_id in guild.add_many(role_key, user_ids))
+            if added:
+                await self._storage.apply_batch(guild_id, added, [])
+                self._notify(SubscriptionChange(guild_id, added=added))
+            return len(added)
+
+    async def remove_subscriptions(self, rows: Iterable[Tuple[int, str]], guild_id: int) -> int:
+        """批量移除 (user_id, role_key) 订阅记录，不存在的记录会被跳过，返回实际移除的条数。"""
+        role_users: Dict[str, List[int]] = defaultdict(list)
+        for user_id, role_key in rows:
+            role_users[role_key].append(user_id)
+
+        async with self._guild_locks[guild_id]:
+            return await self._remove_locked(guild_id, role_users)
+
+    async def remove_users(self, user_ids: Iterable[int], guild_id: int) -> int:
+        """移除一批用户的全部订阅 (例如成员已离开服务器)，返回实际移除的订阅条数。"""
+        async with self._guild_locks[guild_id]:
+            guild = await self._get_guild(guild_id)
+            role_users: Dict[str, List[int]] = defaultdict(list)
+            for user_id in user_ids:
+                for role_key in guild.roles_of(user_id):
+                    role_users[role_key].append(user_id)
+            return await self._remove_locked(guild_id, role_users)
+
+    async def remove_user(self, user_id: int, guild_id: int) -> int:
+        return await self.remove_users((user_id,), guild_id)
+
+    async def _remove_locked(self, guild_id: int, role_users: Dict[str, List[int]]) -> int:
+        """必须在持有该服务器的锁时调用。"""
+        guild = await self._get_guild(guild_id)
+        removed: List[Tuple[int, str]] = []
+        for role_key, user_ids in role_users.items():
+            removed.extend((user_id, role_key) for user_id in guild.remove_many(role_key, user_ids))
+        if removed:
+            await self._storage.apply_batch(guild_id, [], removed)
+            self._notify(SubscriptionChange(guild_id, removed=removed))
+        return len(removed)
+
+    async def get_subscribed_user_ids(self, guild_id: int) -> List[int]:
+        """该服务器内至少订阅了一个身份组的所有用户ID (快照)。"""
+        return list((await self._get_guild(guild_id)).user_roles)
+
+    async def export_subscriptions(self, guild_id: int) -> Iterator[Tuple[int, str]]:
+        """
+        返回逐条产出一个服务器所有 (user_id, role_key) 订阅记录的迭代器。
+        迭代基于调用时的键值快照，导出过程中发生的订阅变更不会影响遍历。
+        """
+        items = list((await self._get_guild(guild_id)).user_roles.items())
+        return ((user_id, role_key) for user_id, roles in items for role_key in roles)
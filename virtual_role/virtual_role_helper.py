@@ -1,9 +1,7 @@
-from typing import Dict, Any
+from virtual_role.virtual_role_config_manager import GuildRolesView, VirtualRoleConfigManager
 
-from virtual_role.virtual_role_config_manager import VirtualRoleConfigManager
 
-
-async def get_virtual_role_configs_for_guild(guild_id: int) -> Dict[str, Dict[str, Any]]:
+async def get_virtual_role_configs_for_guild(guild_id: int) -> GuildRolesView:
     """
     从 VirtualRoleConfigManager 为特定服务器提取所有“虚拟身份组”的配置。
 
@@ -11,7 +9,8 @@ async def get_virtual_role_configs_for_guild(guild_id: int) -> Dict[str, Dict[st
         guild_id: 服务器的ID。
 
     Returns:
-        一个字典，键是虚拟身份组的key，值是包含 'name' 和 'description' 等的字典。
+        一个只读的有序映射，键是虚拟身份组的key，值是包含 'name' 和 'description' 等的字典。
+        返回的是配置管理器缓存的视图，不要尝试修改它。
     """
     config_manager = VirtualRoleConfigManager()
     return await config_manager.get_guild_roles_ordered(guild_id)
\ No newline at end of file
@@ -0,0 +1,299 @@
+# virtual_role/virtual_role_index.py
+from array import array
+from bisect import bisect_left
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+
+class MemberIdView(Sequence[int]):
+    """
+    某个虚拟身份组成员ID的只读视图 (按ID升序)。
+    视图引用的有序数组快照创建后不会再被修改 (修改只作用于集合，并在下次读取时生成新快照)，
+    因此可以安全地在 await 之间持有和遍历。
+    """
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids: array):
+        self._ids = ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        return self._ids[index]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids)
+
+    def __contains__(self, user_id) -> bool:
+        i = bisect_left(self._ids, user_id)
+        return i < len(self._ids) and self._ids[i] == user_id
+
+    def __repr__(self) -> str:
+        return f"MemberIdView({list(self._ids)!r})"
+
+
+_EMPTY_VIEW = MemberIdView(array('Q'))
+
+
+# array('Q') 能保存的ID范围
+_MAX_ID = 2 ** 64
+
+
+def _check_id(user_id: int):
+    if not 0 <= user_id < _MAX_ID:
+        raise ValueError(f"用户ID {user_id} 超出范围")
+
+
+class _RoleMembers:
+    """
+    一个身份组的成员：写入使用集合 (O(1))，读取使用按需构建的有序数组快照。
+    快照在下一次读取时才重建，之后的修改不会影响已经发出的快照。
+    """
+    __slots__ = ("ids", "_snapshot")
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.ids: Set[int] = set(ids)
+        self._snapshot: Optional[array] = None
+
+    def add(self, user_id: int) -> bool:
+        if user_id in self.ids:
+            return False
+        self.ids.add(user_id)
+        self._snapshot = None
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        if user_id not in self.ids:
+            return False
+        self.ids.discard(user_id)
+        self._snapshot = None
+        return True
+
+    def update(self, user_ids: Iterable[int]):
+        self.ids.update(user_ids)
+        self._snapshot = None
+
+    def difference_update(self, user_ids: Iterable[int]):
+        self.ids.difference_update(user_ids)
+        self._snapshot = None
+
+    def snapshot(self) -> array:
+        if self._snapshot is None:
+            self._snapshot = array('Q', sorted(self.ids))
+        return self._snapshot
+
+
+class GuildMembershipIndex:
+    """
+    单个服务器的 role_key -> 成员ID 反向索引。
+
+    每个身份组的成员保存在一个集合中，增删和成员判断均为 O(1)；
+    需要按顺序遍历成员时 (members())，才把集合排序为 array('Q') 快照并缓存到下一次修改，
+    连续的多次修改只会在下一次读取时排序一次。
+    """
+
+    def __init__(self):
+        self._roles: Dict[str, _RoleMembers] = {}
+
+    @classmethod
+    def build(cls, role_users: Dict[str, Iterable[int]]) -> 'GuildMembershipIndex':
+        """从 {role_key: user_ids} 一次性构建索引。"""
+        index = cls()
+        for role_key, user_ids in role_users.items():
+            members = _RoleMembers(user_ids)
+            if members.ids:
+                for user_id in members.ids:
+                    _check_id(user_id)
+                index._roles[role_key] = members
+        return index
+
+    def add(self, role_key: str, user_id: int) -> bool:
+        """将用户加入身份组，如果用户原本不在其中则返回 True。ID超出范围时抛出 ValueError。"""
+        _check_id(user_id)
+        members = self._roles.get(role_key)
+        if members is None:
+            members = self._roles[role_key] = _RoleMembers()
+        return members.add(user_id)
+
+    def remove(self, role_key: str, user_id: int) -> bool:
+        """将用户移出身份组，如果用户原本在其中则返回 True。"""
+        members = self._roles.get(role_key)
+        if members is None or not members.discard(user_id):
+            return False
+        if not members.ids:
+            del self._roles[role_key]
+        return True
+
+    def add_many(self, role_key: str, user_ids: Iterable[int]):
+        """批量加入身份组。先检查全部ID，任何一个超出范围时索引不变。"""
+        user_ids = list(user_ids)
+        for user_id in user_ids:
+            _check_id(user_id)
+        if not user_ids:
+            return
+        members = self._roles.get(role_key)
+        if members is None:
+            members = self._roles[role_key] = _RoleMembers()
+        members.update(user_ids)
+
+    def remove_many(self, role_key: str, user_ids: Iterable[int]):
+        """批量移出身份组。"""
+        members = self._roles.get(role_key)
+        if members is None:
+            return
+        members.difference_update(user_ids)
+        if not members.ids:
+            del self._roles[role_key]
+
+    def contains(self, role_key: str, user_id: int) -> bool:
+        members = self._roles.get(role_key)
+        return members is not None and user_id in members.ids
+
+    def count(self, role_key: str) -> int:
+        members = self._roles.get(role_key)
+        return len(members.ids) if members else 0
+
+    def members(self, role_key: str) -> MemberIdView:
+        """返回身份组成员的只读有序视图。自上次修改以来第一次调用时排序一次，之后为 O(1)。"""
+        members = self._roles.get(role_key)
+        if members is None:
+            return _EMPTY_VIEW
+        return MemberIdView(members.snapshot())
+
+    def role_keys(self) -> Iterable[str]:
+        return self._roles.keys()
+
+    def rename(self, old_key: str, new_key: str) -> MemberIdView:
+        """
+        将 old_key 的成员合并到 new_key 下，返回被移动的成员视图。
+        如果 new_key 原本为空，这只是一次字典键的移动。
+        """
+        old_members = self._roles.pop(old_key, None)
+        if old_members is None:
+            return _EMPTY_VIEW
+        moved = MemberIdView(old_members.snapshot())
+
+        existing = self._roles.get(new_key)
+        if existing is None:
+            self._roles[new_key] = old_members
+        else:
+            existing.update(old_members.ids)
+        return moved
+
+    def union(self, role_keys: Iterable[str]) -> FrozenSet[int]:
+        """多个身份组成员的并集。"""
+        return frozenset().union(*(self._roles[key].ids for key in role_keys if key in self._roles))
+
+    def intersection(self, role_keys: Iterable[str]) -> FrozenSet[int]:
+        """多个身份组成员的交集，从最小的身份组开始计算。"""
+        sets = sorted((self._roles[key].ids if key in self._roles else set() for key in role_keys), key=len)
+        if not sets:
+            return frozenset()
+        return frozenset(sets[0]).intersection(*sets[1:])
+
+
+class GuildSubscriptions:
+    """
+    单个服务器的全部订阅数据：正向映射 user_id -> (role_keys) 加上反向索引。
+
+    读取方无需加锁：每个用户的身份组列表是不可变的元组，修改时整体替换；
+    反向索引返回的视图引用不可变的有序快照。所有修改都在一段不含 await 的同步代码中完成，
+    因此读取方看到的总是某次修改之前或之后的完整状态。
+
+    计数器随每次修改增量维护，读取均为 O(1)：
+    - 每个身份组的人数即反向索引集合的大小；
+    - 用户的引用计数即其身份组元组的长度，归零时用户被移出 user_roles，
+      因此 len(user_roles) 就是独立订阅人数；
+    - total_subscriptions 为总订阅人次。
+    """
+
+    def __init__(self, user_roles: Dict[int, Tuple[str, ...]] = None):
+        self.user_roles: Dict[int, Tuple[str, ...]] = user_roles or {}
+        self.total_subscriptions = 0
+        role_users: Dict[str, List[int]] = {}
+        for user_id, roles in self.user_roles.items():
+            self.total_subscriptions += len(roles)
+            for role_key in roles:
+                role_users.setdefault(role_key, []).append(user_id)
+        self.index = GuildMembershipIndex.build(role_users)
+
+    @classmethod
+    def from_role_users(cls, role_users: Dict[str, Iterable[int]]) -> 'GuildSubscriptions':
+        """从按身份组组织的数据 {role_key: user_ids} 构建 (存储后端按这种形式保存数据)。"""
+        user_roles: Dict[int, Tuple[str, ...]] = {}
+        for role_key, user_ids in role_users.items():
+            for user_id in user_ids:
+                user_roles[user_id] = user_roles.get(user_id, ()) + (role_key,)
+        return cls(user_roles)
+
+    @property
+    def unique_subscribers(self) -> int:
+        return len(self.user_roles)
+
+    def roles_of(self, user_id: int) -> Tuple[str, ...]:
+        return self.user_roles.get(user_id, ())
+
+    def add(self, user_id: int, role_key: str) -> bool:
+        roles = self.user_roles.get(user_id, ())
+        if role_key in roles:
+            return False
+        # 先更新索引：超出范围的ID会在这里抛出 ValueError，此时正向映射还没有被修改
+        self.index.add(role_key, user_id)
+        self.user_roles[user_id] = roles + (role_key,)
+        self.total_subscriptions += 1
+        return True
+
+    def remove(self, user_id: int, role_key: str) -> bool:
+        roles = self.user_roles.get(user_id, ())
+        if role_key not in roles:
+            return False
+        remaining = tuple(key for key in roles if key != role_key)
+        if remaining:
+            self.user_roles[user_id] = remaining
+        else:
+            del self.user_roles[user_id]
+        self.index.remove(role_key, user_id)
+        self.total_subscriptions -= 1
+        return True
+
+    def add_many(self, role_key: str, user_ids: Iterable[int]) -> List[int]:
+        """批量订阅，返回实际新增的用户ID。"""
+        added = [user_id for user_id in set(user_ids) if role_key not in self.user_roles.get(user_id, ())]
+        if not added:
+            return added
+        # 先整体重建索引 (失败时索引不变)，成功后再修改正向映射，两者不会出现不一致
+        self.index.add_many(role_key, added)
+        for user_id in added:
+            self.user_roles[user_id] = self.user_roles.get(user_id, ()) + (role_key,)
+        self.total_subscriptions += len(added)
+        return added
+
+    def remove_many(self, role_key: str, user_ids: Iterable[int]) -> List[int]:
+        """批量退订，返回实际被移除的用户ID。"""
+        removed = []
+        for user_id in set(user_ids):
+            roles = self.user_roles.get(user_id, ())
+            if role_key in roles:
+                remaining = tuple(key for key in roles if key != role_key)
+                if remaining:
+                    self.user_roles[user_id] = remaining
+                else:
+                    del self.user_roles[user_id]
+                removed.append(user_id)
+        if removed:
+            self.index.remove_many(role_key, removed)
+            self.total_subscriptions -= len(removed)
+        return removed
+
+    def rename(self, old_key: str, new_key: str) -> int:
+        """重命名身份组，返回受影响的用户数。只遍历原身份组的成员。"""
+        moved_user_ids = self.index.rename(old_key, new_key)
+        for user_id in moved_user_ids:
+            roles = tuple(key for key in self.user_roles[user_id] if key != old_key)
+            if new_key in roles:
+                # 用户同时订阅了新旧两个身份组，合并后少了一条订阅
+                self.total_subscriptions -= 1
+            else:
+                roles += (new_key,)
+            self.user_roles[user_id] = roles
+        return len(moved_user_ids)
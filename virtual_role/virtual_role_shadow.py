@@ -0,0 +1,266 @@
+# virtual_role/virtual_role_shadow.py
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+import discord
+
+import config
+from utility import member_cache
+from utility.member_cache import resolve_members
+from utility.rate_limit import route_key
+from utility.write_behind import WriteBehindWriter, write_file_atomic
+from virtual_role.virtual_role_config_manager import VirtualRoleConfigManager
+from virtual_role.virtual_role_data_manager import SubscriptionChange, VirtualRoleDataManager
+
+if TYPE_CHECKING:
+    from main import NewsBot
+
+SHADOW_ROLES_FILE = os.path.join("data", "virtual_role_shadow_roles.json")
+# 影子身份组的名称前缀，与临时通知身份组的 "通知-" 前缀区分
+SHADOW_ROLE_NAME_PREFIX = "订阅-"
+
+# 是否为每个虚拟组维护一个长期存在的隐藏身份组，提及时只需切换一次可提及状态
+SHADOW_ROLES_ENABLED = getattr(config, "VIRTUAL_ROLE_SHADOW_ROLES", False)
+# 对照订阅数据全量校正影子身份组成员的间隔 (分钟)
+SHADOW_ROLE_SYNC_MINUTES = getattr(config, "VIRTUAL_ROLE_SHADOW_SYNC_MINUTES", 30)
+
+logger = logging.getLogger("NewsBot.ShadowRoles")
+
+
+class ShadowRoleManager:
+    """
+    影子身份组：每个虚拟组对应一个长期存在的、无权限、不显示的真实身份组。
+
+    - 订阅/退订通过数据管理器的监听接口进入待处理队列 (同一成员的多次变更会合并为最后一次)，
+      由后台任务逐个调用添加/移除成员身份组的 REST 接口。
+    - 校正任务定期对照订阅数据和身份组的实际成员，补上遗漏的变更、重建被删除的身份组、
+      删除已不存在的虚拟组对应的身份组。
+    - 只有成员已校正且没有待处理变更的身份组才会被用于提及，否则调用方应退回临时身份组方案。
+    """
+
+    def __init__(self, bot: 'NewsBot'):
+        self.bot = bot
+        self.data_manager = VirtualRoleDataManager()
+        self.config_manager = VirtualRoleConfigManager()
+        self._writer = WriteBehindWriter.default()
+        # { guild_id_str: { role_key: role_id } }
+        self._role_ids: Dict[str, Dict[str, int]] = self._load()
+        # { guild_id: { (role_key, user_id): True 表示添加 / False 表示移除 } }
+        self._pending: Dict[int, Dict[Tuple[str, int], bool]] = {}
+        # 成员已对照订阅数据校正过的 (guild_id, role_key)
+        self._synced: Set[Tuple[int, str]] = set()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+    # --- 持久化 ---
+
+    @staticmethod
+    def _load() -> Dict[str, Dict[str, int]]:
+        try:
+            with open(SHADOW_ROLES_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.error(f"无法解析 {SHADOW_ROLES_FILE}，已有的影子身份组将在校正时被重新创建。")
+            return {}
+
+    def _schedule_save(self):
+        snapshot = json.dumps(self._role_ids, indent=4, ensure_ascii=False)
+        self._writer.schedule(SHADOW_ROLES_FILE, lambda: write_file_atomic(SHADOW_ROLES_FILE, snapshot))
+
+    def _set_role_id(self, guild_id: int, role_key: str, role_id: Optional[int]):
+        guild_roles = self._role_ids.setdefault(str(guild_id), {})
+        if role_id is None:
+            guild_roles.pop(role_key, None)
+            if not guild_roles:
+                del self._role_ids[str(guild_id)]
+        else:
+            guild_roles[role_key] = role_id
+        self._schedule_save()
+
+    # --- 生命周期 ---
+
+    def start(self):
+        self.data_manager.add_listener(self.on_subscriptions_changed)
+        self._worker = asyncio.create_task(self._process_pending())
+
+    def stop(self):
+        self.data_manager.remove_listener(self.on_subscriptions_changed)
+        if self._worker:
+            self._worker.cancel()
+
+    # --- 增量同步 ---
+
+    def on_subscriptions_changed(self, change: SubscriptionChange):
+        if change.renamed:
+            self._on_renamed(change.guild_id, *change.renamed)
+            return
+        guild_roles = self._role_ids.get(str(change.guild_id))
+        if not guild_roles:
+            return
+        pending = self._pending.setdefault(change.guild_id, {})
+        for user_id, role_key in change.added:
+            if role_key in guild_roles:
+                pending[(role_key, user_id)] = True
+        for user_id, role_key in change.removed:
+            if role_key in guild_roles:
+                pending[(role_key, user_id)] = False
+        if pending:
+            self._wakeup.set()
+
+    def _on_renamed(self, guild_id: int, old_key: str, new_key: str):
+        guild_roles = self._role_ids.get(str(guild_id), {})
+        role_id = guild_roles.get(old_key)
+        if role_id is None:
+            return
+        if new_key in guild_roles:
+            # 两个身份组的订阅被合并：保留新 key 的身份组，旧的在校正时被删除
+            self._synced.discard((guild_id, new_key))
+            return
+        self._set_role_id(guild_id, old_key, None)
+        self._set_role_id(guild_id, new_key, role_id)
+        if (guild_id, old_key) in self._synced:
+            self._synced.discard((guild_id, old_key))
+            self._synced.add((guild_id, new_key))
+        pending = self._pending.get(guild_id, {})
+        for _, user_id in [op for op in pending if op[0] == old_key]:
+            pending[(new_key, user_id)] = pending.pop((old_key, user_id))
+
+        guild = self.bot.get_guild(guild_id)
+        role = guild.get_role(role_id) if guild else None
+        if role:
+            asyncio.create_task(self._rename_role(role, new_key))
+
+    @staticmethod
+    async def _rename_role(role: discord.Role, role_key: str):
+        try:
+            await role.edit(name=f"{SHADOW_ROLE_NAME_PREFIX}{role_key}", reason="新闻组标识符已修改")
+        except discord.HTTPException as e:
+            logger.warning(f"无法重命名影子身份组 {role.id}: {e}")
+
+    async def _process_pending(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                guild_id, pending = next(iter(self._pending.items()))
+                if not pending:
+                    del self._pending[guild_id]
+                    continue
+                # 变更在请求完成后才从待处理队列中移除，进行中的变更同样会让 get_ready_role 返回 None
+                (role_key, user_id), add = next(iter(pending.items()))
+                try:
+                    await self._apply(guild_id, role_key, user_id, add)
+                except Exception as e:
+                    # 网络错误、超时等：成员状态不确定，标记为未校正，由下次校正重新对照
+                    logger.warning(f"同步服务器 {guild_id} 影子身份组 '{role_key}' 的成员 {user_id} 失败: {e}")
+                    self._synced.discard((guild_id, role_key))
+                # 请求期间同一变更被覆盖 (例如订阅后又退订) 时保留新的变更，稍后再处理
+                if pending.get((role_key, user_id)) == add:
+                    del pending[(role_key, user_id)]
+
+    async def _apply(self, guild_id: int, role_key: str, user_id: int, add: bool):
+        role_id = self._role_ids.get(str(guild_id), {}).get(role_key)
+        if role_id is None:
+            return
+        monitor = getattr(self.bot, "rate_limits", None)
+        if monitor:
+            await monitor.acquire(route_key(
+                "PUT" if add else "DELETE",
+                f"/api/v{discord.http.INTERNAL_API_VERSION}/guilds/{guild_id}/members/0/roles/0"
+            ))
+        try:
+            if add:
+                await self.bot.http.add_role(guild_id, user_id, role_id, reason="新闻订阅")
+            else:
+                await self.bot.http.remove_role(guild_id, user_id, role_id, reason="取消新闻订阅")
+        except discord.NotFound:
+            # 成员已离开服务器，或身份组被删除 (由校正任务重建)
+            pass
+
+    # --- 全量校正 ---
+
+    async def _ensure_role(self, guild: discord.Guild, role_key: str) -> Optional[discord.Role]:
+        role_id = self._role_ids.get(str(guild.id), {}).get(role_key)
+        role = guild.get_role(role_id) if role_id else None
+        if role is not None:
+            return role
+        try:
+            role = await guild.create_role(
+                name=f"{SHADOW_ROLE_NAME_PREFIX}{role_key}",
+                permissions=discord.Permissions.none(),
+                mentionable=False,
+                reason="新闻订阅组的影子身份组"
+            )
+        except discord.HTTPException as e:
+            logger.error(f"无法为服务器 {guild.id} 的新闻组 '{role_key}' 创建影子身份组: {e}")
+            return None
+        self._set_role_id(guild.id, role_key, role.id)
+        self._synced.discard((guild.id, role_key))
+        return role
+
+    async def reconcile_guild(self, guild: discord.Guild):
+        """对照订阅数据校正一个服务器的所有影子身份组。"""
+        role_configs = await self.config_manager.get_guild_roles_ordered(guild.id)
+
+        # 删除已不存在的虚拟组对应的影子身份组
+        for role_key, role_id in list(self._role_ids.get(str(guild.id), {}).items()):
+            if role_key in role_configs:
+                continue
+            role = guild.get_role(role_id)
+            if role:
+                try:
+                    await role.delete(reason="新闻订阅组已删除")
+                except discord.HTTPException as e:
+                    logger.warning(f"无法删除影子身份组 {role_id}: {e}")
+                    continue
+            self._set_role_id(guild.id, role_key, None)
+            self._synced.discard((guild.id, role_key))
+
+        for role_key in role_configs:
+            role = await self._ensure_role(guild, role_key)
+            if role is None:
+                continue
+            subscribers = await self.data_manager.get_users_in_role(role_key, guild.id)
+            desired = set(await resolve_members(guild, subscribers))
+            # 按需缓存成员时 role.members 只包含已缓存的成员 (订阅者都已在上一步缓存)，
+            # 已退订且未缓存的成员由增量同步负责移除
+            current = {member.id for member in role.members}
+            pending = self._pending.setdefault(guild.id, {})
+            for user_id in desired - current:
+                pending[(role_key, user_id)] = True
+            for user_id in current - desired:
+                pending[(role_key, user_id)] = False
+            self._synced.add((guild.id, role_key))
+        if self._pending.get(guild.id):
+            self._wakeup.set()
+
+    async def reconcile_all(self):
+        for guild in self.bot.guilds:
+            # 使用完整成员缓存时，等成员列表拉取完成后再校正
+            if not guild.chunked and not member_cache.is_lazy():
+                continue
+            try:
+                await self.reconcile_guild(guild)
+            except Exception as e:
+                logger.error(f"校正服务器 {guild.id} 的影子身份组时出错: {e}", exc_info=True)
+
+    # --- 提及 ---
+
+    def get_ready_role(self, guild: discord.Guild, role_key: str) -> Optional[discord.Role]:
+        """
+        返回可以直接用于提及的影子身份组：已校正且没有待处理的成员变更。
+        否则返回 None，并由调用方使用临时身份组方案。
+        """
+        if (guild.id, role_key) not in self._synced:
+            return None
+        if any(key == role_key for key, _ in self._pending.get(guild.id, {})):
+            return None
+        role_id = self._role_ids.get(str(guild.id), {}).get(role_key)
+        return guild.get_role(role_id) if role_id else None
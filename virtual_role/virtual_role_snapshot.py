@@ -0,0 +1,161 @@
+# virtual_role/virtual_role_snapshot.py
+import logging
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+from utility.write_behind import write_file_atomic
+
+# 二进制快照格式 (小端):
+#   文件头: magic "NVRS"(4) 版本(2) 服务器数量(4)
+#   索引:   每个服务器一项 guild_id(8) 数据块偏移(8) 数据块长度(8) crc32(4)，按 guild_id 升序
+#   数据块: varint 身份组数量，之后每个身份组为
+#           varint key长度 | key (UTF-8) | varint 成员数量 | 成员ID升序排列后的 varint 差值
+#
+# 索引只有几十字节每服务器，启动时只解析索引；某个服务器的数据块在第一次访问时才被解码。
+# 在 POSIX 系统上文件通过 mmap 读取，未被访问的服务器的数据不会被读入内存。
+SNAPSHOT_MAGIC = b"NVRS"
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('<4sHI')
+_INDEX_ENTRY = struct.Struct('<QQQI')
+
+# 按身份组组织的服务器数据: { role_key: user_ids }
+RoleUsers = Dict[str, Iterable[int]]
+
+logger = logging.getLogger("NewsBot.VirtualRoleSnapshot")
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(buffer, offset: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def encode_guild_block(role_users: Mapping[str, Iterable[int]]) -> bytes:
+    """把一个服务器的 {role_key: user_ids} 编码为数据块，空的身份组会被省略。"""
+    roles = [(role_key, sorted(set(user_ids))) for role_key, user_ids in role_users.items()]
+    roles = [(role_key, user_ids) for role_key, user_ids in roles if user_ids]
+
+    out = bytearray()
+    _write_varint(out, len(roles))
+    for role_key, user_ids in roles:
+        key_bytes = role_key.encode('utf-8')
+        _write_varint(out, len(key_bytes))
+        out += key_bytes
+        _write_varint(out, len(user_ids))
+        previous = 0
+        for user_id in user_ids:
+            _write_varint(out, user_id - previous)
+            previous = user_id
+    return bytes(out)
+
+
+def decode_guild_block(block) -> Dict[str, List[int]]:
+    """解码一个数据块，返回 {role_key: 升序的 user_ids}。"""
+    role_users: Dict[str, List[int]] = {}
+    role_count, offset = _read_varint(block, 0)
+    for _ in range(role_count):
+        key_len, offset = _read_varint(block, offset)
+        role_key = bytes(block[offset:offset + key_len]).decode('utf-8')
+        offset += key_len
+        member_count, offset = _read_varint(block, offset)
+        user_ids = []
+        user_id = 0
+        for _ in range(member_count):
+            delta, offset = _read_varint(block, offset)
+            user_id += delta
+            user_ids.append(user_id)
+        role_users[role_key] = user_ids
+    return role_users
+
+
+def write_snapshot(path: str, blocks: Iterable[Tuple[int, Union[bytes, memoryview]]]):
+    """原子地写入快照文件。blocks 为 (guild_id, 已编码的数据块)，空数据块会被跳过。"""
+    blocks = sorted(((guild_id, block) for guild_id, block in blocks if block), key=lambda item: item[0])
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(blocks))
+    offset = len(header) + _INDEX_ENTRY.size * len(blocks)
+
+    parts = [header]
+    for guild_id, block in blocks:
+        parts.append(_INDEX_ENTRY.pack(guild_id, offset, len(block), zlib.crc32(block)))
+        offset += len(block)
+    parts.extend(block for _, block in blocks)
+    write_file_atomic(path, b"".join(parts))
+
+
+class SnapshotReader:
+    """
+    只读地打开一个快照文件，构造时只解析索引。
+
+    文件被替换 (os.replace) 后，已打开的 reader 仍然读取旧文件的内容。
+    Windows 无法替换仍被映射的文件，因此在非 POSIX 系统上直接把文件读入内存。
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._buffer: Union[bytes, mmap.mmap] = b""
+        # { guild_id: (偏移, 长度, crc32) }
+        self._index: Dict[int, Tuple[int, int, int]] = {}
+        try:
+            self._open()
+        except FileNotFoundError:
+            pass
+
+    def _open(self):
+        with open(self._path, 'rb') as f:
+            if os.name == 'posix' and os.fstat(f.fileno()).st_size > 0:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = f.read()
+
+        if len(self._buffer) < _HEADER.size:
+            if self._buffer:
+                logger.error(f"快照文件 {self._path} 不完整，将被视为空。")
+            return
+        magic, version, guild_count = _HEADER.unpack_from(self._buffer, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            logger.error(f"快照文件 {self._path} 的格式无法识别 (magic={magic!r}, version={version})，将被视为空。")
+            return
+        for i in range(guild_count):
+            guild_id, offset, length, crc = _INDEX_ENTRY.unpack_from(self._buffer, _HEADER.size + i * _INDEX_ENTRY.size)
+            self._index[guild_id] = (offset, length, crc)
+
+    def guild_ids(self) -> Iterable[int]:
+        return self._index.keys()
+
+    def block(self, guild_id: int) -> Optional[bytes]:
+        """返回服务器的原始数据块 (已校验)，不存在或校验失败时返回 None。"""
+        entry = self._index.get(guild_id)
+        if entry is None:
+            return None
+        offset, length, crc = entry
+        block = self._buffer[offset:offset + length]
+        if zlib.crc32(block) != crc:
+            logger.error(f"快照文件 {self._path} 中服务器 {guild_id} 的数据块校验失败，该服务器的快照数据将被忽略。")
+            return None
+        return block
+
+    def read_guild(self, guild_id: int) -> Dict[str, List[int]]:
+        block = self.block(guild_id)
+        return decode_guild_block(block) if block else {}
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b""
+        self._index = {}
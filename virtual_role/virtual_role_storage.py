@@ -0,0 +1,456 @@
+# virtual_role/virtual_role_storage.py
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import config
+from utility.write_behind import WriteBehindWriter, fsync_directory
+from virtual_role.virtual_role_snapshot import (
+    RoleUsers, SnapshotReader, encode_guild_block, write_snapshot
+)
+
+DATA_DIR = "data"
+# 旧版 JSON 快照，只在迁移时读取
+JSON_DATA_FILE = os.path.join(DATA_DIR, "user_virtual_roles.json")
+SNAPSHOT_DATA_FILE = os.path.join(DATA_DIR, "user_virtual_roles.snap")
+JOURNAL_DATA_FILE = os.path.join(DATA_DIR, "user_virtual_roles.journal")
+SQLITE_DATA_FILE = os.path.join(DATA_DIR, "user_virtual_roles.sqlite3")
+
+# 日志文件超过该大小 (字节) 后合并进快照
+JOURNAL_COMPACT_BYTES = getattr(config, "VIRTUAL_ROLE_JOURNAL_COMPACT_BYTES", 1024 * 1024)
+
+# 日志记录格式: op(1) guild_id(8) user_id(8) key长度(2) new_key长度(2) | key | new_key | crc32(4)
+_RECORD_HEADER = struct.Struct('<BQQHH')
+_RECORD_CRC = struct.Struct('<I')
+_OP_ADD, _OP_REMOVE, _OP_RENAME = 1, 2, 3
+
+# 按服务器组织的完整数据: { guild_id: { role_key: user_ids } }
+GuildData = Dict[int, Dict[str, Set[int]]]
+# 一条日志记录去掉 guild_id 后的内容: (op, user_id, key, new_key)
+JournalRecord = Tuple[int, int, str, str]
+
+logger = logging.getLogger("NewsBot.VirtualRoleStorage")
+
+
+class VirtualRoleStorage(ABC):
+    """
+    虚拟身份组订阅数据的持久化后端接口。
+
+    内存中的数据和反向映射由 VirtualRoleDataManager 维护，
+    后端只负责在某个服务器第一次被访问时提供它的数据，并把每一次变更落盘。
+    没有实现全部抽象方法的后端在实例化时就会报错。
+    """
+
+    @abstractmethod
+    def load_guild(self, guild_id: int) -> RoleUsers:
+        """
+        同步加载一个服务器的订阅数据，返回 {role_key: user_ids}。
+        数据管理器在线程池中调用它 (不阻塞事件循环)，不同服务器的加载可能在多个线程中同时进行。
+        """
+
+    @abstractmethod
+    async def add(self, guild_id: int, user_id: int, role_key: str):
+        ...
+
+    @abstractmethod
+    async def remove(self, guild_id: int, user_id: int, role_key: str):
+        ...
+
+    @abstractmethod
+    async def rename(self, guild_id: int, old_key: str, new_key: str):
+        ...
+
+    @abstractmethod
+    async def apply_batch(self, guild_id: int, added: Sequence[Tuple[int, str]], removed: Sequence[Tuple[int, str]]):
+        """批量写入 (user_id, role_key) 的添加和移除，整个批次只产生一次写入。"""
+
+    async def flush(self):
+        """等待所有已提交的变更写入磁盘。"""
+        pass
+
+
+class JournalVirtualRoleStorage(VirtualRoleStorage):
+    """
+    快照 + 追加日志存储。
+
+    - 快照: data/user_virtual_roles.snap，按服务器分块的二进制格式 (见 virtual_role_snapshot)。
+      启动时只解析索引，服务器的数据块在第一次被访问时才解码。
+    - 日志: 每次变更向 data/user_virtual_roles.journal 追加一条固定格式的记录，O(1) 写入，不再整体重写文件。
+      启动时把日志记录按服务器分组暂存，在解码该服务器的快照数据块后再应用。
+    - 日志超过阈值后，把它轮转为 .compacting 文件，在写线程中合并进新快照，之后删除。
+      合并时没有变更的服务器直接复制原始数据块，不需要解码。
+    - 旧版的 JSON 快照 (data/user_virtual_roles.json) 会在首次启动时自动转换为二进制快照。
+    - 所有文件写入都在写后台线程中执行，事件循环只负责编码并投递记录。
+
+    所有记录 (添加/移除/重命名) 都是幂等的，因此即使在合并过程中崩溃，重放也不会产生错误数据。
+    """
+
+    def __init__(self, snapshot_path: str = SNAPSHOT_DATA_FILE, journal_path: str = JOURNAL_DATA_FILE,
+                 legacy_json_path: str = JSON_DATA_FILE, compact_threshold: int = JOURNAL_COMPACT_BYTES,
+                 writer: Optional[WriteBehindWriter] = None):
+        self._snapshot_path = snapshot_path
+        self._journal_path = journal_path
+        self._compacting_path = journal_path + ".compacting"
+        self._legacy_json_path = legacy_json_path
+        self._compact_threshold = compact_threshold
+        # 日志文件只在写线程中访问
+        self._writer = writer or WriteBehindWriter.default()
+        self._journal_file = None
+        self._journal_size = 0
+        self._compacting = False
+        # 以下两项只在事件循环中访问：启动时的快照，以及尚未被访问的服务器在启动时日志中的记录
+        self._snapshot: Optional[SnapshotReader] = None
+        self._pending_records: Dict[int, List[JournalRecord]] = {}
+        self._open()
+
+    # --- 记录编解码 ---
+
+    @staticmethod
+    def _encode_record(op: int, guild_id: int, user_id: int, key: str, new_key: str = "") -> bytes:
+        key_bytes, new_key_bytes = key.encode('utf-8'), new_key.encode('utf-8')
+        body = _RECORD_HEADER.pack(op, guild_id, user_id, len(key_bytes), len(new_key_bytes)) + key_bytes + new_key_bytes
+        return body + _RECORD_CRC.pack(zlib.crc32(body))
+
+    @staticmethod
+    def _iter_records(buffer: bytes) -> Iterator[Tuple[int, int, int, int, str, str]]:
+        """依次解码记录，返回 (结束偏移, op, guild_id, user_id, key, new_key)。遇到不完整或损坏的记录即停止。"""
+        offset = 0
+        while offset + _RECORD_HEADER.size <= len(buffer):
+            op, guild_id, user_id, key_len, new_key_len = _RECORD_HEADER.unpack_from(buffer, offset)
+            body_end = offset + _RECORD_HEADER.size + key_len + new_key_len
+            record_end = body_end + _RECORD_CRC.size
+            if record_end > len(buffer):
+                return
+            (crc,) = _RECORD_CRC.unpack_from(buffer, body_end)
+            if crc != zlib.crc32(buffer[offset:body_end]):
+                return
+            key_start = offset + _RECORD_HEADER.size
+            key = buffer[key_start:key_start + key_len].decode('utf-8')
+            new_key = buffer[key_start + key_len:body_end].decode('utf-8')
+            yield record_end, op, guild_id, user_id, key, new_key
+            offset = record_end
+
+    @staticmethod
+    def _apply_records(role_users: RoleUsers, records: Iterable[JournalRecord]) -> Dict[str, Set[int]]:
+        """把一个服务器的日志记录依次应用到它的数据上。"""
+        members = {role_key: set(user_ids) for role_key, user_ids in role_users.items()}
+        for op, user_id, key, new_key in records:
+            if op == _OP_ADD:
+                members.setdefault(key, set()).add(user_id)
+            elif op == _OP_REMOVE:
+                user_ids = members.get(key)
+                if user_ids is not None:
+                    user_ids.discard(user_id)
+                    if not user_ids:
+                        del members[key]
+            elif op == _OP_RENAME:
+                user_ids = members.pop(key, None)
+                if user_ids:
+                    members.setdefault(new_key, set()).update(user_ids)
+        return members
+
+    @classmethod
+    def _read_journal(cls, path: str, records: Dict[int, List[JournalRecord]]) -> int:
+        """把日志文件中的记录按服务器追加到 records，返回有效记录的结束偏移。"""
+        try:
+            with open(path, 'rb') as f:
+                buffer = f.read()
+        except FileNotFoundError:
+            return 0
+        valid_end = 0
+        for valid_end, op, guild_id, user_id, key, new_key in cls._iter_records(buffer):
+            records.setdefault(guild_id, []).append((op, user_id, key, new_key))
+        if valid_end < len(buffer):
+            logger.warning(f"日志文件 {path} 末尾有 {len(buffer) - valid_end} 字节不完整的记录，已忽略。")
+        return valid_end
+
+    @staticmethod
+    def _read_legacy_json(path: str) -> Optional[GuildData]:
+        """读取旧版 JSON 快照 { guild_id_str: { user_id_str: [roles] } }，文件不存在时返回 None。"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                legacy_data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logger.error(f"无法解析旧版快照文件 {path}，将以空数据启动。")
+            return {}
+        data: GuildData = {}
+        for guild_id_str, user_roles_map in legacy_data.items():
+            members = data.setdefault(int(guild_id_str), {})
+            for user_id_str, roles in user_roles_map.items():
+                for role_key in roles:
+                    members.setdefault(role_key, set()).add(int(user_id_str))
+        return data
+
+    def _fold_journal(self, journal_path: str):
+        """把一个日志文件合并进快照，没有变更的服务器直接复制原始数据块。"""
+        records: Dict[int, List[JournalRecord]] = {}
+        self._read_journal(journal_path, records)
+        snapshot = SnapshotReader(self._snapshot_path)
+        try:
+            blocks = []
+            for guild_id in set(snapshot.guild_ids()).union(records):
+                guild_records = records.get(guild_id)
+                if guild_records is None:
+                    blocks.append((guild_id, snapshot.block(guild_id)))
+                else:
+                    role_users = self._apply_records(snapshot.read_guild(guild_id), guild_records)
+                    blocks.append((guild_id, encode_guild_block(role_users)))
+            write_snapshot(self._snapshot_path, blocks)
+        finally:
+            snapshot.close()
+        os.remove(journal_path)
+
+    @classmethod
+    def read_state(cls, snapshot_path: str = SNAPSHOT_DATA_FILE, journal_path: str = JOURNAL_DATA_FILE,
+                   legacy_json_path: str = JSON_DATA_FILE) -> GuildData:
+        """读取快照 (或旧版 JSON 快照) 并重放所有日志，得到完整的当前数据 (不修改任何文件)。"""
+        records: Dict[int, List[JournalRecord]] = {}
+        cls._read_journal(journal_path + ".compacting", records)
+        cls._read_journal(journal_path, records)
+
+        if os.path.exists(snapshot_path):
+            snapshot = SnapshotReader(snapshot_path)
+            try:
+                data: GuildData = {guild_id: snapshot.read_guild(guild_id) for guild_id in snapshot.guild_ids()}
+            finally:
+                snapshot.close()
+        else:
+            data = cls._read_legacy_json(legacy_json_path) or {}
+
+        for guild_id, guild_records in records.items():
+            data[guild_id] = cls._apply_records(data.get(guild_id, {}), guild_records)
+        return data
+
+    # --- 存储接口 ---
+
+    def _open(self):
+        if not os.path.exists(self._snapshot_path):
+            legacy_data = self._read_legacy_json(self._legacy_json_path)
+            if legacy_data is not None:
+                write_snapshot(
+                    self._snapshot_path,
+                    ((guild_id, encode_guild_block(role_users)) for guild_id, role_users in legacy_data.items())
+                )
+                logger.info(f"已将旧版快照 {self._legacy_json_path} 转换为二进制快照 {self._snapshot_path}。")
+
+        if os.path.exists(self._compacting_path):
+            # 上次合并没有完成：先完成它，再读取快照
+            self._fold_journal(self._compacting_path)
+
+        self._snapshot = SnapshotReader(self._snapshot_path)
+        valid_end = self._read_journal(self._journal_path, self._pending_records)
+
+        self._journal_file = open(self._journal_path, 'ab')
+        # 截掉崩溃时写了一半的记录，保证之后追加的记录可以被正确解析
+        self._journal_file.truncate(valid_end)
+        self._journal_size = valid_end
+
+    def load_guild(self, guild_id: int) -> RoleUsers:
+        # 服务器只会被加载一次，之后的变更都来自内存，启动快照之后的合并不会影响这里的结果
+        role_users = self._snapshot.read_guild(guild_id)
+        records = self._pending_records.pop(guild_id, None)
+        if records:
+            return self._apply_records(role_users, records)
+        return role_users
+
+    # 以下 _write_record / _fsync_journal / _rotate_and_fold 只在写线程中执行
+
+    def _write_record(self, record: bytes):
+        self._journal_file.write(record)
+        # 队列中没有更多待写记录时才 fsync，突发流量下多条记录共享一次 fsync
+        if self._writer.is_idle():
+            self._fsync_journal()
+
+    def _fsync_journal(self):
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+
+    def _rotate_and_fold(self):
+        """轮转当前日志，并把它合并进快照。"""
+        # 如果上一次合并失败留下了 .compacting 文件，先只重试合并，避免覆盖其中的记录
+        if not os.path.exists(self._compacting_path):
+            self._fsync_journal()
+            self._journal_file.close()
+            os.replace(self._journal_path, self._compacting_path)
+            self._journal_file = open(self._journal_path, 'ab')
+            fsync_directory(os.path.dirname(self._journal_path) or ".")
+
+        self._fold_journal(self._compacting_path)
+        logger.info("订阅日志已合并到快照。")
+
+    def _append(self, record: bytes):
+        self._writer.submit(self._write_record, record)
+        self._journal_size += len(record)
+        if self._journal_size >= self._compact_threshold and not self._compacting:
+            self._compacting = True
+            self._journal_size = 0
+            self._writer.submit(self._rotate_and_fold).add_done_callback(self._on_compacted)
+
+    def _on_compacted(self, _future):
+        self._compacting = False
+
+    async def add(self, guild_id: int, user_id: int, role_key: str):
+        self._append(self._encode_record(_OP_ADD, guild_id, user_id, role_key))
+
+    async def remove(self, guild_id: int, user_id: int, role_key: str):
+        self._append(self._encode_record(_OP_REMOVE, guild_id, user_id, role_key))
+
+    async def rename(self, guild_id: int, old_key: str, new_key: str):
+        self._append(self._encode_record(_OP_RENAME, guild_id, 0, old_key, new_key))
+
+    async def apply_batch(self, guild_id: int, added: Sequence[Tuple[int, str]], removed: Sequence[Tuple[int, str]]):
+        records = [self._encode_record(_OP_ADD, guild_id, user_id, role_key) for user_id, role_key in added]
+        records.extend(self._encode_record(_OP_REMOVE, guild_id, user_id, role_key) for user_id, role_key in removed)
+        if records:
+            self._append(b"".join(records))
+
+    async def flush(self):
+        await self._writer.run(self._fsync_journal)
+
+
+class SqliteVirtualRoleStorage(VirtualRoleStorage):
+    """
+    SQLite (WAL) 存储：每条订阅是一行 (guild_id, role_key, user_id)。
+    每次变更只写入一行，所有数据库操作都投递到写后台线程中执行，不阻塞事件循环。
+    服务器的数据在第一次被访问时按主键范围读取。首次启动时会自动从旧的快照/日志文件迁移数据。
+    """
+
+    def __init__(self, path: str = SQLITE_DATA_FILE, legacy_snapshot_path: str = SNAPSHOT_DATA_FILE,
+                 legacy_journal_path: str = JOURNAL_DATA_FILE, legacy_json_path: str = JSON_DATA_FILE,
+                 writer: Optional[WriteBehindWriter] = None):
+        self._path = path
+        self._legacy_snapshot_path = legacy_snapshot_path
+        self._legacy_journal_path = legacy_journal_path
+        self._legacy_json_path = legacy_json_path
+        # sqlite3 连接不是线程安全的，只在写线程中使用它
+        self._writer = writer or WriteBehindWriter.default()
+        self._conn = self._writer.submit(self._connect).result()
+        # 加载服务器数据专用的只读连接，在线程池中使用，同一时间只允许一个线程读取。
+        # WAL 模式下读取不会被写线程阻塞；未加载的服务器不会有本进程提交的变更，因此不需要等待写队列。
+        self._read_conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                guild_id INTEGER NOT NULL,
+                role_key TEXT NOT NULL,
+                user_id  INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, role_key, user_id)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (guild_id, user_id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._migrate_from_json(conn)
+        return conn
+
+    def _migrate_from_json(self, conn: sqlite3.Connection):
+        """一次性地把旧的文件存储中的数据导入数据库。"""
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+
+        # 旧的快照可能还带有未合并的日志，一并读取
+        legacy_data = JournalVirtualRoleStorage.read_state(
+            self._legacy_snapshot_path, self._legacy_journal_path, self._legacy_json_path
+        )
+
+        rows = [
+            (guild_id, role_key, user_id)
+            for guild_id, role_users in legacy_data.items()
+            for role_key, user_ids in role_users.items()
+            for user_id in user_ids
+        ]
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR IGNORE INTO subscriptions (guild_id, role_key, user_id) VALUES (?, ?, ?)", rows)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+        if rows:
+            logger.info(f"已从旧的文件存储迁移 {len(rows)} 条订阅记录到 SQLite。")
+
+    def load_guild(self, guild_id: int) -> RoleUsers:
+        role_users: Dict[str, List[int]] = {}
+        # 按主键顺序读取，每个身份组的成员已经是升序
+        with self._read_lock:
+            cursor = self._read_conn.execute(
+                "SELECT role_key, user_id FROM subscriptions WHERE guild_id = ? ORDER BY role_key, user_id", (guild_id,)
+            )
+            for role_key, user_id in cursor:
+                role_users.setdefault(role_key, []).append(user_id)
+        return role_users
+
+    def _execute(self, sql: str, *params):
+        # 写线程会记录失败任务的日志，这里不需要等待结果
+        self._writer.submit(self._conn.execute, sql, params)
+
+    async def add(self, guild_id: int, user_id: int, role_key: str):
+        self._execute(
+            "INSERT OR IGNORE INTO subscriptions (guild_id, role_key, user_id) VALUES (?, ?, ?)",
+            guild_id, role_key, user_id
+        )
+
+    async def remove(self, guild_id: int, user_id: int, role_key: str):
+        self._execute(
+            "DELETE FROM subscriptions WHERE guild_id = ? AND role_key = ? AND user_id = ?",
+            guild_id, role_key, user_id
+        )
+
+    async def rename(self, guild_id: int, old_key: str, new_key: str):
+        def _rename():
+            with self._conn:
+                self._conn.execute("BEGIN")
+                # 已经同时订阅了新旧 key 的用户会被 OR IGNORE 跳过，之后统一删除残留的旧 key
+                self._conn.execute(
+                    "UPDATE OR IGNORE subscriptions SET role_key = ? WHERE guild_id = ? AND role_key = ?",
+                    (new_key, guild_id, old_key)
+                )
+                self._conn.execute("DELETE FROM subscriptions WHERE guild_id = ? AND role_key = ?", (guild_id, old_key))
+
+        self._writer.submit(_rename)
+
+    async def apply_batch(self, guild_id: int, added: Sequence[Tuple[int, str]], removed: Sequence[Tuple[int, str]]):
+        def _apply():
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO subscriptions (guild_id, role_key, user_id) VALUES (?, ?, ?)",
+                    [(guild_id, role_key, user_id) for user_id, role_key in added]
+                )
+                self._conn.executemany(
+                    "DELETE FROM subscriptions WHERE guild_id = ? AND role_key = ? AND user_id = ?",
+                    [(guild_id, role_key, user_id) for user_id, role_key in removed]
+                )
+
+        self._writer.submit(_apply)
+
+    async def flush(self):
+        await self._writer.flush()
+
+
+STORAGE_BACKENDS = {
+    "journal": JournalVirtualRoleStorage,
+    # 旧配置名，旧版 JSON 快照会被自动转换
+    "json": JournalVirtualRoleStorage,
+    "sqlite": SqliteVirtualRoleStorage,
+}
+
+
+def create_storage(backend: str) -> VirtualRoleStorage:
+    """根据配置的名称创建存储后端，未知名称回退到 SQLite。"""
+    storage_cls = STORAGE_BACKENDS.get(backend)
+    if storage_cls is None:
+        logger.warning(f"未知的虚拟身份组存储后端 '{backend}'，将使用 sqlite。")
+        storage_cls = SqliteVirtualRoleStorage
+    return storage_cls()
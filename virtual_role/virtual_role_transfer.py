@@ -0,0 +1,82 @@
+# virtual_role/virtual_role_transfer.py
+import csv
+import io
+import json
+from typing import Iterable, List, Tuple
+
+# 导入/导出文件格式:
+# - csv:   表头为 user_id,role_key，每行一条订阅
+# - jsonl: 每行一个 {"user_id": "...", "role_key": "..."}，user_id 使用字符串以免丢失精度
+EXPORT_FORMATS = ("csv", "jsonl")
+# Discord 的ID (snowflake) 是 64 位有符号整数中的正数
+MAX_USER_ID = 2 ** 63
+
+
+def write_subscriptions_file(rows: Iterable[Tuple[int, str]], fmt: str) -> io.BytesIO:
+    """把订阅记录逐行写入一个内存文件，返回已回到开头的 BytesIO。"""
+    buffer = io.BytesIO()
+    text = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+    if fmt == "csv":
+        writer = csv.writer(text)
+        writer.writerow(("user_id", "role_key"))
+        for user_id, role_key in rows:
+            writer.writerow((user_id, role_key))
+    elif fmt == "jsonl":
+        for user_id, role_key in rows:
+            text.write(json.dumps({"user_id": str(user_id), "role_key": role_key}, ensure_ascii=False))
+            text.write("\n")
+    else:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    text.flush()
+    # 分离包装器，避免它被回收时关闭底层的 BytesIO
+    text.detach()
+    buffer.seek(0)
+    return buffer
+
+
+def _parse_row(line_no: int, user_id, role_key) -> Tuple[int, str]:
+    try:
+        parsed_user_id = int(str(user_id).strip())
+    except ValueError:
+        raise ValueError(f"第 {line_no} 行的 user_id `{user_id}` 不是有效的数字ID。")
+    if not 0 < parsed_user_id < MAX_USER_ID:
+        raise ValueError(f"第 {line_no} 行的 user_id `{user_id}` 超出了 Discord ID 的范围。")
+    parsed_role_key = str(role_key or "").strip()
+    if not parsed_role_key:
+        raise ValueError(f"第 {line_no} 行缺少 role_key。")
+    return parsed_user_id, parsed_role_key
+
+
+def parse_subscriptions_file(filename: str, content: bytes) -> List[Tuple[int, str]]:
+    """
+    解析导入文件，根据扩展名判断格式 (.csv 或 .jsonl)。
+
+    Raises:
+        ValueError: 文件格式不正确，错误信息可直接展示给用户。
+    """
+    try:
+        text = content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError("文件必须使用 UTF-8 编码。")
+
+    rows: List[Tuple[int, str]] = []
+    if filename.lower().endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or not {"user_id", "role_key"}.issubset(reader.fieldnames):
+            raise ValueError("CSV 文件的表头必须包含 `user_id` 和 `role_key`。")
+        for line_no, record in enumerate(reader, start=2):
+            rows.append(_parse_row(line_no, record["user_id"], record["role_key"]))
+    elif filename.lower().endswith((".jsonl", ".ndjson")):
+        for line_no, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                raise ValueError(f"第 {line_no} 行不是有效的 JSON。")
+            if not isinstance(record, dict):
+                raise ValueError(f"第 {line_no} 行必须是一个 JSON 对象。")
+            rows.append(_parse_row(line_no, record.get("user_id"), record.get("role_key")))
+    else:
+        raise ValueError("仅支持 `.csv` 或 `.jsonl` 文件。")
+    return rows
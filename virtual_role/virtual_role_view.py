@@ -60,6 +60,7 @@ class VirtualRoleManageView(ui.View):
         self.clear_items()
         user_roles = await self.cog.data_manager.get_user_roles(self.user.id, self.guild.id)
         all_virtual_roles = await get_virtual_role_configs_for_guild(self.guild.id)
+        role_counts = await self.cog.data_manager.get_role_counts(all_virtual_roles.keys(), self.guild.id)
 
         if not all_virtual_roles:
             self.embed = discord.Embed(title="无可用通知组", description="此服务器没有配置任何可用的虚拟通知组。", color=Color.orange())
@@ -67,7 +68,7 @@ class VirtualRoleManageView(ui.View):
             description_lines = ["点击下方的按钮来加入或退出通知组。\n"]
             for role_key, config in all_virtual_roles.items():
                 is_selected = role_key in user_roles
-                self.add_item(VirtualRoleButton(self.cog, role_key, config["name"], is_selected))
+                self.add_item(VirtualRoleButton(self.cog, role_key, config["name"], is_selected, role_counts[role_key]))
                 status_emoji = "✅" if is_selected else "❌"
                 description_lines.append(f"{status_emoji} **{config['name']}**\n └ {config['description']}")
             self.embed = discord.Embed(
@@ -81,11 +82,13 @@ class VirtualRoleManageView(ui.View):
 
 
 class VirtualRoleButton(ui.Button):
-    def __init__(self, cog: 'VirtualRoleCog', role_key: str, role_name: str, is_selected: bool):
+    def __init__(self, cog: 'VirtualRoleCog', role_key: str, role_name: str, is_selected: bool, subscriber_count: int):
         self.cog = cog
         self.role_key = role_key
+        count_suffix = f" ({subscriber_count})"
         super().__init__(
-            label=role_name,
+            # 按钮标签最长 80 个字符，超长时截断名称以保留人数
+            label=role_name[:80 - len(count_suffix)] + count_suffix,
             style=discord.ButtonStyle.success if is_selected else discord.ButtonStyle.secondary,
             custom_id=f"toggle_virtual_role:{role_key}"
         )
@@ -23,6 +23,16 @@ STATUS_TYPE = "watching"  # 可以是 playing, watching, listening
 STATUS_TEXT = "新闻频道"
 COMMAND_GROUP_NAME = "新闻"
 
+# 成员缓存策略: "full" 启动时缓存所有成员; "subscribers" 只在需要时按ID查询并缓存订阅者等用到的成员，
+# 适合大型服务器 (启动更快、内存占用更小)。
+# 注意 "subscribers" 的网关开销：未缓存的订阅者需要通过网关按ID查询 (每 100 人一次请求，网关每分钟约 120 条消息的限额)，
+# 查到的成员会一直缓存；已离开的成员在 MEMBER_ABSENT_CACHE_MINUTES 内不会被重复查询
+MEMBER_CACHE_POLICY = "full"
+# 已确认离开服务器的成员多长时间内不再重复查询 (分钟)，应大于 VIRTUAL_ROLE_PRUNE_INTERVAL_MINUTES
+MEMBER_ABSENT_CACHE_MINUTES = 360
+# 每个频道缓存的最近消息数 (None 表示不缓存消息)
+MESSAGE_CACHE_SIZE = 1000
+
 # Cog 模块启用/禁用配置
 # 确保 "core" 和 "at" 都已启用
 COGS = {
@@ -32,4 +42,47 @@ COGS = {
     "at": {
         "enabled": True,
     }
-}
\ No newline at end of file
+}
+
+# 虚拟身份组订阅数据的存储后端
+# "sqlite": 每次订阅/退订只写入一行，服务器数据在首次访问时才读取 (默认，首次启动会自动迁移旧的数据文件)
+# "journal": 每次变更向 data/user_virtual_roles.journal 追加一条记录，定期合并进 data/user_virtual_roles.snap 二进制快照 (服务器数据在首次访问时才解码)
+VIRTUAL_ROLE_STORAGE_BACKEND = "sqlite"
+# journal 后端: 日志文件超过该大小 (字节) 后合并进快照
+VIRTUAL_ROLE_JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+# 成员离开服务器后保留其新闻订阅的小时数，期间重新加入则订阅不受影响
+# (0 表示收到离开事件后立即清理；定期检查发现的离开成员至少要连续两次检查都不在服务器内才会被清理)
+VIRTUAL_ROLE_PRUNE_GRACE_HOURS = 24
+# 定期对照成员缓存清理已离开成员订阅的间隔 (分钟)
+VIRTUAL_ROLE_PRUNE_INTERVAL_MINUTES = 60
+
+# 为每个新闻组维护一个长期存在的隐藏身份组 ("订阅-" 前缀)，订阅变更时增量同步成员，
+# 通知时无需再逐个添加成员。每个新闻组占用一个身份组名额 (服务器上限 250 个)
+VIRTUAL_ROLE_SHADOW_ROLES = False
+# 对照订阅数据全量校正影子身份组成员的间隔 (分钟)
+VIRTUAL_ROLE_SHADOW_SYNC_MINUTES = 30
+
+# 临时身份组通知时，同时为成员添加身份组的请求数 (会根据速率限制响应头自动等待，不会超出限额)
+AT_ROLE_ASSIGN_CONCURRENCY = 8
+# 小规模虚拟组直接在消息中逐个提及成员，最多拆成几条消息 (超过则使用身份组方式通知)
+AT_DIRECT_MENTION_MAX_MESSAGES = 5
+# 直接提及时每条消息最多包含的提及数，应低于服务器 AutoMod "提及过多"规则的阈值 (常见为 20~50)；
+# 消息仍被拦截时，尚未收到提及的成员会改用临时身份组通知，且该服务器 1 小时内不再使用直接提及
+AT_DIRECT_MENTIONS_PER_MESSAGE = 20
+# 同时执行的临时身份组通知任务数 (任务保存在 data/notification_jobs.json，重启后继续)
+AT_NOTIFICATION_WORKERS = 2
+# /子区通知: 最多在内存中维护多少个新闻论坛帖子的成员列表 (由网关事件增量更新)
+AT_THREAD_MEMBER_INDEX_SIZE = 512
+
+# 每日论坛管理任务的默认触发时间，按各服务器 forum_manager_config 中 "timezone" 的本地时间计算
+# (也可以在 forum_manager_config 中用 "daily_task_time" 为单个服务器设置)
+DAILY_TASK_TRIGGER_TIME = "00:00"
+# 每日论坛管理任务: 同时执行的服务器数量，以及单个服务器的超时时间 (秒)
+FORUM_DAILY_TASK_CONCURRENCY = 4
+FORUM_DAILY_TASK_TIMEOUT_SECONDS = 600
+# 批量归档帖子时同时进行的编辑请求数 (会根据速率限制响应头自动等待)
+FORUM_EDIT_CONCURRENCY = 3
+# 所有帖子编辑之间的最小间隔 (秒)。每个帖子是独立的速率限制桶，第一次编辑前没有响应头可以参考，
+# 因此主动保持间隔 (同一帖子另按 5 次 / 5 秒的已知限额保持间隔)
+FORUM_EDIT_MIN_INTERVAL_SECONDS = 0.25